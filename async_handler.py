@@ -0,0 +1,1474 @@
+"""asyncio implementation of the Slack and Kakao conversation path
+
+Configuration, routing, prompt building and message formatting are shared with
+handler.py. Slack, DynamoDB and Bedrock calls run on one event loop through the
+async Bolt app, AsyncWebClient and aiobotocore, so a long-running process can
+serve many conversations at once. Run it as a server with `python async_handler.py`.
+"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import AsyncExitStack
+from contextvars import ContextVar
+from datetime import datetime
+from decimal import Decimal
+from typing import Collection, List, Optional, Dict, Any, Tuple
+
+import aiohttp
+from aiobotocore.session import get_session
+from aiohttp import web
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_client import AsyncWebClient
+from slack_bolt.adapter.aws_lambda.handler import to_aws_response
+from slack_bolt.async_app import AsyncApp, AsyncBoltRequest, AsyncSay
+from slack_bolt.authorization import AuthorizeResult
+from slack_bolt.authorization.async_authorize import AsyncAuthorize
+
+from handler import (
+    Config,
+    ConversationRecord,
+    DynamoDBInstallationStore,
+    DynamoDBManager,
+    EventDeduplicator,
+    EventRouter,
+    MessageFormatter,
+    BedrockManager,
+    RatePacer,
+    RefundBatch,
+    RetrievalCache,
+    CancelToken,
+    SlackImage,
+    ContextPacker,
+    GenerationCancelled,
+    ImageJob,
+    ImageJobError,
+    LexicalIndex,
+    SlackManager,
+    SlackTeam,
+    StageTrace,
+    TeamRegistry,
+    ThreadLease,
+    MSG_PREVIOUS,
+    MSG_RESPONSE,
+    MSG_ERROR,
+    MSG_GENERATE_ERROR,
+    MSG_IMAGE,
+    build_refund_blocks,
+    edited_question,
+    get_env_int,
+    inference_profiles,
+    is_conditional_check_failed,
+    is_refund_message,
+    screen_slack_event,
+    success,
+    unauthorized,
+)
+
+
+class AsyncClients:
+    """Async AWS clients, opened once per process and shared by all requests"""
+
+    def __init__(self):
+        self.dynamodb = None
+        self.bedrock_agent = None
+        self.bedrock_runtime = None
+        self.s3 = None
+        self._stack: Optional[AsyncExitStack] = None
+        self._lock = asyncio.Lock()
+
+    async def open(self) -> "AsyncClients":
+        """Create the DynamoDB, Bedrock Agent Runtime, Bedrock Runtime and S3 clients if not created yet"""
+        async with self._lock:
+            if self.dynamodb is None:
+                session = get_session()
+                self._stack = AsyncExitStack()
+                self.dynamodb = await self._stack.enter_async_context(
+                    session.create_client("dynamodb", region_name=Config.AWS_REGION)
+                )
+                self.bedrock_agent = await self._stack.enter_async_context(
+                    session.create_client("bedrock-agent-runtime", region_name=Config.AWS_REGION)
+                )
+                self.bedrock_runtime = await self._stack.enter_async_context(
+                    session.create_client("bedrock-runtime", region_name=Config.AWS_REGION)
+                )
+                self.s3 = await self._stack.enter_async_context(
+                    session.create_client("s3", region_name=Config.AWS_REGION)
+                )
+        return self
+
+    def use(self, dynamodb: Any, bedrock_agent: Any, bedrock_runtime: Any = None, s3: Any = None) -> None:
+        """Use already created clients, e.g. local stand-ins"""
+        self.dynamodb = dynamodb
+        self.bedrock_agent = bedrock_agent
+        self.bedrock_runtime = bedrock_runtime
+        self.s3 = s3
+
+    async def close(self) -> None:
+        """Close the clients and their connection pools"""
+        if self._stack:
+            await self._stack.aclose()
+            self._stack = None
+        self.dynamodb = None
+        self.bedrock_agent = None
+        self.bedrock_runtime = None
+        self.s3 = None
+
+
+class AsyncTable:
+    """Item level access to the DynamoDB table through the low-level async client"""
+
+    _serializer = TypeSerializer()
+    _deserializer = TypeDeserializer()
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def dump(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert a Python item to DynamoDB attribute values"""
+        return {key: self._serializer.serialize(value) for key, value in item.items()}
+
+    def load(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert DynamoDB attribute values to a Python item"""
+        return {key: self._deserializer.deserialize(value) for key, value in item.items()}
+
+    def _request(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        request = dict(params, TableName=self.name)
+        for name in ("Key", "Item", "ExpressionAttributeValues"):
+            if name in request:
+                request[name] = self.dump(request[name])
+        return request
+
+    def _response(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        for name in ("Item", "Attributes"):
+            if name in response:
+                response[name] = self.load(response[name])
+        return response
+
+    # Same keyword arguments and responses as the boto3 Table resource
+
+    async def get_item(self, **params) -> Dict[str, Any]:
+        return self._response(await clients.dynamodb.get_item(**self._request(params)))
+
+    async def put_item(self, **params) -> Dict[str, Any]:
+        return self._response(await clients.dynamodb.put_item(**self._request(params)))
+
+    async def update_item(self, **params) -> Dict[str, Any]:
+        return self._response(await clients.dynamodb.update_item(**self._request(params)))
+
+    async def delete_item(self, **params) -> Dict[str, Any]:
+        return self._response(await clients.dynamodb.delete_item(**self._request(params)))
+
+    async def count(self, index_name: str, attribute: str, value: Any) -> int:
+        response = await clients.dynamodb.query(
+            TableName=self.name,
+            IndexName=index_name,
+            KeyConditionExpression="#key = :value",
+            ExpressionAttributeNames={"#key": attribute},
+            ExpressionAttributeValues={":value": self._serializer.serialize(value)},
+            Select="COUNT",
+        )
+        return response.get("Count", 0)
+
+
+# Initialize async AWS clients (opened on first use)
+clients = AsyncClients()
+table = AsyncTable(Config.DYNAMODB_TABLE_NAME)
+
+
+class AsyncTeamRegistry(TeamRegistry):
+    """Per-workspace AsyncWebClients, resolved from team_id through an in-container LRU
+
+    Installations are added by the OAuth endpoint of handler.py and read here
+    through the async table.
+    """
+
+    _teams: "OrderedDict[str, SlackTeam]" = OrderedDict()
+    _lock = threading.Lock()
+    _current: ContextVar = ContextVar("async_slack_team", default=None)
+    _default: Optional[SlackTeam] = None
+
+    @staticmethod
+    def new_client(token: str) -> Any:
+        return AsyncWebClient(token=token)
+
+    @classmethod
+    def default(cls) -> SlackTeam:
+        """The single workspace of SLACK_BOT_TOKEN"""
+        if cls._default is None:
+            cls._default = SlackTeam(None, None, False, app.client, None, None)
+        return cls._default
+
+    @classmethod
+    async def aget(cls, enterprise_id: Optional[str], team_id: Optional[str],
+                   is_enterprise_install: bool = False) -> Optional[SlackTeam]:
+        """Return the workspace, or None if the bot is not installed there"""
+        if not Config.is_multi_team():
+            return cls.default()
+
+        key = DynamoDBInstallationStore.key(enterprise_id, team_id, is_enterprise_install)
+        team = cls.cached(key)
+        if team is not None:
+            return team
+
+        response = await table.get_item(Key={"id": key})
+        bot = DynamoDBInstallationStore.bot_from_item(response.get("Item"))
+        if bot is None:
+            print(f"AsyncTeamRegistry: no installation for {key}")
+            return None
+        return cls.cache(key, cls.from_bot(bot))
+
+    @classmethod
+    async def aresolve(cls, body: Dict[str, Any]) -> Optional[SlackTeam]:
+        """Return the workspace a Slack request body came from"""
+        return await cls.aget(*cls.ids(body))
+
+
+class AsyncTeamAuthorize(AsyncAuthorize):
+    """Bolt authorize answered from AsyncTeamRegistry, so warm requests skip DynamoDB"""
+
+    async def __call__(self, *, context: Any, enterprise_id: Optional[str], team_id: Optional[str],
+                       user_id: Optional[str], **kwargs) -> Optional[AuthorizeResult]:
+        team = await AsyncTeamRegistry.aget(enterprise_id, team_id, bool(context.is_enterprise_install))
+        if team is None:
+            return None
+        return AuthorizeResult(
+            enterprise_id=enterprise_id,
+            team_id=team_id,
+            bot_token=team.client.token,
+            bot_user_id=team.bot_user_id,
+            bot_id=team.bot_id,
+        )
+
+
+# Initialize async Slack app, for one workspace or for every workspace that installed it
+if Config.is_multi_team():
+    app = AsyncApp(
+        signing_secret=Config.SLACK_SIGNING_SECRET,
+        process_before_response=True,
+        authorize=AsyncTeamAuthorize(),
+    )
+else:
+    app = AsyncApp(
+        token=Config.SLACK_BOT_TOKEN,
+        signing_secret=Config.SLACK_SIGNING_SECRET,
+        process_before_response=True,
+    )
+
+# Lazy initialization for bot_id to avoid API call at module load time
+async def get_bot_id() -> str:
+    """Get the Slack bot user ID of the current workspace, looked up once per workspace"""
+    team = AsyncTeamRegistry.current()
+    if team.bot_user_id:
+        return team.bot_user_id
+    user_id = (await team.client.auth_test())["user_id"]
+    return AsyncTeamRegistry.with_bot_user_id(team, user_id).bot_user_id
+
+
+def slack_client() -> AsyncWebClient:
+    """Get the Slack client of the workspace the current request came from"""
+    return AsyncTeamRegistry.current().client
+
+
+class AsyncDynamoDBManager:
+    """Handles DynamoDB operations for conversation context"""
+
+    @staticmethod
+    async def has_context(thread_ts: Optional[str], user: str) -> bool:
+        """Check whether a dedup marker exists in DynamoDB"""
+        try:
+            key = {"id": thread_ts or user}
+            return "Item" in await table.get_item(Key=key, ProjectionExpression="id")
+        except Exception as e:
+            print(f"Error retrieving context: {e}")
+            return False
+
+    @staticmethod
+    async def put_context(thread_ts: Optional[str], user: str) -> None:
+        """Store a minimal dedup marker in DynamoDB with TTL"""
+        try:
+            await table.put_item(Item=DynamoDBManager.context_item(thread_ts, user))
+        except Exception as e:
+            print(f"Error storing context: {e}")
+
+    @staticmethod
+    async def claim_event(event_id: str) -> bool:
+        """Record an event id with a conditional write, returning False if it already exists"""
+        try:
+            await table.put_item(
+                Item=DynamoDBManager.event_item(event_id),
+                ConditionExpression="attribute_not_exists(id)",
+            )
+            return True
+        except ClientError as e:
+            if is_conditional_check_failed(e):
+                return False
+            print(f"Error claiming event: {e}")
+            return True
+        except Exception as e:
+            print(f"Error claiming event: {e}")
+            return True
+
+    @staticmethod
+    async def count_user_contexts(user: str) -> int:
+        """Count contexts belonging to a specific user using GSI"""
+        try:
+            return await table.count("user-index", "user", user)
+        except Exception as e:
+            print(f"Error counting contexts: {e}")
+            return 0
+
+
+class AsyncConversationRecord:
+    """Stores complete conversation turns in DynamoDB"""
+
+    @staticmethod
+    async def put(record_id: str, question: str, answer: str, prompt: str,
+                  timings: Dict[str, int], channel: Optional[str] = None,
+                  thread_ts: Optional[str] = None, user_id: Optional[str] = None,
+                  usage: Optional[Dict[str, int]] = None) -> None:
+        """Store a conversation record"""
+        try:
+            await table.put_item(Item=ConversationRecord.build_item(
+                record_id, question, answer, prompt, timings, channel, thread_ts, user_id, usage
+            ))
+        except Exception as e:
+            print(f"Error storing conversation record: {e}")
+
+    @staticmethod
+    async def get(record_id: str) -> Optional[Dict[str, Any]]:
+        """Retrieve and decode a conversation record"""
+        try:
+            item = (await table.get_item(Key={"id": f"conv:{record_id}"})).get("Item")
+            return ConversationRecord.decode(item) if item else None
+        except Exception as e:
+            print(f"Error retrieving conversation record: {e}")
+            return None
+
+
+class AsyncThreadLease:
+    """Per-thread lease of ThreadLease, taken and drained through the async table"""
+
+    @staticmethod
+    async def acquire(key: str, message: Dict[str, str]) -> bool:
+        """Take the lease, or append the message to the holder's pending list"""
+        try:
+            for _ in range(3):
+                try:
+                    await table.put_item(**ThreadLease.acquire_params(key, message["client_msg_id"]))
+                    return True
+                except ClientError as e:
+                    if not is_conditional_check_failed(e):
+                        raise
+
+                try:
+                    await table.update_item(**ThreadLease.append_params(key, message))
+                    return False
+                except ClientError as e:
+                    # The lease was released in between; try to take it again
+                    if not is_conditional_check_failed(e):
+                        raise
+        except Exception as e:
+            print(f"Error acquiring thread lease: {e}")
+
+        # Answer on our own rather than dropping the message
+        return True
+
+    @staticmethod
+    async def in_flight(key: str, client_msg_id: str) -> bool:
+        """Check if a message is still debounced or being answered under the lease"""
+        try:
+            return ThreadLease.holds((await table.get_item(Key={"id": key})).get("Item"), client_msg_id)
+        except Exception as e:
+            print(f"Error reading thread lease: {e}")
+            return False
+
+    @staticmethod
+    async def drain(key: str) -> List[Dict[str, str]]:
+        """Take the pending messages and extend the lease"""
+        try:
+            response = await table.update_item(**ThreadLease.drain_params(key))
+            return response.get("Attributes", {}).get("pending", [])
+        except Exception as e:
+            print(f"Error draining thread lease: {e}")
+            return []
+
+    @staticmethod
+    async def release(key: str) -> bool:
+        """Release the lease, returning False if messages arrived in the meantime"""
+        try:
+            await table.delete_item(**ThreadLease.release_params(key))
+            return True
+        except ClientError as e:
+            if is_conditional_check_failed(e):
+                return False
+            print(f"Error releasing thread lease: {e}")
+            return True
+        except Exception as e:
+            print(f"Error releasing thread lease: {e}")
+            return True
+
+
+class AsyncCancelToken(CancelToken):
+    """CancelToken that reads and writes cancel items through the async table"""
+
+    @classmethod
+    async def acancel(cls, client_msg_id: str, version: Any) -> None:
+        """Cancel generations answering versions of a message older than `version`"""
+        version = Decimal(str(version))
+        cls.remember(client_msg_id, version)
+        try:
+            await table.put_item(**cls.cancel_params(client_msg_id, version))
+        except ClientError as e:
+            if not is_conditional_check_failed(e):
+                print(f"Error storing cancel token: {e}")
+        except Exception as e:
+            print(f"Error storing cancel token: {e}")
+
+    async def afetch(self) -> Dict[str, Decimal]:
+        """Read the cancel items of all messages concurrently"""
+        keys = [{"id": f"cancel:{message['client_msg_id']}"} for message in self.messages]
+        try:
+            responses = await asyncio.gather(*(table.get_item(Key=key) for key in keys))
+        except Exception as e:
+            print(f"Error reading cancel tokens: {e}")
+            return {}
+        return {
+            message["client_msg_id"]: Decimal(response["Item"]["version"])
+            for message, response in zip(self.messages, responses) if "Item" in response
+        }
+
+    async def arefresh(self) -> List[Dict[str, str]]:
+        """Read all cancellations now and return the messages that are still current"""
+        self.merge_versions(await self.afetch())
+        return self.remaining()
+
+    async def acheck(self) -> None:
+        """Raise GenerationCancelled if any message was edited or deleted"""
+        self.merge_versions(await self.afetch() if self.due() else {})
+        if len(self.remaining()) < len(self.messages):
+            raise GenerationCancelled()
+
+
+class AsyncSlackManager:
+    """Handles Slack messaging operations"""
+
+    @staticmethod
+    async def get_user_display_name(user_id: str) -> str:
+        """Get user display name from Slack API, sharing the sync path's cache"""
+        cache = SlackManager._user_name_cache
+        if user_id in cache:
+            return cache[user_id]
+
+        try:
+            response = await slack_client().users_info(user=user_id)
+            if response.get("ok"):
+                display_name = SlackManager.display_name(response.get("user", {}), user_id)
+                cache[user_id] = display_name
+                return display_name
+        except Exception as e:
+            print(f"Error fetching user info for {user_id}: {e}")
+
+        return user_id
+
+    @staticmethod
+    async def update_message(say: AsyncSay, channel: str, thread_ts: Optional[str],
+                             latest_ts: str, message: str) -> tuple:
+        """Update existing message and send additional messages if needed"""
+        try:
+            split_messages = MessageFormatter.split_message(message, Config.MAX_LEN_SLACK)
+
+            for i, text in enumerate(split_messages):
+                if i == 0:
+                    # Update the initial message
+                    await slack_client().chat_update(channel=channel, ts=latest_ts, text=text)
+                else:
+                    # Add delay if configured
+                    if Config.SLACK_SAY_INTERVAL > 0:
+                        await asyncio.sleep(Config.SLACK_SAY_INTERVAL)
+
+                    # Send additional messages in thread
+                    result = await say(text=text, thread_ts=thread_ts)
+                    latest_ts = result["ts"]
+
+            return message, latest_ts
+        except Exception as e:
+            print(f"Error updating message: {e}")
+            # Update with error message
+            await slack_client().chat_update(channel=channel, ts=latest_ts, text=MSG_ERROR)
+            return MSG_ERROR, latest_ts
+
+    @staticmethod
+    async def get_thread_history(channel: str, thread_ts: str, exclude_ids: Collection[str]) -> List[str]:
+        """Retrieve conversation history from a Slack thread"""
+        try:
+            response = await slack_client().conversations_replies(channel=channel, ts=thread_ts)
+
+            if not response.get("ok"):
+                print("Failed to retrieve thread messages")
+                return []
+
+            return SlackManager.format_thread_history(response.get("messages", []), exclude_ids)
+
+        except Exception as e:
+            print(f"Error retrieving thread history: {e}")
+            return []
+
+    @staticmethod
+    async def download_image(session: aiohttp.ClientSession, file: Dict[str, str]) -> bytes:
+        """Stream a file from Slack, stopping at IMAGE_DOWNLOAD_LIMIT bytes"""
+        headers = {"Authorization": f"Bearer {slack_client().token}"}
+        async with session.get(file["url"], headers=headers) as response:
+            response.raise_for_status()
+            SlackImage.check_response(response.headers.get("Content-Type", ""))
+            data = bytearray()
+            async for chunk in response.content.iter_chunked(65536):
+                data += chunk
+                if len(data) > Config.IMAGE_DOWNLOAD_LIMIT:
+                    raise ValueError(f"Image larger than {Config.IMAGE_DOWNLOAD_LIMIT} bytes")
+            return bytes(data)
+
+    @classmethod
+    async def load_images(cls, files: List[Dict[str, str]]) -> List[Tuple[str, bytes]]:
+        """Return the encoded images of the files, downloaded concurrently and encoded off the loop"""
+        async def load(session: aiohttp.ClientSession, file: Dict[str, str]) -> Optional[Tuple[str, bytes]]:
+            image = SlackImage.get(file["id"])
+            if image is None:
+                try:
+                    data = await cls.download_image(session, file)
+                    image = await asyncio.to_thread(SlackImage.encode, data)
+                except Exception as e:
+                    print(f"Error loading image {file['id']}: {e}")
+                    return None
+                if image is None:
+                    print(f"Skipping image {file['id']}: unsupported or too large")
+                    return None
+                SlackImage.put(file["id"], image)
+            return image
+
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            images = await asyncio.gather(*(load(session, file) for file in files))
+        return [image for image in images if image]
+
+
+class AsyncStatusUpdater:
+    """Posts the cursor and status updates of a conversation in order
+
+    Each Slack write is a task that awaits the previous one, so writes stay ordered
+    without blocking the conversation. Status updates that start after the final
+    answer is queued are skipped.
+    """
+
+    def __init__(self, say: AsyncSay, channel: Optional[str], thread_ts: Optional[str],
+                 trace: StageTrace):
+        self.say = say
+        self.channel = channel
+        self.thread_ts = thread_ts
+        self.trace = trace
+        self.latest_ts: Optional[str] = None
+        self._final = False
+        self._tail: Optional[asyncio.Task] = None
+
+    def post(self, text: str) -> asyncio.Task:
+        """Post the initial status message"""
+        return self._enqueue("post_cursor", self._post, text)
+
+    def update(self, text: str, stage: str = "status") -> asyncio.Task:
+        """Queue a status update, skipped if the final answer is already queued"""
+        return self._enqueue(stage, self._update, text, False)
+
+    def finish(self, text: str) -> asyncio.Task:
+        """Queue the final answer"""
+        self._final = True
+        return self._enqueue("final_update", self._update, text, True)
+
+    def discard(self) -> asyncio.Task:
+        """Queue removal of the status message of a cancelled conversation"""
+        self._final = True
+        return self._enqueue("discard", self._delete)
+
+    async def close(self) -> None:
+        """Wait for all queued Slack writes to complete"""
+        if self._tail:
+            await self._tail
+
+    def _enqueue(self, stage: str, func, *args) -> asyncio.Task:
+        previous = self._tail
+
+        async def run() -> None:
+            if previous:
+                await previous
+            await self.trace.arun(stage, func(*args))
+
+        self._tail = asyncio.create_task(run())
+        return self._tail
+
+    async def _post(self, text: str) -> None:
+        try:
+            result = await self.say(text=text, thread_ts=self.thread_ts)
+            self.latest_ts = result["ts"]
+        except Exception as e:
+            print(f"Error posting status message: {e}")
+
+    async def _update(self, text: str, final: bool) -> None:
+        if not self.latest_ts or (self._final and not final):
+            return
+        _, self.latest_ts = await AsyncSlackManager.update_message(
+            self.say, self.channel, self.thread_ts, self.latest_ts, text
+        )
+
+    async def _delete(self) -> None:
+        if not self.latest_ts:
+            return
+        try:
+            await slack_client().chat_delete(channel=self.channel, ts=self.latest_ts)
+        except Exception as e:
+            print(f"Error deleting status message: {e}")
+
+
+class AsyncBedrockManager:
+    """Handles Amazon Bedrock operations"""
+
+    @staticmethod
+    async def invoke_knowledge_base(query: str, channel: Optional[str] = None) -> List[str]:
+        """Retrieve relevant passages from the lexical index and the Bedrock Knowledge Bases"""
+        candidates, coverage = LexicalIndex.lookup(query)
+        if not LexicalIndex.is_sufficient(candidates, coverage, Config.knowledge_base_ids(channel)):
+            candidates = LexicalIndex.merge(
+                candidates, await AsyncBedrockManager.retrieve_knowledge_bases(query, channel)
+            )
+        return ContextPacker.pack(query, candidates)
+
+    @staticmethod
+    async def retrieve_knowledge_bases(query: str, channel: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Retrieve every query variant from every Knowledge Base of the channel at once"""
+        requests = BedrockManager.retrieval_requests(query, channel)
+        if not requests:
+            return []
+
+        scopes = RetrievalCache.expired_scopes([kb_id for kb_id, _ in requests])
+        items = await asyncio.gather(
+            *(table.get_item(**RetrievalCache.marker_params(scope)) for scope in scopes), return_exceptions=True
+        )
+        for scope, response in zip(scopes, items):
+            if isinstance(response, Exception):
+                print(f"Error reading knowledge base version of {scope}: {response}")
+            else:
+                RetrievalCache.set_version(scope, response.get("Item"))
+
+        rankings, tasks = {}, {}
+        for kb_id, variant in requests:
+            passages = RetrievalCache.get(variant, kb_id)
+            if passages is not None:
+                rankings[(kb_id, variant)] = passages
+            else:
+                task = asyncio.create_task(AsyncBedrockManager.retrieve_knowledge_base(variant, kb_id))
+                tasks[task] = (kb_id, variant)
+
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=Config.KB_RETRIEVE_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            for task in done:
+                rankings[tasks[task]] = task.result()
+        return BedrockManager.fuse_rankings(requests, rankings)
+
+    @staticmethod
+    async def retrieve_knowledge_base(query: str, knowledge_base_id: str) -> List[Tuple[str, float]]:
+        """Retrieve relevant passages from one Bedrock Knowledge Base"""
+        try:
+            response = await clients.bedrock_agent.retrieve(
+                **BedrockManager.retrieve_params(query, knowledge_base_id)
+            )
+            passages = BedrockManager.knowledge_passages(response)
+        except Exception as e:
+            print(f"Error retrieving from knowledge base {knowledge_base_id}: {e}")
+            return []
+
+        RetrievalCache.put(query, passages, knowledge_base_id)
+        return passages
+
+    @staticmethod
+    async def invoke_agent(prompt: str, cancel: Optional[AsyncCancelToken] = None) -> str:
+        """Invoke Amazon Bedrock Agent with prompt and return response
+
+        With a cancel token, the stream is checked between chunks and closed
+        with GenerationCancelled once the question is edited or deleted.
+        """
+        try:
+            # Create a unique session ID
+            now = datetime.now()
+            session_id = str(int(now.timestamp() * 1000))
+
+            # Call Bedrock Agent
+            response = await clients.bedrock_agent.invoke_agent(
+                agentId=Config.AGENT_ID,
+                agentAliasId=Config.AGENT_ALIAS_ID,
+                sessionId=session_id,
+                inputText=prompt,
+            )
+
+            # Process streaming response
+            completion = ""
+            stream = response.get("completion")
+            try:
+                async for event in stream:
+                    if cancel:
+                        await cancel.acheck()
+                    chunk = event["chunk"]
+                    completion += chunk["bytes"].decode()
+            except GenerationCancelled:
+                stream.close()
+                raise
+
+            return completion
+
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            print(f"Error invoking Bedrock Agent: {e}")
+            return MSG_GENERATE_ERROR.format(type(e).__name__)
+
+    @staticmethod
+    async def converse(request: Dict[str, Any],
+                       cancel: Optional[AsyncCancelToken] = None) -> Tuple[str, Dict[str, int]]:
+        """Generate an answer with ConverseStream through the model's inference profile"""
+        try:
+            model_id = request["modelId"]
+            # Only the first request of the process calls the control plane, on a worker thread
+            arn = BedrockManager.cached_profile(model_id) or await asyncio.to_thread(
+                BedrockManager.inference_profile, model_id
+            )
+            try:
+                response = await clients.bedrock_runtime.converse_stream(**dict(request, modelId=arn))
+            except Exception as e:
+                if arn == model_id or not inference_profiles.is_stale(e):
+                    raise
+                # The stored profile was deleted, resolve it again and retry once
+                await asyncio.to_thread(inference_profiles.invalidate, arn)
+                response = await clients.bedrock_runtime.converse_stream(
+                    **dict(request, modelId=await asyncio.to_thread(BedrockManager.inference_profile, model_id))
+                )
+
+            # Process streaming response, the usage arrives in the last event
+            completion = ""
+            usage: Dict[str, int] = {}
+            stream = response.get("stream")
+            try:
+                async for event in stream:
+                    if cancel:
+                        await cancel.acheck()
+                    if "contentBlockDelta" in event:
+                        completion += event["contentBlockDelta"]["delta"].get("text", "")
+                    elif "metadata" in event:
+                        usage = BedrockManager.token_usage(event["metadata"].get("usage", {}))
+            except GenerationCancelled:
+                stream.close()
+                raise
+
+            print(f"converse: usage: {usage}")
+            return completion, usage
+
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            print(f"Error invoking Bedrock Converse: {e}")
+            return MSG_GENERATE_ERROR.format(type(e).__name__), {}
+
+    @classmethod
+    async def generate(cls, query: str, prompt: str, cancel: Optional[AsyncCancelToken] = None,
+                       images: Optional[List[Tuple[str, bytes]]] = None,
+                       **inputs: Any) -> Tuple[str, Dict[str, int]]:
+        """Answer with ConverseStream when MODEL_ID is set, otherwise with the Bedrock Agent"""
+        if Config.MODEL_ID == "None":
+            return await cls.invoke_agent(prompt, cancel), {}
+        return await cls.converse(BedrockManager.converse_request(query, images=images, **inputs), cancel)
+
+
+class AsyncImageJob(ImageJob):
+    """Image generation command, run as a task next to the conversations
+
+    The process is long-running, so the job needs no separate function: it is
+    scheduled on the event loop and the event handler returns right away.
+    """
+
+    # Running jobs, referenced until done so they are not garbage collected
+    _tasks: set = set()
+
+    @classmethod
+    async def astart(cls, say: AsyncSay, text: str, channel: str, thread_ts: Optional[str], user_id: str) -> None:
+        """Answer a command with a status message and start the generation in the background"""
+        try:
+            job = cls.parse(text)
+        except ImageJobError as e:
+            await say(text=str(e), thread_ts=thread_ts)
+            return
+
+        result = await say(text=MSG_IMAGE, thread_ts=thread_ts)
+        team = AsyncTeamRegistry.current()
+        job.update(
+            channel=channel, thread_ts=thread_ts, user=user_id, status_ts=result["ts"],
+            enterprise_id=team.enterprise_id, team_id=team.team_id,
+            is_enterprise_install=team.is_enterprise_install,
+        )
+        print(f"AsyncImageJob: {job}")
+
+        task = asyncio.create_task(cls.arun(job))
+        cls._tasks.add(task)
+        task.add_done_callback(cls._tasks.discard)
+
+    @staticmethod
+    async def acached(key: str) -> Optional[bytes]:
+        """Return a previously generated image from S3, or None"""
+        if Config.IMAGE_BUCKET_NAME == "None":
+            return None
+        try:
+            response = await clients.s3.get_object(Bucket=Config.IMAGE_BUCKET_NAME, Key=key)
+            async with response["Body"] as body:
+                return await body.read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                print(f"Error reading cached image {key}: {e}")
+            return None
+
+    @staticmethod
+    async def astore(key: str, data: bytes, job: Dict[str, Any]) -> None:
+        """Keep a generated image in S3"""
+        if Config.IMAGE_BUCKET_NAME == "None":
+            return
+        try:
+            await clients.s3.put_object(
+                Bucket=Config.IMAGE_BUCKET_NAME, Key=key, Body=data, ContentType="image/png",
+                Metadata={"seed": str(job["seed"]), "style": job["style"]},
+            )
+        except Exception as e:
+            print(f"Error caching image {key}: {e}")
+
+    @classmethod
+    async def ainvoke_model(cls, job: Dict[str, Any]) -> bytes:
+        """Generate an image with IMAGE_MODEL_ID"""
+        response = await clients.bedrock_runtime.invoke_model(**cls.model_request(job))
+        async with response["body"] as body:
+            return cls.image_bytes(json.loads(await body.read()))
+
+    @classmethod
+    async def arun(cls, job: Dict[str, Any]) -> bool:
+        """Generate or fetch the image, upload it to the thread and remove the status message"""
+        trace = StageTrace("async_image_job")
+        store_task = None
+        try:
+            key = cls.cache_key(job)
+            data = await trace.arun("cache", cls.acached(key))
+            if data is None:
+                data = await trace.arun("generate", cls.ainvoke_model(job))
+                # Stored while the image is uploaded
+                store_task = asyncio.create_task(trace.arun("store", cls.astore(key, data, job)))
+            await trace.arun("upload", slack_client().files_upload_v2(**cls.upload_params(job, data)))
+            await slack_client().chat_delete(channel=job["channel"], ts=job["status_ts"])
+            return True
+
+        except Exception as e:
+            print(f"Error in image job: {e}")
+            text = str(e) if isinstance(e, ImageJobError) else MSG_ERROR
+            try:
+                await slack_client().chat_update(channel=job["channel"], ts=job["status_ts"], text=text)
+            except Exception as update_error:
+                print(f"Error updating image status: {update_error}")
+            return False
+
+        finally:
+            if store_task:
+                await store_task
+            print(trace.report())
+
+
+async def conversation(say: AsyncSay, query: str, thread_ts: Optional[str] = None,
+                       channel: Optional[str] = None, client_msg_id: Optional[str] = None,
+                       user_id: Optional[str] = None, exclude_ids: Optional[List[str]] = None,
+                       cancel: Optional[AsyncCancelToken] = None,
+                       files: Optional[List[Dict[str, str]]] = None) -> bool:
+    """Main conversation handler that processes queries and returns AI responses
+
+    Same stages as the sync conversation, run as tasks on the event loop instead of
+    worker threads. Returns False if the cancel token fired.
+    """
+    print(f"conversation: query: {query}, user_id: {user_id}")
+
+    trace = StageTrace("async_conversation")
+    status = AsyncStatusUpdater(say, channel, thread_ts, trace)
+    record_task = None
+    answered = True
+
+    try:
+        # Send initial status message
+        status.post(Config.BOT_CURSOR)
+
+        # Start the independent I/O stages
+        history_task = None
+        if thread_ts and channel and client_msg_id:
+            status.update(MSG_PREVIOUS, "status_previous")
+            history_task = asyncio.create_task(trace.arun(
+                "history", AsyncSlackManager.get_thread_history(channel, thread_ts, exclude_ids or [client_msg_id])
+            ))
+
+        user_task = None
+        if user_id:
+            user_task = asyncio.create_task(trace.arun(
+                "user", AsyncSlackManager.get_user_display_name(user_id)
+            ))
+
+        knowledge_task = None
+        if Config.has_retrieval():
+            knowledge_task = asyncio.create_task(trace.arun(
+                "retrieve", AsyncBedrockManager.invoke_knowledge_base(query, channel)
+            ))
+
+        images_task = None
+        if files and Config.MODEL_ID != "None":
+            images_task = asyncio.create_task(trace.arun("images", AsyncSlackManager.load_images(files)))
+        elif files:
+            print("conversation: images are only answered with MODEL_ID (Converse), ignoring them")
+
+        # Create prompt with context and query
+        inputs = {
+            "contexts": await history_task if history_task else None,
+            "knowledge": await knowledge_task if knowledge_task else None,
+            "user_id": user_id,
+            "user_name": await user_task if user_task else None,
+        }
+        prompt = BedrockManager.create_prompt(query, **inputs)
+
+        # Update status while waiting for response
+        status.update(MSG_RESPONSE, "status_response")
+
+        # Get response from AI
+        images = await images_task if images_task else None
+        message, usage = await trace.arun(
+            "generate", AsyncBedrockManager.generate(query, prompt, cancel, images, **inputs)
+        )
+
+        # Send final response
+        status.finish(message)
+
+        # Store the complete turn while the final response is posted
+        record_id = client_msg_id or f"{channel}:{int(time.time() * 1000)}"
+        record_task = asyncio.create_task(trace.arun("record", AsyncConversationRecord.put(
+            record_id, query, message, prompt, trace.elapsed_ms(), channel, thread_ts, user_id, usage
+        )))
+
+    except GenerationCancelled:
+        print("conversation: cancelled, the question was edited or deleted")
+        status.discard()
+        answered = False
+
+    except Exception as e:
+        print(f"Error in conversation handler: {e}")
+        # Update with error message if possible
+        status.finish(MSG_ERROR)
+
+    finally:
+        await status.close()
+        if record_task:
+            await record_task
+        print(trace.report())
+
+    return answered
+
+
+async def coalesced_conversation(say: AsyncSay, lease_key: str, message: Dict[str, str],
+                                 thread_ts: Optional[str], channel: str) -> None:
+    """Answer a message, merging in messages that arrive while it is pending"""
+    if not await AsyncThreadLease.acquire(lease_key, message):
+        print(f"coalesced_conversation: {message['client_msg_id']} queued on {lease_key}")
+        return
+
+    messages = [message]
+    while True:
+        # Let the rest of a burst arrive before answering
+        if Config.THREAD_DEBOUNCE_SECONDS > 0:
+            await asyncio.sleep(Config.THREAD_DEBOUNCE_SECONDS)
+
+        # Drop messages edited or deleted while they were pending
+        cancel = AsyncCancelToken(messages + await AsyncThreadLease.drain(lease_key))
+        messages = await cancel.arefresh()
+
+        if messages:
+            first = min(messages, key=lambda m: m.get("ts", ""))
+            if len(messages) > 1:
+                print(f"coalesced_conversation: {len(messages)} messages merged")
+            answered = await conversation(
+                say, ThreadLease.merge(messages), thread_ts, channel,
+                first["client_msg_id"], first["user"],
+                exclude_ids=[m["client_msg_id"] for m in messages], cancel=cancel,
+                files=ThreadLease.files(messages),
+            )
+            # Messages still current after a cancellation are answered in the next round
+            messages = [] if answered else cancel.remaining()
+
+        # Messages that arrived during generation get another round
+        if not messages and await AsyncThreadLease.release(lease_key):
+            return
+
+
+@app.event("app_mention")
+async def handle_mention(body: Dict[str, Any], say: AsyncSay) -> None:
+    """Handle mentions of the bot in channels"""
+    print(f"handle_mention: {body}")
+
+    event = body["event"]
+    thread_ts = event.get("thread_ts", event.get("ts"))
+    channel = event.get("channel")
+    user_id = event.get("user")
+
+    # Check if the channel is allowed
+    if Config.ALLOWED_CHANNEL_SET:
+        if channel not in Config.ALLOWED_CHANNEL_SET:
+            first_channel = f"<#{Config.ALLOWED_CHANNEL_LIST[0]}>"
+            message = Config.ALLOWED_CHANNEL_MESSAGE.format(first_channel)
+            await say(text=message, thread_ts=thread_ts)
+            print(f"handle_mention: {message}")
+            return
+
+    # Extract query text (remove the bot mention)
+    prompt = re.sub(f"<@{await get_bot_id()}>", "", event.get("text", "")).strip()
+
+    if ImageJob.is_command(prompt):
+        await AsyncImageJob.astart(say, prompt, channel, thread_ts, user_id)
+        return
+
+    # Process the conversation, merged with quick follow-up messages in the thread
+    lease_key = ThreadLease.key(channel, event.get("thread_ts"), user_id)
+    await coalesced_conversation(say, lease_key, ThreadLease.message(event, prompt), thread_ts, channel)
+
+
+async def handle_message_edit(event: Dict[str, Any], say: AsyncSay) -> None:
+    """Cancel generations for an edited or deleted question and requeue it if still in flight"""
+    if event.get("subtype") == "message_deleted":
+        previous = event["previous_message"]
+        print(f"handle_message_edit: {previous['client_msg_id']} deleted")
+        await AsyncCancelToken.acancel(previous["client_msg_id"], CancelToken.DELETED_VERSION)
+        return
+
+    message = event["message"]
+    version = message.get("edited", {}).get("ts") or event.get("event_ts", "0")
+    print(f"handle_message_edit: {message['client_msg_id']} edited at {version}")
+    await AsyncCancelToken.acancel(message["client_msg_id"], version)
+
+    question = edited_question(event, await get_bot_id())
+    if question and ImageJob.is_command(question[1]["text"]):
+        print("handle_message_edit: image commands are not run again on edit")
+    elif question:
+        lease_key, pending, thread_ts = question
+        if ThreadLease.recent(message) or await AsyncThreadLease.in_flight(lease_key, pending["client_msg_id"]):
+            await coalesced_conversation(say, lease_key, pending, thread_ts, event["channel"])
+        else:
+            print(f"handle_message_edit: {pending['client_msg_id']} was already answered, ignoring the edit")
+
+
+@app.event("message")
+async def handle_message(body: Dict[str, Any], say: AsyncSay) -> None:
+    """Handle direct messages to the bot, and edits or deletes of questions"""
+    print(f"handle_message: {body}")
+
+    event = body["event"]
+
+    # Ignore messages from bots (including this bot)
+    if event.get("bot_id"):
+        return
+
+    if event.get("subtype") in EventRouter.EDIT_SUBTYPES:
+        await handle_message_edit(event, say)
+        return
+
+    channel = event["channel"]
+    user_id = event.get("user")
+    prompt = event.get("text", "").strip()
+
+    if ImageJob.is_command(prompt):
+        await AsyncImageJob.astart(say, prompt, channel, None, user_id)
+        return
+
+    # Process the conversation (thread_ts=None for DMs), merged with quick follow-ups
+    lease_key = ThreadLease.key(channel, None, user_id)
+    await coalesced_conversation(say, lease_key, ThreadLease.message(event, prompt), None, channel)
+
+
+async def process_refund_done(channel: str, message_ts: str, user: str) -> None:
+    """Process refund-done emoji reaction: mask account number and add refund timestamp"""
+    print(f"process_refund_done: channel={channel}, message_ts={message_ts}, user={user}")
+
+    try:
+        # Get the original message
+        result = await slack_client().conversations_history(
+            channel=channel,
+            latest=message_ts,
+            limit=1,
+            inclusive=True
+        )
+
+        if not result.get("ok") or not result.get("messages"):
+            print("Failed to retrieve message")
+            return
+
+        message = result["messages"][0]
+        blocks = message.get("blocks", [])
+
+        if not blocks:
+            print("No blocks found in message")
+            return
+
+        if not is_refund_message(blocks):
+            print("Not a refund request message")
+            return
+
+        # Update the message
+        await slack_client().chat_update(
+            channel=channel,
+            ts=message_ts,
+            blocks=build_refund_blocks(blocks),
+            text=message.get("text", "환불 신청이 처리되었습니다.")
+        )
+
+        print("Refund message updated successfully")
+
+    except Exception as e:
+        print(f"Error processing refund done: {e}")
+
+
+class AsyncRefundBatch(RefundBatch):
+    """RefundBatch with the history scan and paced updates on the event loop"""
+
+    @classmethod
+    async def acall(cls, method, **kwargs) -> Any:
+        """Call an async Slack Web API method, waiting out rate limits"""
+        for attempt in range(cls.RATE_LIMIT_RETRIES + 1):
+            try:
+                return await method(**kwargs)
+            except SlackApiError as e:
+                if e.response.status_code != 429 or attempt == cls.RATE_LIMIT_RETRIES:
+                    raise
+                delay = int(e.response.headers.get("Retry-After", 1))
+                print(f"RefundBatch: rate limited, retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+    @classmethod
+    async def ascan(cls, channel: str, oldest: str, latest: str) -> Tuple[List[Dict[str, Any]], int]:
+        """Collect refund request messages in the range, along with the number of messages read"""
+        requests = []
+        scanned = 0
+        cursor = None
+        while True:
+            params = {"channel": channel, "oldest": oldest, "latest": latest,
+                      "inclusive": True, "limit": cls.PAGE_SIZE}
+            if cursor:
+                params["cursor"] = cursor
+            result = await cls.acall(slack_client().conversations_history, **params)
+
+            messages = result.get("messages") or []
+            scanned += len(messages)
+            requests.extend(m for m in messages if is_refund_message(m.get("blocks") or []))
+
+            cursor = (result.get("response_metadata") or {}).get("next_cursor")
+            if not result.get("has_more") or not cursor:
+                return requests, scanned
+
+    @classmethod
+    async def aupdate(cls, channel: str, message: Dict[str, Any], pacer: RatePacer,
+                      deadline: float) -> Optional[bool]:
+        """Update one refund request; None if it was left for the next run"""
+        delay = pacer.reserve(deadline)
+        if delay is None:
+            return None
+        await asyncio.sleep(delay)
+        try:
+            await cls.acall(
+                slack_client().chat_update,
+                channel=channel,
+                ts=message["ts"],
+                blocks=build_refund_blocks(message["blocks"]),
+                text=message.get("text", "환불 신청이 처리되었습니다."),
+            )
+            return True
+        except Exception as e:
+            print(f"Error updating refund message {message['ts']}: {e}")
+            return False
+
+    @classmethod
+    async def arun(cls, channel: str, oldest: str, latest: str,
+                   budget: Optional[float] = None) -> Dict[str, Any]:
+        """Scan the range and update every open refund request, returning a report"""
+        started = time.monotonic()
+        deadline = started + (Config.REFUND_BATCH_BUDGET if budget is None else budget)
+
+        requests, scanned = await cls.ascan(channel, oldest, latest)
+        todo = [m for m in requests if not cls.is_processed(m["blocks"])]
+
+        pacer = RatePacer(Config.REFUND_BATCH_RATE)
+        results = await asyncio.gather(*(cls.aupdate(channel, m, pacer, deadline) for m in todo))
+
+        report = {
+            "channel": channel,
+            "oldest": oldest,
+            "latest": latest,
+            "scanned": scanned,
+            "requests": len(requests),
+            "already_done": len(requests) - len(todo),
+            "updated": [],
+            "failed": [],
+            "pending": [],
+        }
+        for message, result in zip(todo, results):
+            key = "pending" if result is None else "updated" if result else "failed"
+            report[key].append(message["ts"])
+        report["elapsed_ms"] = int((time.monotonic() - started) * 1000)
+
+        print(f"RefundBatch: {json.dumps(report)}")
+        return report
+
+
+async def process_refund_batch(channel: str, message_ts: str, user: str) -> None:
+    """Process refund-done-all emoji reaction: handle open refund requests up to the reacted message"""
+    print(f"process_refund_batch: channel={channel}, message_ts={message_ts}, user={user}")
+
+    try:
+        oldest, latest = AsyncRefundBatch.time_range(message_ts)
+        report = await AsyncRefundBatch.arun(channel, oldest, latest)
+        await slack_client().chat_postMessage(
+            channel=channel,
+            thread_ts=message_ts,
+            text=AsyncRefundBatch.format_report(report),
+        )
+    except Exception as e:
+        print(f"Error processing refund batch: {e}")
+
+
+# Reaction handlers mapping: emoji name -> async handler function
+REACTION_HANDLERS = {
+    "refund-done": process_refund_done,
+    "refund-done-all": process_refund_batch,
+}
+
+
+@app.event("reaction_added")
+async def handle_reaction_added(body: Dict[str, Any]) -> None:
+    """Handle emoji reaction added events (already filtered by EventRouter)"""
+    print(f"handle_reaction_added: {body}")
+
+    event = body["event"]
+    reaction = event.get("reaction", "")
+    item = event.get("item", {})
+
+    # Dispatch to the appropriate handler
+    handler = REACTION_HANDLERS.get(reaction)
+    if handler:
+        await handler(item.get("channel", ""), item.get("ts", ""), event.get("user", ""))
+    else:
+        print(f"No handler found for reaction: {reaction}")
+
+
+async def handle_uninstall(body: Dict[str, Any]) -> None:
+    """Remove the installation of a workspace that uninstalled the app or revoked its bot token"""
+    event = body["event"]
+    if event["type"] == "tokens_revoked" and not event.get("tokens", {}).get("bot"):
+        return
+
+    key = DynamoDBInstallationStore.key(*AsyncTeamRegistry.ids(body))
+    print(f"handle_uninstall: {key}")
+    await table.delete_item(Key={"id": key})
+    AsyncTeamRegistry.evict(key)
+
+
+# Installations are only kept with OAuth
+if Config.is_multi_team():
+    app.event("app_uninstalled")(handle_uninstall)
+    app.event("tokens_revoked")(handle_uninstall)
+
+
+async def dispatch(body: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """Dispatch an already parsed and verified Slack request to the async Bolt app"""
+    # Socket mode accepts the parsed body and skips the signature check already done
+    bolt_request = AsyncBoltRequest(
+        body=body,
+        query=event.get("queryStringParameters"),
+        headers=event.get("headers") or {},
+        mode="socket_mode",
+    )
+
+    # Listeners act for the workspace of the event; Bolt answers uninstalled ones itself
+    with AsyncTeamRegistry.using(await AsyncTeamRegistry.aresolve(body)):
+        return to_aws_response(await app.async_dispatch(bolt_request))
+
+
+# Conversations still running after their Slack request was acknowledged
+_background: set = set()
+
+
+async def dispatch_quietly(body: Dict[str, Any], event: Dict[str, Any]) -> None:
+    """Dispatch a Slack request whose response has already been sent"""
+    try:
+        await dispatch(body, event)
+    except Exception as e:
+        print(f"dispatch_quietly: error handling event: {e}")
+
+
+def dispatch_in_background(body: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """Acknowledge a Slack request now and answer it after the debounce window on the loop"""
+    task = asyncio.create_task(dispatch_quietly(body, event))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return success()
+
+
+async def wait_background() -> None:
+    """Wait for conversations acknowledged before they finished"""
+    while _background:
+        await asyncio.gather(*_background)
+
+
+async def lambda_handler(event: Dict[str, Any], context: Any = None) -> Dict[str, Any]:
+    """Handle an API Gateway style Slack request on the event loop"""
+    response, body, route = screen_slack_event(event)
+    if response is not None:
+        return response
+
+    await clients.open()
+
+    # Mentions in other channels only get the allowed channel notice
+    if route == EventRouter.REJECT:
+        return await dispatch(body, event)
+
+    # Reactions, edits and uninstalls have no new client_msg_id, so claim the event_id instead
+    if route in (EventRouter.REACTION, EventRouter.EDIT, EventRouter.UNINSTALL):
+        event_id = body.get("event_id")
+        if event_id and not await AsyncDynamoDBManager.claim_event(event_id):
+            print("lambda_handler: duplicate event_id detected")
+            return success()
+        # Edits requeue the question, so they wait out the debounce window like new messages
+        if route == EventRouter.EDIT:
+            return dispatch_in_background(body, event)
+        return await dispatch(body, event)
+
+    # Extract message identifiers
+    token = ThreadLease.message_id(body["event"])
+    user = body["event"]["user"]
+
+    # Check for duplicate events (idempotency)
+    if EventDeduplicator.is_duplicate(token) or await AsyncDynamoDBManager.has_context(token, user):
+        print("lambda_handler: duplicate event detected")
+        return success()
+
+    # Check user throttling
+    count = await AsyncDynamoDBManager.count_user_contexts(user)
+    if count >= Config.MAX_THROTTLE_COUNT:
+        print(f"lambda_handler: throttle limit reached: {count} >= {Config.MAX_THROTTLE_COUNT}")
+        return success()
+
+    # Store context to prevent duplicate processing
+    await AsyncDynamoDBManager.put_context(token, user)
+
+    # Answer Slack before the debounce window and generation, so it does not retry
+    return dispatch_in_background(body, event)
+
+
+async def kakao_handler(event: Dict[str, Any], context: Any = None) -> Dict[str, Any]:
+    """Handle Kakao bot events on the event loop"""
+    print(f"kakao_handler: {event}")
+
+    # Validate authentication
+    headers = event.get("headers", {})
+    auth_header = headers.get("Authorization", "")
+
+    # Check for Authorization header and validate token
+    if not auth_header or auth_header != f"Bearer {Config.KAKAO_BOT_TOKEN}":
+        print("kakao_handler: unauthorized request")
+        return unauthorized()
+
+    # Parse request body
+    try:
+        body = json.loads(event["body"])
+    except Exception as e:
+        print(f"kakao_handler: error parsing body: {e}")
+        return success()
+
+    # Check if query exists
+    if "query" not in body:
+        print("kakao_handler: no query found")
+        return success()
+
+    query = body["query"]
+    print(f"kakao_handler: query: {query}")
+
+    await clients.open()
+
+    # Create prompt and get response
+    try:
+        trace = StageTrace("async_kakao_handler")
+        knowledge = await trace.arun("retrieve", AsyncBedrockManager.invoke_knowledge_base(query))
+        prompt = BedrockManager.create_prompt(query, knowledge=knowledge)
+        message, usage = await trace.arun(
+            "generate", AsyncBedrockManager.generate(query, prompt, knowledge=knowledge)
+        )
+        await AsyncConversationRecord.put(
+            f"kakao:{int(time.time() * 1000)}", query, message, prompt, trace.elapsed_ms(), usage=usage
+        )
+        print(trace.report())
+        return success(message)
+    except Exception as e:
+        print(f"kakao_handler: error processing query: {e}")
+        return success("죄송합니다. 응답을 생성하는 중 오류가 발생했습니다.")
+
+
+async def to_lambda_event(request: web.Request) -> Dict[str, Any]:
+    """Convert an aiohttp request to an API Gateway style event"""
+    return {
+        "httpMethod": request.method,
+        "headers": dict(request.headers),
+        "queryStringParameters": dict(request.query),
+        "body": await request.text(),
+        "isBase64Encoded": False,
+    }
+
+
+def to_web_response(response: Dict[str, Any]) -> web.Response:
+    """Convert an API Gateway style response to an aiohttp response"""
+    return web.Response(
+        status=response["statusCode"],
+        text=response.get("body") or "",
+        headers=response.get("headers") or {},
+    )
+
+
+async def slack_events(request: web.Request) -> web.Response:
+    return to_web_response(await lambda_handler(await to_lambda_event(request)))
+
+
+async def kakao_events(request: web.Request) -> web.Response:
+    return to_web_response(await kakao_handler(await to_lambda_event(request)))
+
+
+async def on_startup(web_app: web.Application) -> None:
+    await clients.open()
+
+
+async def on_cleanup(web_app: web.Application) -> None:
+    await wait_background()
+    await clients.close()
+
+
+def main() -> None:
+    """Serve Slack and Kakao events from a long-running process"""
+    web_app = web.Application()
+    web_app.router.add_post("/slack/events", slack_events)
+    web_app.router.add_post("/kakao/events", kakao_events)
+    web_app.on_startup.append(on_startup)
+    web_app.on_cleanup.append(on_cleanup)
+    web.run_app(web_app, port=get_env_int("PORT", 3000))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,16 @@ import json
 import boto3
 import os
 
+from botocore.exceptions import ClientError
+from inference_profiles import (
+    InferenceProfileRegistry,
+    JsonProfileStore,
+    INFERENCE_PROFILE_CROSS_REGION,
+    INFERENCE_PROFILE_NAME,
+    INFERENCE_PROFILE_STORE,
+    INFERENCE_PROFILE_TAGS,
+)
+
 
 AWS_REGION = os.environ.get("AWS_REGION", "us-east-1")
 
@@ -23,6 +33,9 @@ bedrock = boto3.client(service_name="bedrock", region_name=AWS_REGION)
 
 bedrock_runtime = boto3.client(service_name="bedrock-runtime", region_name=AWS_REGION)
 
+# Resolves the profile once and reuses it, instead of creating one per call
+inference_profiles = InferenceProfileRegistry(bedrock, AWS_REGION, JsonProfileStore(INFERENCE_PROFILE_STORE))
+
 
 def parse_args():
     p = argparse.ArgumentParser(description="invoke_claude_3")
@@ -30,34 +43,14 @@ def parse_args():
     return p.parse_args()
 
 
-def create_inference_profile():
-    profile_name = "gurumi-ai-bot-inference-profile"
-
-    model_arn = "arn:aws:bedrock:{}::foundation-model/{}".format(
-        AWS_REGION, MODEL_ID_TEXT
-    )
-
-    tags = [
-        {"key": "Name", "value": "gurumi-ai-bot"},
-        {"key": "dept", "value": "sre"},
-    ]
-
-    """Create Inference Profile using base model ARN"""
-    response = bedrock.create_inference_profile(
-        inferenceProfileName=profile_name,
-        description="gurumi-ai-bot Inference Profile",
-        modelSource={"copyFrom": model_arn},
-        tags=tags,
-    )
-
-    profile_arn = response["inferenceProfileArn"]
-
-    return profile_arn
-
-
 def converse_stream(prompt):
     try:
-        model_id = create_inference_profile()
+        model_id = inference_profiles.resolve(
+            MODEL_ID_TEXT,
+            INFERENCE_PROFILE_NAME,
+            INFERENCE_PROFILE_TAGS,
+            cross_region=INFERENCE_PROFILE_CROSS_REGION == "Yes",
+        )
 
         messages = [
             {
@@ -66,11 +59,28 @@ def converse_stream(prompt):
             },
         ]
 
-        streaming_response = bedrock_runtime.converse_stream(
-            modelId=model_id,
-            messages=messages,
-            inferenceConfig={"maxTokens": 4096, "temperature": 0.5, "topP": 0.9},
-        )
+        try:
+            streaming_response = bedrock_runtime.converse_stream(
+                modelId=model_id,
+                messages=messages,
+                inferenceConfig={"maxTokens": 4096, "temperature": 0.5, "topP": 0.9},
+            )
+        except ClientError as e:
+            if not inference_profiles.is_stale(e):
+                raise
+            # The stored profile was deleted, resolve it again and retry once
+            inference_profiles.invalidate(model_id)
+            model_id = inference_profiles.resolve(
+                MODEL_ID_TEXT,
+                INFERENCE_PROFILE_NAME,
+                INFERENCE_PROFILE_TAGS,
+                cross_region=INFERENCE_PROFILE_CROSS_REGION == "Yes",
+            )
+            streaming_response = bedrock_runtime.converse_stream(
+                modelId=model_id,
+                messages=messages,
+                inferenceConfig={"maxTokens": 4096, "temperature": 0.5, "topP": 0.9},
+            )
 
         # Extract and print the streamed response text in real-time.
         for chunk in streaming_response["stream"]:
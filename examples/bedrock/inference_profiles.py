@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import boto3
+import os
+import sys
+
+# The registry ships with the function, next to handler.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from profile_registry import InferenceProfileRegistry, JsonProfileStore
+
+
+AWS_REGION = os.environ.get("AWS_REGION", "us-east-1")
+
+MODEL_ID_TEXT = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+
+INFERENCE_PROFILE_NAME = os.environ.get(
+    "INFERENCE_PROFILE_NAME", "gurumi-ai-bot-inference-profile"
+)
+
+# Routes requests over the regions of the geography (us, eu, apac) for more throughput
+INFERENCE_PROFILE_CROSS_REGION = os.environ.get(
+    "INFERENCE_PROFILE_CROSS_REGION", "Yes"
+)
+
+# Resolved ARNs survive restarts here, so only the first run touches the control plane
+INFERENCE_PROFILE_STORE = os.environ.get(
+    "INFERENCE_PROFILE_STORE",
+    os.path.join(os.path.expanduser("~"), ".cache", "gurumi", "inference_profiles.json"),
+)
+
+INFERENCE_PROFILE_TAGS = [
+    {"key": "Name", "value": "gurumi-ai-bot"},
+    {"key": "dept", "value": "sre"},
+]
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="inference_profiles")
+    p.add_argument("-m", "--model", default=MODEL_ID_TEXT, help="foundation model id")
+    p.add_argument("-n", "--name", default=INFERENCE_PROFILE_NAME, help="inference profile name, empty to find one by tags")
+    p.add_argument(
+        "--cross-region",
+        default=INFERENCE_PROFILE_CROSS_REGION == "Yes",
+        action=argparse.BooleanOptionalAction,
+        help="copy from the geography's cross-region inference profile",
+    )
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    bedrock = boto3.client(service_name="bedrock", region_name=AWS_REGION)
+    registry = InferenceProfileRegistry(bedrock, AWS_REGION, JsonProfileStore(INFERENCE_PROFILE_STORE))
+
+    print(registry.resolve(args.model, args.name or None, INFERENCE_PROFILE_TAGS, cross_region=args.cross_region))
+
+
+if __name__ == "__main__":
+    main()
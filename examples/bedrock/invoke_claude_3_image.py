@@ -2,10 +2,18 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import io
 import json
 import boto3
 import base64
 
+from PIL import Image
+
+
+# Larger images are downscaled by the model anyway, so send at most this much
+MAX_EDGE = 1568
+MAX_PIXELS = 1150000
+
 
 def parse_args():
     p = argparse.ArgumentParser(description="invoke_claude_3")
@@ -13,6 +21,35 @@ def parse_args():
     return p.parse_args()
 
 
+def encode_image(path):
+    """
+    Downscales an image to the size the model uses and encodes it as base64.
+
+    :param path: The image file.
+    :return: The media type and the base64 string.
+    """
+    with Image.open(path) as image:
+        image_format = image.format
+        width, height = image.size
+        scale = min(1.0, MAX_EDGE / max(width, height), (MAX_PIXELS / (width * height)) ** 0.5)
+
+        if scale < 1.0 or image_format not in ("JPEG", "PNG", "GIF", "WEBP"):
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            image.draft("RGB", size)
+            image = image.resize(size, Image.LANCZOS)
+
+            # Keep PNG for screenshots and transparency, photos as JPEG
+            image_format = "JPEG" if image_format == "JPEG" else "PNG"
+            output = io.BytesIO()
+            image.convert("RGB" if image_format == "JPEG" else "RGBA").save(output, image_format)
+            data = output.getvalue()
+        else:
+            with open(path, "rb") as file:
+                data = file.read()
+
+    return "image/{}".format(image_format.lower()), base64.b64encode(data).decode("utf8")
+
+
 def invoke_claude_3(prompt):
     """
     Invokes Anthropic Claude 3 Sonnet to run an inference using the input
@@ -31,8 +68,7 @@ def invoke_claude_3(prompt):
     image = "../images/gurumi-bot.png"
 
     # Read reference image from file and encode as base64 strings.
-    with open(image, "rb") as file:
-        encoded_image = base64.b64encode(file.read()).decode("utf8")
+    media_type, encoded_image = encode_image(image)
 
     try:
         body = {
@@ -50,7 +86,7 @@ def invoke_claude_3(prompt):
                             "type": "image",
                             "source": {
                                 "type": "base64",
-                                "media_type": "image/jpeg",
+                                "media_type": media_type,
                                 "data": encoded_image,
                             },
                         },
@@ -5,18 +5,18 @@ import argparse
 import json
 import boto3
 import base64
-import io
-
-from PIL import Image
 
 
 def parse_args():
     p = argparse.ArgumentParser(description="invoke_stable_diffusion")
     p.add_argument("-p", "--prompt", default="Hello", help="prompt", required=True)
+    p.add_argument("-s", "--seed", type=int, default=0, help="seed, 0 for a random one")
+    p.add_argument("--style", default="photographic", help="style preset")
+    p.add_argument("-o", "--output", default="image.png", help="output file")
     return p.parse_args()
 
 
-def invoke_stable_diffusion(prompt, seed=0, style_preset="photographic"):
+def invoke_stable_diffusion(prompt, seed=0, style_preset="photographic", output="image.png"):
     """
     Invokes the Stability.ai Stable Diffusion XL model to create an image using
     the input provided in the request body.
@@ -25,7 +25,7 @@ def invoke_stable_diffusion(prompt, seed=0, style_preset="photographic"):
     :param seed: Random noise seed (omit this option or use 0 for a random seed)
     :param style_preset: Pass in a style preset to guide the image model towards
                           a particular style.
-    :return: Base64-encoded inference response from the model.
+    :param output: The file the PNG is written to.
     """
 
     # Initialize the Amazon Bedrock runtime client
@@ -60,12 +60,14 @@ def invoke_stable_diffusion(prompt, seed=0, style_preset="photographic"):
         # body["artifacts"][0]["base64"] = None
         # print("response: {}".format(body))
 
+        # The artifact already is a PNG, so it is written as it is without decoding the image
         base64_image = body.get("artifacts")[0].get("base64")
-        base64_bytes = base64_image.encode("ascii")
-        image_bytes = base64.b64decode(base64_bytes)
+        image_bytes = base64.b64decode(base64_image)
+
+        with open(output, "wb") as file:
+            file.write(image_bytes)
 
-        image = Image.open(io.BytesIO(image_bytes))
-        image.show()
+        print("{} ({} bytes)".format(output, len(image_bytes)))
 
     except Exception as e:
         print("Error: {}".format(e))
@@ -74,7 +76,7 @@ def invoke_stable_diffusion(prompt, seed=0, style_preset="photographic"):
 def main():
     args = parse_args()
 
-    invoke_stable_diffusion(args.prompt)
+    invoke_stable_diffusion(args.prompt, args.seed, args.style, args.output)
 
 
 if __name__ == "__main__":
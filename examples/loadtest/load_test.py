@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Replay or synthesize Slack and Kakao traffic against the bot in-process.
+
+Signed Slack `app_mention`, `message` and `reaction_added` payloads and Kakao
+query bodies are sent to `handler.lambda_handler` and `handler.kakao_handler`
+at a target QPS, with Slack, DynamoDB and Bedrock replaced by local stand-ins.
+With `--async`, the same traffic is sent to `async_handler` on one event loop.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+
+from slack_sdk.signature import SignatureVerifier
+
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# The handler reads its configuration at import time
+os.environ.setdefault("SLACK_BOT_TOKEN", "xoxb-load-test")
+os.environ.setdefault("SLACK_SIGNING_SECRET", "load-test-signing-secret")
+os.environ.setdefault("KAKAO_BOT_TOKEN", "load-test-kakao-token")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AGENT_ID", "LOADTEST")
+os.environ.setdefault("AGENT_ALIAS_ID", "LOADTEST")
+
+CHANNEL_ID = "C0LOAD"
+DM_CHANNEL_ID = "D0LOAD"
+BOT_USER_ID = "UBOT"
+
+EVENT_KINDS = ("app_mention", "message", "reaction_added", "kakao")
+EDIT_KINDS = ("message_changed", "message_deleted")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="load_test")
+    p.add_argument("--qps", type=float, default=5.0, help="target requests per second")
+    p.add_argument("--duration", type=float, default=30.0, help="test duration in seconds")
+    p.add_argument(
+        "--burstiness",
+        type=float,
+        default=1.0,
+        help="coefficient of variation of inter-arrival times (0 = even, 1 = Poisson, >1 = bursty)",
+    )
+    p.add_argument(
+        "--mix",
+        default="app_mention=0.5,message=0.2,reaction_added=0.1,kakao=0.2",
+        help="traffic mix by event kind",
+    )
+    p.add_argument("--duplicate-ratio", type=float, default=0.05, help="share of events delivered twice")
+    p.add_argument("--retry-ratio", type=float, default=0.1, help="share of events retried by Slack")
+    p.add_argument("--retry-delay", type=float, default=3.0, help="seconds before a Slack retry")
+    p.add_argument(
+        "--burst-ratio",
+        type=float,
+        default=0.2,
+        help="share of questions followed by 1-2 quick follow-up messages from the same user",
+    )
+    p.add_argument(
+        "--edit-ratio",
+        type=float,
+        default=0.05,
+        help="share of questions edited (or, for a third of them, deleted) while being answered",
+    )
+    p.add_argument("--users", type=int, default=20, help="number of distinct users")
+    p.add_argument("--concurrency", type=int, default=50, help="concurrent invocations (containers or in-flight tasks)")
+    p.add_argument("--async", dest="async_mode", action="store_true", help="drive async_handler on one event loop")
+    p.add_argument("--replay", help="JSONL file of Slack event bodies or {\"kakao\": {...}} lines")
+    p.add_argument("--slack-latency", type=float, default=0.05)
+    p.add_argument("--dynamodb-latency", type=float, default=0.01)
+    p.add_argument("--bedrock-latency", type=float, default=1.0)
+    p.add_argument("--model-id", help="answer with ConverseStream and prompt caching instead of the Agent")
+    p.add_argument(
+        "--cache-min-tokens",
+        type=int,
+        help="PROMPT_CACHE_MIN_TOKENS, lower it to cache the short prompts of synthetic traffic",
+    )
+    p.add_argument("--seed", type=int, default=None)
+    p.add_argument("--json", action="store_true", help="print the report as JSON")
+    p.add_argument("--verbose", action="store_true", help="keep the handler's own output")
+    return p.parse_args()
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in EVENT_KINDS:
+            raise ValueError(f"unknown event kind: {kind}")
+        weights[kind] = float(weight)
+    return weights
+
+
+class TrafficFactory:
+    """Builds Slack event bodies and Kakao query bodies."""
+
+    def __init__(self, users, rng):
+        self.users = [f"U{i:05d}" for i in range(users)]
+        self.rng = rng
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _next(self):
+        with self._lock:
+            self.count += 1
+            return self.count, f"{time.time():.6f}"
+
+    def _envelope(self, event):
+        return {
+            "token": "load-test",
+            "team_id": "T0LOAD",
+            "api_app_id": "A0LOAD",
+            "type": "event_callback",
+            "event_id": f"Ev{uuid.uuid4().hex[:12].upper()}",
+            "event_time": int(time.time()),
+            "event": event,
+        }
+
+    def build(self, kind):
+        n, ts = self._next()
+        user = self.rng.choice(self.users)
+
+        if kind == "kakao":
+            return {"query": f"AWSKRUG 소모임 {n} 알려줘"}
+
+        if kind == "reaction_added":
+            return self._envelope({
+                "type": "reaction_added",
+                "user": user,
+                "reaction": "refund-done",
+                "item": {"type": "message", "channel": CHANNEL_ID, "ts": ts},
+                "event_ts": ts,
+            })
+
+        event = {
+            "type": kind,
+            "user": user,
+            "client_msg_id": str(uuid.uuid4()),
+            "ts": ts,
+            "event_ts": ts,
+        }
+        if kind == "app_mention":
+            event.update(channel=CHANNEL_ID, text=f"<@{BOT_USER_ID}> 질문 {n}: Lambda 콜드 스타트 줄이는 방법?")
+            if self.rng.random() < 0.5:
+                event["thread_ts"] = f"{float(ts) - 60:.6f}"
+        else:
+            event.update(channel=DM_CHANNEL_ID, channel_type="im", text=f"질문 {n}: DynamoDB TTL 은 어떻게 동작해?")
+        return self._envelope(event)
+
+    def follow_up(self, body):
+        """A quick follow-up message by the same user in the same thread or DM."""
+        n, ts = self._next()
+        event = dict(body["event"], client_msg_id=str(uuid.uuid4()), ts=ts, event_ts=ts)
+        event["text"] = f"{event['text'].split(':')[0]} 추가 {n}: 예시도 같이 알려줘"
+        return self._envelope(event)
+
+    def edit(self, body, delete=False):
+        """A message_changed or message_deleted event for a question."""
+        _, ts = self._next()
+        original = body["event"]
+        previous = {key: original[key] for key in ("type", "user", "client_msg_id", "ts", "text")}
+        event = {
+            "type": "message",
+            "channel": original["channel"],
+            "channel_type": "im" if original["channel"] == DM_CHANNEL_ID else "channel",
+            "hidden": True,
+            "ts": ts,
+            "event_ts": ts,
+            "previous_message": previous,
+        }
+        if delete:
+            event.update(subtype="message_deleted", deleted_ts=original["ts"])
+        else:
+            message = dict(previous, text=f"{original['text']} (수정)", edited={"user": original["user"], "ts": ts})
+            if "thread_ts" in original:
+                message["thread_ts"] = original["thread_ts"]
+            event.update(subtype="message_changed", message=message)
+        return self._envelope(event)
+
+
+class Request:
+    """One scheduled delivery to the handler."""
+
+    def __init__(self, kind, body, due, retry_num=None, duplicate=False, follow_up=False):
+        self.kind = kind
+        self.body = body
+        self.due = due
+        self.retry_num = retry_num
+        self.duplicate = duplicate
+        self.follow_up = follow_up
+
+
+class LoadTest:
+    def __init__(self, args, handler, counter, table, rng):
+        self.args = args
+        self.handler = handler
+        self.counter = counter
+        self.table = table
+        self.rng = rng
+        self.verifier = SignatureVerifier(os.environ["SLACK_SIGNING_SECRET"])
+        self.results = []
+        self._lock = threading.Lock()
+
+    def api_event(self, request):
+        if request.kind == "kakao":
+            return {
+                "headers": {"Authorization": f"Bearer {os.environ['KAKAO_BOT_TOKEN']}"},
+                "body": json.dumps(request.body),
+            }
+
+        raw_body = json.dumps(request.body)
+        timestamp = str(int(time.time()))
+        headers = {
+            "Content-Type": "application/json",
+            "X-Slack-Request-Timestamp": timestamp,
+            "X-Slack-Signature": self.verifier.generate_signature(timestamp=timestamp, body=raw_body),
+        }
+        if request.retry_num:
+            headers["X-Slack-Retry-Num"] = str(request.retry_num)
+            headers["X-Slack-Retry-Reason"] = "http_timeout"
+        return {
+            "httpMethod": "POST",
+            "requestContext": {"httpMethod": "POST"},
+            "isBase64Encoded": False,
+            "headers": headers,
+            "body": raw_body,
+        }
+
+    def send(self, request):
+        delay = request.due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        event = self.api_event(request)
+        status = 0
+        try:
+            if request.kind == "kakao":
+                status = self.handler.kakao_handler(event, None)["statusCode"]
+            else:
+                status = self.handler.lambda_handler(event, None)["statusCode"]
+        except Exception as e:
+            sys.__stderr__.write(f"load_test: {request.kind} failed: {e}\n")
+        self.record(request, status)
+
+    async def send_async(self, request, semaphore):
+        delay = request.due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        event = self.api_event(request)
+        status = 0
+        async with semaphore:
+            try:
+                if request.kind == "kakao":
+                    status = (await self.handler.kakao_handler(event, None))["statusCode"]
+                else:
+                    status = (await self.handler.lambda_handler(event, None))["statusCode"]
+            except Exception as e:
+                sys.__stderr__.write(f"load_test: {request.kind} failed: {e}\n")
+        self.record(request, status)
+
+    def record(self, request, status):
+        # Latency is measured from the scheduled arrival, so queueing counts
+        latency = time.perf_counter() - request.due
+        label = request.kind
+        if request.retry_num:
+            label = f"{request.kind} (retry)"
+        elif request.duplicate:
+            label = f"{request.kind} (duplicate)"
+        elif request.follow_up:
+            label = f"{request.kind} (follow-up)"
+        elif request.kind in EDIT_KINDS:
+            label = request.kind
+        with self._lock:
+            self.results.append((label, status, latency))
+
+    def schedule(self):
+        args = self.args
+        weights = parse_mix(args.mix)
+        kinds, probabilities = zip(*weights.items())
+        factory = TrafficFactory(args.users, self.rng)
+        replay = load_replay(args.replay) if args.replay else None
+
+        mean = 1.0 / args.qps
+        start = time.perf_counter()
+        due = start
+        requests = []
+        while due - start < args.duration:
+            if replay:
+                kind, body = replay[len(requests) % len(replay)]
+            else:
+                kind = self.rng.choices(kinds, probabilities)[0]
+                body = factory.build(kind)
+            requests.append(Request(kind, body, due))
+
+            if kind != "kakao":
+                if self.rng.random() < args.duplicate_ratio:
+                    requests.append(Request(kind, body, due + self.rng.uniform(0, 1), duplicate=True))
+                if self.rng.random() < args.retry_ratio:
+                    requests.append(Request(kind, body, due + args.retry_delay, retry_num=1))
+            if kind in ("app_mention", "message") and not replay and self.rng.random() < args.burst_ratio:
+                follow_due = due
+                for _ in range(self.rng.randint(1, 2)):
+                    follow_due += self.rng.uniform(0.2, 1.0)
+                    requests.append(Request(kind, factory.follow_up(body), follow_due, follow_up=True))
+            if kind in ("app_mention", "message") and not replay and self.rng.random() < args.edit_ratio:
+                delete = self.rng.random() < 1 / 3
+                edit_kind = EDIT_KINDS[1] if delete else EDIT_KINDS[0]
+                edit_due = due + self.rng.uniform(0.5, 2.0)
+                requests.append(Request(edit_kind, factory.edit(body, delete), edit_due))
+
+            due += self.interval(mean)
+        return sorted(requests, key=lambda r: r.due)
+
+    def interval(self, mean):
+        burstiness = self.args.burstiness
+        if burstiness <= 0:
+            return mean
+        shape = 1.0 / (burstiness * burstiness)
+        return self.rng.gammavariate(shape, mean / shape)
+
+    def run(self):
+        requests = self.schedule()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+            for request in requests:
+                wait = request.due - time.perf_counter() - 0.01
+                if wait > 0:
+                    time.sleep(wait)
+                executor.submit(self.send, request)
+        return time.perf_counter() - started
+
+    async def run_async(self):
+        requests = self.schedule()
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        started = time.perf_counter()
+        await asyncio.gather(*(self.send_async(request, semaphore) for request in requests))
+        # Slack requests are acknowledged before they are answered
+        await self.handler.wait_background()
+        return time.perf_counter() - started
+
+
+def load_replay(path):
+    events = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            body = json.loads(line)
+            if "kakao" in body:
+                events.append(("kakao", body["kakao"]))
+            else:
+                events.append((body.get("event", {}).get("type", "message"), body))
+    return events
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def build_report(test, wall):
+    kinds = {}
+    for label, status, latency in test.results:
+        kinds.setdefault(label, []).append((status, latency))
+
+    report = {
+        "mode": "async" if test.args.async_mode else "sync",
+        "requests": len(test.results),
+        "wall_seconds": round(wall, 2),
+        "throughput_rps": round(len(test.results) / wall, 2) if wall else 0,
+        "throttle_rejections": test.table.throttled,
+        "kinds": {},
+        "outbound_calls": dict(test.counter.by_backend()),
+        "outbound_operations": {
+            f"{backend}:{operation}": count
+            for (backend, operation), count in sorted(test.counter.snapshot().items())
+        },
+        "model_tokens": dict(test.counter.tokens),
+    }
+    for label, values in sorted(kinds.items()):
+        latencies = [latency for _, latency in values]
+        report["kinds"][label] = {
+            "count": len(values),
+            "errors": sum(1 for status, _ in values if status != 200),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p90_ms": round(percentile(latencies, 90) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "max_ms": round(max(latencies) * 1000, 1),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"{report['mode']} requests: {report['requests']} in {report['wall_seconds']}s "
+          f"({report['throughput_rps']} req/s), throttle rejections: {report['throttle_rejections']}")
+    print()
+    print(f"{'kind':<28}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for label, stats in report["kinds"].items():
+        print(f"{label:<28}{stats['count']:>8}{stats['errors']:>8}{stats['p50_ms']:>10}"
+              f"{stats['p90_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+    print()
+    print("outbound calls per backend:")
+    for backend, count in sorted(report["outbound_calls"].items()):
+        print(f"  {backend:<10}{count:>8}")
+    for operation, count in report["outbound_operations"].items():
+        print(f"    {operation:<40}{count:>8}")
+    if report["model_tokens"]:
+        print()
+        print("model tokens:")
+        for field, count in sorted(report["model_tokens"].items()):
+            print(f"  {field:<24}{count:>10}")
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+
+    if args.model_id:
+        os.environ["MODEL_ID"] = args.model_id
+    if args.cache_min_tokens is not None:
+        os.environ["PROMPT_CACHE_MIN_TOKENS"] = str(args.cache_min_tokens)
+
+    sys.path.insert(0, ROOT_DIR)
+    import standins
+
+    counter = standins.CallCounter()
+    standins.SlackStandIn(counter, latency=args.slack_latency, bot_user_id=BOT_USER_ID).install()
+
+    latencies = dict(
+        slack_latency=args.slack_latency,
+        dynamodb_latency=args.dynamodb_latency,
+        bedrock_latency=args.bedrock_latency,
+    )
+    if args.async_mode:
+        import async_handler as handler
+
+        table, _ = standins.install_async(handler, counter, **latencies)
+    else:
+        import handler
+
+        table, _ = standins.install(handler, counter, **latencies)
+    test = LoadTest(args, handler, counter, table, rng)
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        if args.async_mode:
+            wall = asyncio.run(test.run_async())
+        else:
+            wall = test.run()
+
+    report = build_report(test, wall)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,631 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+In-process stand-ins for the Slack Web API, DynamoDB and Bedrock.
+
+They replace the real backends of `handler.py` and `async_handler.py` so the bot
+can be driven locally without network access, while counting every outbound call
+per backend. The async stand-ins share state and latency settings with the sync
+ones, so both paths run against the same simulated backends.
+"""
+
+import asyncio
+import hashlib
+import json
+import sys
+import threading
+import time
+
+from collections import Counter
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+from slack_sdk import WebClient
+from slack_sdk.web.slack_response import SlackResponse
+
+try:
+    from slack_sdk.web.async_client import AsyncWebClient
+    from slack_sdk.web.async_slack_response import AsyncSlackResponse
+except ImportError:  # aiohttp is only installed for the async path
+    AsyncWebClient = None
+
+
+class CallCounter:
+    """Thread-safe counter of outbound calls per backend and operation, and of model tokens."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.tokens = Counter()
+
+    def add(self, backend, operation):
+        with self._lock:
+            self.calls[(backend, operation)] += 1
+
+    def add_tokens(self, usage):
+        with self._lock:
+            self.tokens.update(usage)
+
+    def by_backend(self):
+        totals = Counter()
+        with self._lock:
+            for (backend, _), count in self.calls.items():
+                totals[backend] += count
+        return totals
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.calls)
+
+
+class SlackStandIn:
+    """
+    Replaces `WebClient.api_call` and `AsyncWebClient.api_call` for every client
+    in the process.
+
+    Bolt creates a WebClient per request, so the patch is applied to the class
+    rather than to `app.client`.
+    """
+
+    def __init__(self, counter, latency=0.05, bot_user_id="UBOT", history_size=60):
+        self.counter = counter
+        self.latency = latency
+        self.bot_user_id = bot_user_id
+        self.history_size = history_size
+        self._original = None
+        self._original_async = None
+        self._ts_lock = threading.Lock()
+        self._ts = time.time()
+
+    def install(self):
+        self._original = WebClient.api_call
+        stand_in = self
+
+        def api_call(client, api_method, **kwargs):
+            return stand_in.api_call(client, api_method, **kwargs)
+
+        WebClient.api_call = api_call
+
+        if AsyncWebClient is not None:
+            self._original_async = AsyncWebClient.api_call
+
+            async def async_api_call(client, api_method, **kwargs):
+                return await stand_in.async_api_call(client, api_method, **kwargs)
+
+            AsyncWebClient.api_call = async_api_call
+        return self
+
+    def uninstall(self):
+        if self._original:
+            WebClient.api_call = self._original
+        if self._original_async:
+            AsyncWebClient.api_call = self._original_async
+
+    def _next_ts(self):
+        with self._ts_lock:
+            self._ts += 0.000100
+            return f"{self._ts:.6f}"
+
+    def api_call(self, client, api_method, http_verb="POST", files=None, data=None,
+                 params=None, json=None, headers=None, auth=None):
+        self.counter.add("slack", api_method)
+        if self.latency:
+            time.sleep(self.latency)
+
+        args = {**(params or {}), **(data or {}), **(json or {})}
+        return SlackResponse(
+            client=client,
+            http_verb=http_verb,
+            api_url=f"https://slack.com/api/{api_method}",
+            req_args=args,
+            data=self.respond(api_method, args),
+            headers={},
+            status_code=200,
+        )
+
+    async def async_api_call(self, client, api_method, http_verb="POST", files=None, data=None,
+                             params=None, json=None, headers=None, auth=None):
+        self.counter.add("slack", api_method)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        args = {**(params or {}), **(data or {}), **(json or {})}
+        return AsyncSlackResponse(
+            client=client,
+            http_verb=http_verb,
+            api_url=f"https://slack.com/api/{api_method}",
+            req_args=args,
+            data=self.respond(api_method, args),
+            headers={},
+            status_code=200,
+        )
+
+    def respond(self, api_method, args):
+        body = {"ok": True}
+
+        if api_method == "auth.test":
+            body.update(user_id=self.bot_user_id, bot_id="BBOT", team_id="T0LOAD")
+        elif api_method in ("chat.postMessage", "chat.update"):
+            body.update(channel=args.get("channel"), ts=args.get("ts") or self._next_ts())
+        elif api_method == "conversations.replies":
+            body.update(messages=[
+                {"user": "U0LOAD", "text": "이전 질문입니다.", "ts": args.get("ts")},
+                {"bot_id": "BBOT", "text": "이전 답변입니다."},
+            ])
+        elif api_method == "conversations.history":
+            body.update(self.history(args))
+        elif api_method == "users.info":
+            body.update(user={"id": args.get("user"), "profile": {"display_name": "load-tester"}})
+
+        return body
+
+    def history(self, args):
+        """
+        A single message for `limit=1` lookups; otherwise a paginated channel of
+        `history_size` messages, ten minutes apart, where two in three are
+        refund requests and every fifth request is already processed.
+        """
+        latest = args.get("latest")
+        if int(args.get("limit") or 100) == 1:
+            return {"messages": [refund_message(latest)], "has_more": False}
+
+        latest = float(latest or time.time())
+        start = int(args.get("cursor") or 0)
+        end = min(start + int(args.get("limit") or 100), self.history_size)
+
+        messages = []
+        for i in range(start, end):
+            ts = f"{latest - i * 600:.6f}"
+            if i % 3 == 2:
+                messages.append({"ts": ts, "user": "U0LOAD", "text": "환불 문의드립니다."})
+            else:
+                messages.append(refund_message(ts, done=i % 5 == 4))
+
+        has_more = end < self.history_size
+        return {
+            "messages": messages,
+            "has_more": has_more,
+            "response_metadata": {"next_cursor": str(end) if has_more else ""},
+        }
+
+
+def refund_message(ts, done=False):
+    """A refund request message as posted by the refund form."""
+    fields = [
+        {"type": "mrkdwn", "text": "*이름:*\n홍길동"},
+        {"type": "mrkdwn", "text": "*계좌번호:*\n1234567890123"},
+    ]
+    if done:
+        fields[1] = {"type": "mrkdwn", "text": "*계좌번호:*\n123******0123"}
+        fields.append({"type": "mrkdwn", "text": "*환불일시:*\n2026. 01. 31. 오후 06:00:00"})
+    return {
+        "ts": ts,
+        "text": "환불 신청",
+        "blocks": [
+            {"type": "header", "text": {"type": "plain_text", "text": "환불 신청"}},
+            {"type": "section", "fields": fields},
+        ],
+    }
+
+
+class DynamoDBTableStandIn:
+    """In-memory stand-in for the boto3 DynamoDB Table resource used by the bot.
+
+    Only the condition and update expressions the bot issues are understood.
+    """
+
+    CONDITIONS = {
+        None: lambda item, values: True,
+        "attribute_exists(id)": lambda item, values: item is not None,
+        "attribute_not_exists(id)": lambda item, values: item is None,
+        "attribute_not_exists(id) OR expire_at < :now":
+            lambda item, values: item is None or item["expire_at"] < values[":now"],
+        "attribute_exists(id) AND expire_at >= :now":
+            lambda item, values: item is not None and item["expire_at"] >= values[":now"],
+        "attribute_not_exists(id) OR size(pending) = :zero":
+            lambda item, values: item is None or len(item.get("pending", [])) == values[":zero"],
+        "attribute_not_exists(id) OR #version < :version":
+            lambda item, values: item is None or item["version"] < values[":version"],
+    }
+
+    UPDATES = {
+        "SET pending = list_append(pending, :message)":
+            lambda item, values: {"pending": list(item.get("pending", [])) + list(values[":message"])},
+        "SET answering = list_append(if_not_exists(answering, :empty), pending), "
+        "pending = :empty, expire_at = :expire_at":
+            lambda item, values: {
+                "answering": list(item.get("answering", [])) + list(item.get("pending", [])),
+                "pending": list(values[":empty"]),
+                "expire_at": values[":expire_at"],
+            },
+    }
+
+    def __init__(self, counter, latency=0.01, throttle_limit=None):
+        self.counter = counter
+        self.latency = latency
+        self.throttle_limit = throttle_limit
+        self.throttled = 0
+        self.items = {}
+        self._lock = threading.Lock()
+
+    def _call(self, operation):
+        self.counter.add("dynamodb", operation)
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _conditional_check_failed(operation):
+        return ClientError(
+            {"Error": {"Code": "ConditionalCheckFailedException", "Message": "The conditional request failed"}},
+            operation,
+        )
+
+    def get_item(self, Key, **kwargs):
+        self._call("GetItem")
+        item = self.get(Key["id"])
+        return {"Item": item} if item else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        self._call("PutItem")
+        self.put(Item, ConditionExpression, ExpressionAttributeValues)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None,
+                    ExpressionAttributeValues=None, ReturnValues=None, **kwargs):
+        self._call("UpdateItem")
+        old = self.update(Key["id"], UpdateExpression, ConditionExpression, ExpressionAttributeValues)
+        return {"Attributes": old} if ReturnValues == "UPDATED_OLD" else {}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        self._call("DeleteItem")
+        self.delete(Key["id"], ConditionExpression, ExpressionAttributeValues)
+        return {}
+
+    def query(self, IndexName=None, KeyConditionExpression=None, Select=None, **kwargs):
+        self._call("Query")
+        user = KeyConditionExpression.get_expression()["values"][1]
+        return {"Count": self.count_user(user)}
+
+    # Storage shared by the sync table and the async client stand-ins
+
+    def _check(self, operation, item, condition, values):
+        if not self.CONDITIONS[condition](item, values or {}):
+            raise self._conditional_check_failed(operation)
+
+    def get(self, key):
+        with self._lock:
+            item = self.items.get(key)
+        return dict(item) if item else None
+
+    def put(self, item, condition=None, values=None):
+        with self._lock:
+            self._check("PutItem", self.items.get(item["id"]), condition, values)
+            self.items[item["id"]] = dict(item)
+
+    def update(self, key, expression, condition=None, values=None):
+        """Apply an update and return the old values of the updated attributes"""
+        with self._lock:
+            item = self.items.get(key)
+            self._check("UpdateItem", item, condition, values)
+            item = dict(item or {"id": key})
+            changes = self.UPDATES[expression](item, values or {})
+            old = {name: item[name] for name in changes if name in item}
+            item.update(changes)
+            self.items[key] = item
+        return old
+
+    def delete(self, key, condition=None, values=None):
+        with self._lock:
+            self._check("DeleteItem", self.items.get(key), condition, values)
+            self.items.pop(key, None)
+
+    def count_user(self, user):
+        now = int(time.time())
+        with self._lock:
+            count = sum(
+                1 for item in self.items.values()
+                if item.get("user") == user and item.get("expire_at", now + 1) > now
+            )
+            if self.throttle_limit is not None and count >= self.throttle_limit:
+                self.throttled += 1
+        return count
+
+
+class AsyncDynamoDBClientStandIn:
+    """Stand-in for the low-level async DynamoDB client, backed by a table stand-in."""
+
+    _serializer = TypeSerializer()
+    _deserializer = TypeDeserializer()
+
+    def __init__(self, table):
+        self.table = table
+
+    async def _call(self, operation):
+        self.table.counter.add("dynamodb", operation)
+        if self.table.latency:
+            await asyncio.sleep(self.table.latency)
+
+    def _load(self, item):
+        return {key: self._deserializer.deserialize(value) for key, value in item.items()}
+
+    def _dump(self, item):
+        return {key: self._serializer.serialize(value) for key, value in item.items()}
+
+    async def get_item(self, TableName, Key, **kwargs):
+        await self._call("GetItem")
+        item = self.table.get(self._load(Key)["id"])
+        return {"Item": self._dump(item)} if item else {}
+
+    async def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        await self._call("PutItem")
+        self.table.put(self._load(Item), ConditionExpression, self._load(ExpressionAttributeValues or {}))
+        return {}
+
+    async def update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None,
+                          ExpressionAttributeValues=None, ReturnValues=None, **kwargs):
+        await self._call("UpdateItem")
+        old = self.table.update(
+            self._load(Key)["id"], UpdateExpression, ConditionExpression,
+            self._load(ExpressionAttributeValues or {}),
+        )
+        return {"Attributes": self._dump(old)} if ReturnValues == "UPDATED_OLD" else {}
+
+    async def delete_item(self, TableName, Key, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        await self._call("DeleteItem")
+        self.table.delete(self._load(Key)["id"], ConditionExpression, self._load(ExpressionAttributeValues or {}))
+        return {}
+
+    async def query(self, TableName, ExpressionAttributeValues=None, **kwargs):
+        await self._call("Query")
+        user = self._load(ExpressionAttributeValues)[":value"]
+        return {"Count": self.table.count_user(user)}
+
+
+class CompletionStream:
+    """
+    InvokeAgent completion stream, iterable with `for` and `async for`.
+
+    Like botocore's EventStream it can be closed early, after which no more
+    chunks are produced.
+    """
+
+    def __init__(self, counter, latency, chunks):
+        self.counter = counter
+        self.delay = latency / max(chunks, 1)
+        self.chunks = chunks
+        self.produced = 0
+
+    def _chunk(self):
+        self.produced += 1
+        return {"chunk": {"bytes": f"구루미 답변 {self.produced}/{self.chunks}. ".encode()}}
+
+    def __iter__(self):
+        while self.produced < self.chunks:
+            time.sleep(self.delay)
+            yield self._chunk()
+
+    async def __aiter__(self):
+        while self.produced < self.chunks:
+            await asyncio.sleep(self.delay)
+            yield self._chunk()
+
+    def close(self):
+        if self.produced < self.chunks:
+            self.counter.add("bedrock", "InvokeAgent (closed early)")
+        self.chunks = self.produced
+
+
+class BedrockAgentStandIn:
+    """Stand-in for the bedrock-agent-runtime client (InvokeAgent and Retrieve)."""
+
+    def __init__(self, counter, latency=1.0, chunks=5, retrieve_latency=0.1):
+        self.counter = counter
+        self.latency = latency
+        self.chunks = chunks
+        self.retrieve_latency = retrieve_latency
+
+    def invoke_agent(self, agentId, agentAliasId, sessionId, inputText, **kwargs):
+        self.counter.add("bedrock", "InvokeAgent")
+        return {"completion": CompletionStream(self.counter, self.latency, self.chunks)}
+
+    def retrieve(self, retrievalQuery, knowledgeBaseId, retrievalConfiguration=None, **kwargs):
+        self.counter.add("bedrock", "Retrieve")
+        if self.retrieve_latency:
+            time.sleep(self.retrieve_latency)
+        return self._results(retrievalQuery, retrievalConfiguration)
+
+    @staticmethod
+    def _results(retrievalQuery, retrievalConfiguration):
+        count = (retrievalConfiguration or {}).get("vectorSearchConfiguration", {}).get("numberOfResults", 5)
+        return {
+            "retrievalResults": [
+                {
+                    "content": {"text": f"{retrievalQuery['text']} 관련 문서 {i + 1}"},
+                    "score": round(0.9 - i * 0.1, 2),
+                    "location": {"s3Location": {"uri": f"s3://standin/doc-{i + 1}.md"}},
+                }
+                for i in range(count)
+            ]
+        }
+
+
+class ConverseStream(CompletionStream):
+    """ConverseStream event stream, ending with the metadata event that carries the usage."""
+
+    def __init__(self, counter, latency, chunks, usage):
+        super().__init__(counter, latency, chunks)
+        self.usage = usage
+
+    def _chunk(self):
+        text = super()._chunk()["chunk"]["bytes"].decode()
+        return {"contentBlockDelta": {"delta": {"text": text}, "contentBlockIndex": 0}}
+
+    def _metadata(self):
+        self.usage["outputTokens"] = self.produced * 8
+        self.usage["totalTokens"] = sum(self.usage.values())
+        self.counter.add_tokens(self.usage)
+        return {"metadata": {"usage": dict(self.usage), "metrics": {"latencyMs": 0}}}
+
+    def __iter__(self):
+        yield from super().__iter__()
+        if self.chunks:
+            yield self._metadata()
+
+    async def __aiter__(self):
+        async for event in super().__aiter__():
+            yield event
+        if self.chunks:
+            yield self._metadata()
+
+    def close(self):
+        if self.produced < self.chunks:
+            self.counter.add("bedrock", "ConverseStream (closed early)")
+        self.chunks = self.produced
+
+
+class BedrockRuntimeStandIn:
+    """
+    Stand-in for the bedrock-runtime client (ConverseStream) that simulates prompt caching.
+
+    The prefix up to each cachePoint block is hashed. A prefix seen within
+    `cache_ttl` seconds is read from the cache and the rest up to the last
+    checkpoint is written to it, reported like Bedrock does in
+    cacheReadInputTokens and cacheWriteInputTokens. A token is counted as
+    4 bytes of the block.
+    """
+
+    def __init__(self, counter, latency=1.0, chunks=5, cache_ttl=300):
+        self.counter = counter
+        self.latency = latency
+        self.chunks = chunks
+        self.cache_ttl = cache_ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def usage(self, system, messages):
+        """Return the input, cache read and cache write tokens of a request, updating the cache."""
+        blocks = list(system or [])
+        for message in messages:
+            blocks.extend(message["content"])
+
+        digest = hashlib.sha256()
+        total, checkpoints = 0, []
+        for block in blocks:
+            if "cachePoint" in block:
+                checkpoints.append((digest.hexdigest(), total))
+                continue
+            data = json.dumps(block, ensure_ascii=False, sort_keys=True).encode()
+            digest.update(data)
+            total += len(data) // 4 + 1
+
+        now = time.monotonic()
+        read = 0
+        with self._lock:
+            for key, tokens in reversed(checkpoints):
+                if self._cache.get(key, 0) > now:
+                    read = tokens
+                    break
+            for key, _ in checkpoints:
+                self._cache[key] = now + self.cache_ttl
+        written = checkpoints[-1][1] - read if checkpoints else 0
+        return {
+            "inputTokens": total - read - written,
+            "cacheReadInputTokens": read,
+            "cacheWriteInputTokens": written,
+        }
+
+    def converse_stream(self, modelId, messages, system=None, inferenceConfig=None, **kwargs):
+        self.counter.add("bedrock", "ConverseStream")
+        return {"stream": ConverseStream(self.counter, self.latency, self.chunks, self.usage(system, messages))}
+
+
+class BedrockStandIn:
+    """Stand-in for the bedrock control plane client (application inference profiles)."""
+
+    def __init__(self, counter, region="us-east-1"):
+        self.counter = counter
+        self.region = region
+        self.profiles = []
+
+    def list_inference_profiles(self, typeEquals, **kwargs):
+        self.counter.add("bedrock", "ListInferenceProfiles")
+        if typeEquals == "SYSTEM_DEFINED":
+            return {"inferenceProfileSummaries": []}
+        return {"inferenceProfileSummaries": list(self.profiles)}
+
+    def create_inference_profile(self, inferenceProfileName, modelSource, **kwargs):
+        self.counter.add("bedrock", "CreateInferenceProfile")
+        if any(p["inferenceProfileName"] == inferenceProfileName for p in self.profiles):
+            raise ClientError(
+                {"Error": {"Code": "ConflictException", "Message": "Inference profile already exists"}},
+                "CreateInferenceProfile",
+            )
+        profile = {
+            "inferenceProfileName": inferenceProfileName,
+            "inferenceProfileArn": (
+                f"arn:aws:bedrock:{self.region}:000000000000:application-inference-profile/"
+                f"{len(self.profiles) + 1:012d}"
+            ),
+            "models": [{"modelArn": modelSource["copyFrom"]}],
+            "status": "ACTIVE",
+        }
+        self.profiles.append(profile)
+        return {"inferenceProfileArn": profile["inferenceProfileArn"], "status": "ACTIVE"}
+
+
+class AsyncBedrockRuntimeStandIn(BedrockRuntimeStandIn):
+    """Async variant of the Bedrock Runtime stand-in."""
+
+    async def converse_stream(self, modelId, messages, system=None, inferenceConfig=None, **kwargs):
+        return super().converse_stream(modelId, messages, system, inferenceConfig, **kwargs)
+
+
+class AsyncBedrockAgentStandIn(BedrockAgentStandIn):
+    """Async variant of the Bedrock Agent stand-in."""
+
+    async def invoke_agent(self, agentId, agentAliasId, sessionId, inputText, **kwargs):
+        self.counter.add("bedrock", "InvokeAgent")
+        return {"completion": CompletionStream(self.counter, self.latency, self.chunks)}
+
+    async def retrieve(self, retrievalQuery, knowledgeBaseId, retrievalConfiguration=None, **kwargs):
+        self.counter.add("bedrock", "Retrieve")
+        if self.retrieve_latency:
+            await asyncio.sleep(self.retrieve_latency)
+        return self._results(retrievalQuery, retrievalConfiguration)
+
+
+def install(handler, counter, slack_latency=0.05, dynamodb_latency=0.01, bedrock_latency=1.0):
+    """
+    Swap the backends of an imported `handler` module for stand-ins.
+
+    The Slack stand-in must be installed before `handler` is imported, since the
+    Bolt app calls auth.test while it is constructed.
+    """
+    table = DynamoDBTableStandIn(
+        counter, latency=dynamodb_latency, throttle_limit=handler.Config.MAX_THROTTLE_COUNT
+    )
+    agent = BedrockAgentStandIn(counter, latency=bedrock_latency)
+    handler.table = table
+    handler.bedrock_agent_client = agent
+    handler.bedrock_runtime_client = BedrockRuntimeStandIn(counter, latency=bedrock_latency)
+    handler.inference_profiles.client = BedrockStandIn(counter, region=handler.Config.AWS_REGION)
+    return table, agent
+
+
+def install_async(async_handler, counter, slack_latency=0.05, dynamodb_latency=0.01, bedrock_latency=1.0):
+    """
+    Swap the async AWS clients of an imported `async_handler` module for stand-ins.
+
+    Slack is covered by `SlackStandIn`, which patches `AsyncWebClient` as well.
+    """
+    table = DynamoDBTableStandIn(
+        counter, latency=dynamodb_latency, throttle_limit=async_handler.Config.MAX_THROTTLE_COUNT
+    )
+    agent = AsyncBedrockAgentStandIn(counter, latency=bedrock_latency)
+    runtime = AsyncBedrockRuntimeStandIn(counter, latency=bedrock_latency)
+    async_handler.clients.use(AsyncDynamoDBClientStandIn(table), agent, runtime)
+    # Inference profiles are resolved by handler's registry and table on a worker thread
+    sys.modules["handler"].table = table
+    sys.modules["handler"].inference_profiles.client = BedrockStandIn(counter, region=async_handler.Config.AWS_REGION)
+    return table, agent
@@ -0,0 +1,518 @@
+import asyncio
+import json
+import logging
+import queue
+import time
+
+from collections import Counter
+
+import aiohttp
+
+from tqdm import tqdm
+
+from incremental_exporter import IncrementalNotionExporter
+from python_notion_exporter import NotionExporter, ZipStreamExtractor
+
+
+class RequestThrottled(Exception):
+    """Raised when the Notion API answers 429 or 5xx."""
+
+    def __init__(self, status: int, retry_after: float = None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Spaces out requests to at most `rate` per second across all tasks on the event loop."""
+
+    def __init__(self, rate: float):
+        """
+        Initializes the RateLimiter class.
+
+        Args:
+            rate (float): Requests per second. 0 disables the limit.
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+
+    async def acquire(self):
+        """
+        Waits for the next request slot.
+        """
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class AIMDController:
+    """
+    Additive-increase, multiplicative-decrease limit on requests in flight.
+
+    Each success raises the limit by 1/limit, so it grows by about one per
+    round trip of the whole window. A 429 or 5xx halves it, once per window:
+    only requests started after the last decrease can trigger the next one.
+    Retry-After pauses every new request until it has passed.
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 32,
+        decrease_factor: float = 0.5,
+    ):
+        """
+        Initializes the AIMDController class.
+
+        Args:
+            initial (int, optional): Starting limit. Defaults to 4.
+            minimum (int, optional): Lowest limit. Defaults to 1.
+            maximum (int, optional): Highest limit. Defaults to 32.
+            decrease_factor (float, optional): Factor applied to the limit on throttling. Defaults to 0.5.
+        """
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.decreases = 0
+        self._epoch = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> int:
+        """
+        Waits until a request may start.
+
+        Returns:
+            int: The window the request started in, to pass back to `release`.
+        """
+        async with self._condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return self._epoch
+                await self._condition.wait()
+
+    async def release(self, epoch: int, throttled: bool = False, retry_after: float = None):
+        """
+        Finishes a request and adjusts the limit.
+
+        Args:
+            epoch (int): The value returned by `acquire`.
+            throttled (bool, optional): True if the request was answered with 429 or 5xx. Defaults to False.
+            retry_after (float, optional): Seconds from a Retry-After header. Defaults to None.
+        """
+        async with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                if epoch == self._epoch:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self._epoch += 1
+                    self.decreases += 1
+                if retry_after:
+                    self.paused_until = max(
+                        self.paused_until, time.monotonic() + retry_after
+                    )
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+
+class ExportMetrics:
+    """Counters for requests, throttling, downloads and pages of one export run."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.statuses = Counter()
+        self.requests = 0
+        self.retries = 0
+        self.bytes_downloaded = 0
+        self.pages_done = 0
+        self.pages_failed = 0
+        self.peak_in_flight = 0
+
+    def record(self, status: int, in_flight: int):
+        """
+        Records a finished API request.
+
+        Args:
+            status (int): The HTTP status, or 0 for a connection error.
+            in_flight (int): Requests in flight when it started.
+        """
+        self.requests += 1
+        self.statuses[status] += 1
+        self.peak_in_flight = max(self.peak_in_flight, in_flight)
+
+    def summary(self, controller: AIMDController = None) -> dict:
+        """
+        Summarizes the run so far.
+
+        Args:
+            controller (AIMDController, optional): Adds the current concurrency limit.
+
+        Returns:
+            dict: The metrics.
+        """
+        elapsed = time.monotonic() - self.started
+        summary = {
+            "elapsed_s": round(elapsed, 1),
+            "requests": self.requests,
+            "requests_per_s": round(self.requests / elapsed, 2) if elapsed else 0.0,
+            "statuses": dict(sorted(self.statuses.items())),
+            "throttled": sum(n for s, n in self.statuses.items() if s == 429 or s >= 500),
+            "retries": self.retries,
+            "peak_in_flight": self.peak_in_flight,
+            "downloaded_mb": round(self.bytes_downloaded / 2**20, 1),
+            "pages_done": self.pages_done,
+            "pages_failed": self.pages_failed,
+        }
+        if controller:
+            summary["concurrency_limit"] = round(controller.limit, 1)
+            summary["limit_decreases"] = controller.decreases
+        return summary
+
+
+class AsyncNotionExporter(NotionExporter):
+    """
+    NotionExporter running every request on one event loop.
+
+    Concurrency is set by an AIMD controller that backs off on 429/5xx and
+    Retry-After, under a global requests-per-second limit, instead of a thread
+    pool sized to the CPU count. Downloads stream into the zip extractor on a
+    worker thread.
+    """
+
+    DOWNLOAD_QUEUE_SIZE = 4
+
+    def __init__(
+        self,
+        *args,
+        requests_per_second: float = 3.0,
+        initial_concurrency: int = 4,
+        max_concurrency: int = 32,
+        max_retries: int = 5,
+        **kwargs,
+    ):
+        """
+        Initializes the AsyncNotionExporter class.
+
+        Args:
+            *args: Positional arguments for NotionExporter.
+            requests_per_second (float, optional): Global limit on Notion API requests. Defaults to 3.
+            initial_concurrency (int, optional): Starting number of API requests in flight. Defaults to 4.
+            max_concurrency (int, optional): Upper bound for API requests and downloads in flight. Defaults to 32.
+            max_retries (int, optional): Retries of a throttled or failed API request. Defaults to 5.
+            **kwargs: Keyword arguments for NotionExporter.
+        """
+        super().__init__(*args, **kwargs)
+        self.requests_per_second = requests_per_second
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.metrics = ExportMetrics()
+        self.controller = None
+
+    @staticmethod
+    def _retry_after(value: str) -> float:
+        """
+        Parses a Retry-After header given in seconds.
+
+        Args:
+            value (str): The header value.
+
+        Returns:
+            float: The delay in seconds, or None.
+        """
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            return None
+
+    async def _post(self, session: aiohttp.ClientSession, endpoint: str, payload: dict) -> dict:
+        """
+        Calls a Notion API endpoint, retrying throttled and failed requests.
+
+        Args:
+            session (aiohttp.ClientSession): The HTTP session.
+            endpoint (str): The endpoint name, e.g. "enqueueTask".
+            payload (dict): The request body.
+
+        Returns:
+            dict: The response body.
+        """
+        url = f"{self.api_url}/{endpoint}"
+        body = json.dumps(payload)
+
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire()
+            epoch = await self.controller.acquire()
+            in_flight = self.controller.in_flight
+            status, retry_after, throttled = 0, None, False
+            try:
+                async with session.post(url, data=body, headers=self.query_headers) as response:
+                    status = response.status
+                    if status == 429 or status >= 500:
+                        retry_after = self._retry_after(response.headers.get("Retry-After"))
+                        raise RequestThrottled(status, retry_after)
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+            except (RequestThrottled, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                throttled = True
+                if attempt == self.max_retries:
+                    raise
+                error = e
+            finally:
+                # The slot is freed on every exit, including cancellation and unexpected errors
+                await self.controller.release(epoch, throttled=throttled, retry_after=retry_after)
+                self.metrics.record(status, in_flight)
+
+            self.metrics.retries += 1
+            delay = retry_after if retry_after is not None else self._next_poll_delay(attempt)
+            logging.debug(f"{endpoint} failed with {error}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def _aexport(self, session: aiohttp.ClientSession, page_id: str, recursive: bool = None) -> str:
+        """
+        Initiates the export of a Notion page.
+
+        Args:
+            session (aiohttp.ClientSession): The HTTP session.
+            page_id (str): The ID of the Notion page.
+            recursive (bool, optional): If True, includes subpages. Defaults to the exporter's `recursive`.
+
+        Returns:
+            str: The task ID of the initiated export.
+        """
+        response = await self._post(session, "enqueueTask", self._export_payload(page_id, recursive))
+        return response["taskId"]
+
+    async def _aget_statuses(self, session: aiohttp.ClientSession, task_ids: list) -> dict:
+        """
+        Fetches the status of several export tasks in one request.
+
+        Args:
+            session (aiohttp.ClientSession): The HTTP session.
+            task_ids (list): The IDs of the export tasks.
+
+        Returns:
+            dict: Task statuses keyed by task ID.
+        """
+        response = await self._post(session, "getTasks", {"taskIds": task_ids})
+        return self._statuses_by_id(task_ids, response)
+
+    async def _apoll_exports(self, session: aiohttp.ClientSession, tasks: dict, on_finished):
+        """
+        Polls all outstanding export tasks together, like `_poll_exports`.
+
+        Args:
+            session (aiohttp.ClientSession): The HTTP session.
+            tasks (dict): Page names keyed by export task ID.
+            on_finished (callable): Called with the page name and final status of each task.
+        """
+        outstanding = {task_id: time.monotonic() for task_id in tasks}
+        attempt = 0
+
+        while outstanding:
+            await asyncio.sleep(self._next_poll_delay(attempt))
+            attempt += 1
+
+            task_ids = list(outstanding)
+            batches = [
+                task_ids[i : i + self.poll_batch_size]
+                for i in range(0, len(task_ids), self.poll_batch_size)
+            ]
+            statuses = {}
+            for result in await asyncio.gather(
+                *(self._aget_statuses(session, batch) for batch in batches),
+                return_exceptions=True,
+            ):
+                if isinstance(result, Exception):
+                    logging.warning(f"Failed to poll export tasks: {result}")
+                else:
+                    statuses.update(result)
+
+            now = time.monotonic()
+            for task_id in task_ids:
+                status = statuses.get(task_id, {})
+                if self._is_finished(status):
+                    del outstanding[task_id]
+                    attempt = 0
+                    on_finished(tasks[task_id], status)
+                elif now - outstanding[task_id] > self.task_timeout:
+                    del outstanding[task_id]
+                    on_finished(
+                        tasks[task_id],
+                        {
+                            "state": "failure",
+                            "error": f"Export did not finish within {self.task_timeout:.0f} seconds.",
+                        },
+                    )
+
+    async def _adownload(self, session: aiohttp.ClientSession, url: str) -> list[str]:
+        """
+        Streams an exported zip into the extractor running on a worker thread.
+
+        Args:
+            session (aiohttp.ClientSession): The HTTP session.
+            url (str): The URL of the exported file.
+
+        Returns:
+            list: The extracted file names, relative to the export directory.
+        """
+        directory_path = f"{self.export_directory}{self.export_name}"
+        chunks = queue.Queue(maxsize=self.DOWNLOAD_QUEUE_SIZE)
+        extract = asyncio.get_running_loop().run_in_executor(
+            None, lambda: ZipStreamExtractor(iter(chunks.get, None), directory_path).extract()
+        )
+
+        async def feed(item):
+            # Never block the loop; stop feeding if the extractor gave up
+            while not extract.done():
+                try:
+                    chunks.put_nowait(item)
+                    return
+                except queue.Full:
+                    await asyncio.sleep(0.005)
+
+        try:
+            async with self.download_slots:
+                async with session.get(url, headers=self.download_headers) as response:
+                    response.raise_for_status()
+                    async for chunk in response.content.iter_chunked(self.download_chunk_size):
+                        self.metrics.bytes_downloaded += len(chunk)
+                        await feed(chunk)
+        finally:
+            await feed(None)
+        return await extract
+
+    async def _adownload_page(self, session: aiohttp.ClientSession, name: str, status: dict) -> dict:
+        """
+        Downloads the result of a finished export task.
+
+        Args:
+            session (aiohttp.ClientSession): The HTTP session.
+            name (str): The name of the Notion page.
+            status (dict): The final status of the page's export task.
+
+        Returns:
+            dict: Details about the export status and any errors.
+        """
+        state = status.get("state")
+        if state == "failure":
+            error = status.get("error")
+            logging.error(f"Export failed for {name} with error: {error}")
+            return {"state": state, "name": name, "error": error}
+
+        files = []
+        export_url = status.get("status", {}).get("exportURL")
+        if export_url:
+            try:
+                files = await self._adownload(session, export_url)
+            except Exception as e:
+                logging.error(f"Download failed for {name} with error: {e}")
+                return {"state": "failure", "name": name, "error": str(e)}
+        else:
+            logging.warning(f"Failed to get exportURL for {name}")
+
+        return {
+            "state": state,
+            "name": name,
+            "exportURL": export_url,
+            "pagesExported": status.get("status", {}).get("pagesExported"),
+            "files": files,
+        }
+
+    async def _arun(self, jobs: dict, on_result=None) -> list[dict]:
+        """
+        Exports a set of pages on the event loop, like `_run`.
+
+        Args:
+            jobs (dict): Tuples of page ID and recursive flag, keyed by name.
+            on_result (callable, optional): Called from a worker thread with each page's result.
+
+        Returns:
+            list: The result of every page that was enqueued.
+        """
+        self.metrics = ExportMetrics()
+        self.rate_limiter = RateLimiter(self.requests_per_second)
+        self.controller = AIMDController(
+            initial=self.initial_concurrency, maximum=self.max_concurrency
+        )
+        self.download_slots = asyncio.Semaphore(self.max_concurrency)
+        results = []
+
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            names = list(jobs)
+            task_ids = await asyncio.gather(
+                *(self._aexport(session, page_id, recursive) for page_id, recursive in jobs.values()),
+                return_exceptions=True,
+            )
+            tasks = {}
+            for name, task_id in zip(names, task_ids):
+                if isinstance(task_id, Exception):
+                    logging.error(f"Export failed for {name} with error: {task_id}")
+                    results.append({"state": "failure", "name": name, "error": str(task_id)})
+                    self.metrics.pages_failed += 1
+                else:
+                    tasks[task_id] = name
+
+            with tqdm(total=len(tasks), dynamic_ncols=True) as pbar:
+
+                async def download(name, status):
+                    result = await self._adownload_page(session, name, status)
+                    results.append(result)
+                    if on_result:
+                        await asyncio.to_thread(on_result, result)
+                    if result["state"] == "failure":
+                        self.metrics.pages_failed += 1
+                        return
+                    self.metrics.pages_done += 1
+                    summary = self.metrics.summary(self.controller)
+                    pbar.set_postfix_str(
+                        f"{name}: {summary['requests_per_s']} req/s, "
+                        f"limit {summary['concurrency_limit']}, throttled {summary['throttled']}"
+                    )
+                    pbar.update(1)
+
+                # Downloads start while the poller keeps checking the remaining tasks
+                downloads = []
+                await self._apoll_exports(
+                    session,
+                    tasks,
+                    lambda name, status: downloads.append(
+                        asyncio.ensure_future(download(name, status))
+                    ),
+                )
+                await asyncio.gather(*downloads)
+
+        logging.info(f"Export metrics: {json.dumps(self.metrics.summary(self.controller))}")
+        return results
+
+    def _run(self, jobs: dict, on_result=None) -> list[dict]:
+        """
+        Runs `_arun` on a new event loop, so `process` works unchanged.
+
+        Args:
+            jobs (dict): Tuples of page ID and recursive flag, keyed by name.
+            on_result (callable, optional): Called with each page's result.
+
+        Returns:
+            list: The result of every page that was enqueued.
+        """
+        return asyncio.run(self._arun(jobs, on_result))
+
+
+class AsyncIncrementalNotionExporter(IncrementalNotionExporter, AsyncNotionExporter):
+    """IncrementalNotionExporter whose exports run on the async engine."""
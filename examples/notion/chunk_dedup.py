@@ -0,0 +1,314 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+
+METADATA_SUFFIX = ".metadata.json"
+MAX_PROVENANCE = 20
+
+
+def shingles(text: str, size: int = 8) -> np.ndarray:
+    """
+    Hashes the byte n-grams of a normalized text.
+
+    Byte shingles cover about `size` Latin or `size / 3` Korean characters,
+    so no tokenizer is needed.
+
+    Args:
+        text (str): The text.
+        size (int, optional): Shingle length in bytes, at most 8. Defaults to 8.
+
+    Returns:
+        np.ndarray: The shingles as uint64, repeats included.
+    """
+    data = " ".join(text.lower().split()).encode("utf-8")
+    count = max(len(data) - size + 1, 1)
+    # Reads 8 bytes at every offset as one little-endian integer
+    packed = np.ndarray((count,), dtype="<u8", buffer=data.ljust(count + 7, b"\0"), strides=(1,))
+    if size < 8:
+        packed = packed & np.uint64((1 << (8 * size)) - 1)
+    return packed
+
+
+def mix(values: np.ndarray) -> np.ndarray:
+    """
+    Scrambles uint64 values with the splitmix64 finalizer.
+
+    Args:
+        values (np.ndarray): The values.
+
+    Returns:
+        np.ndarray: The hashes.
+    """
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+class MinHashDeduplicator:
+    """
+    Collapses near-duplicate chunks using MinHash signatures and LSH banding.
+
+    Signatures use one-permutation hashing: each shingle is hashed once, the
+    top bits of the hash pick one of `num_perm` bins and each bin keeps its
+    minimum. Empty bins of short chunks borrow from the next filled bin. LSH
+    bands make candidate pairs. A candidate joins a cluster when its estimated
+    Jaccard similarity reaches `threshold`.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, shingle_size: int = 8):
+        """
+        Initializes the MinHashDeduplicator class.
+
+        Args:
+            threshold (float, optional): Jaccard similarity from which chunks are duplicates. Defaults to 0.8.
+            num_perm (int, optional): Signature length, a power of two. Defaults to 128.
+            shingle_size (int, optional): Shingle length in bytes, at most 8. Defaults to 8.
+        """
+        if num_perm & (num_perm - 1):
+            raise ValueError(f"num_perm must be a power of two: {num_perm}")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = self._band_shape(threshold, num_perm)
+
+    @staticmethod
+    def _band_shape(threshold: float, num_perm: int) -> tuple[int, int]:
+        """
+        Picks bands and rows whose candidate curve rises just below the threshold.
+
+        Args:
+            threshold (float): The similarity threshold.
+            num_perm (int): The signature length.
+
+        Returns:
+            tuple: Number of bands and rows per band.
+        """
+        shapes = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+        below = [s for s in shapes if (1 / s[0]) ** (1 / s[1]) <= threshold] or shapes[:1]
+        return max(below, key=lambda s: (1 / s[0]) ** (1 / s[1]))
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Computes the one-permutation MinHash signature of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            np.ndarray: `num_perm` uint64 values.
+        """
+        shift = np.uint64(64 - (self.num_perm.bit_length() - 1))
+        hashes = np.sort(mix(shingles(text, self.shingle_size)))
+        # Sorted by hash, so each bin's minimum is the first hash at or above its lower bound
+        starts = np.arange(self.num_perm, dtype=np.uint64) << shift
+        first = np.searchsorted(hashes, starts)
+        found = first < len(hashes)
+        found[found] = (hashes[first[found]] >> shift) == starts[found] >> shift
+
+        signature = hashes[np.minimum(first, len(hashes) - 1)] & ((np.uint64(1) << shift) - np.uint64(1))
+        if not found.all():
+            # Densify: an empty bin takes the next filled bin's value, offset by the distance
+            filled = np.flatnonzero(found)
+            empty = np.flatnonzero(~found)
+            nearest = filled[np.searchsorted(filled, empty) % len(filled)]
+            distance = (nearest - empty) % self.num_perm
+            signature[empty] = mix(signature[nearest] + distance.astype(np.uint64))
+        return signature
+
+    def clusters(self, signatures: np.ndarray) -> list[list[int]]:
+        """
+        Groups signatures whose estimated similarity reaches the threshold.
+
+        Args:
+            signatures (np.ndarray): One signature per row.
+
+        Returns:
+            list: Index lists of clusters with more than one member.
+        """
+        parent = list(range(len(signatures)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        checked = set()
+        for band in range(self.bands):
+            rows = np.ascontiguousarray(signatures[:, band * self.rows : (band + 1) * self.rows])
+            keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * self.rows))).ravel()
+            _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+            if counts.max(initial=0) < 2:
+                continue
+
+            order = np.argsort(inverse, kind="stable")
+            starts = np.cumsum(counts) - counts
+            for bucket in np.flatnonzero(counts > 1):
+                members = order[starts[bucket] : starts[bucket] + counts[bucket]]
+                # Compare with the bucket's first member instead of every pair
+                head = members[0]
+                for member in members[1:]:
+                    pair = (int(head), int(member))
+                    if pair in checked or find(pair[0]) == find(pair[1]):
+                        continue
+                    checked.add(pair)
+                    if np.mean(signatures[head] == signatures[member]) >= self.threshold:
+                        parent[find(pair[1])] = find(pair[0])
+
+        groups = {}
+        for i in range(len(signatures)):
+            groups.setdefault(find(i), []).append(i)
+        return [members for members in groups.values() if len(members) > 1]
+
+
+def _read_chunk(path: str) -> tuple[str, dict]:
+    """
+    Reads a chunk and its metadata sidecar.
+
+    Args:
+        path (str): The chunk file.
+
+    Returns:
+        tuple: The text to compare and the sidecar, or None without one.
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    sidecar = None
+    if os.path.isfile(path + METADATA_SUFFIX):
+        with open(path + METADATA_SUFFIX, encoding="utf-8") as f:
+            sidecar = json.load(f)
+        # Chunks start with their page's breadcrumb, which differs between copies
+        text = text.partition("\n\n")[2] or text
+    return text, sidecar
+
+
+def deduplicate_directory(
+    directory: str,
+    threshold: float = 0.8,
+    num_perm: int = 128,
+    shingle_size: int = 8,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Removes near-duplicate chunks from a chunk directory and records provenance on the kept ones.
+
+    In each cluster the longest chunk is kept (ties go to the first path), so
+    the choice is stable between runs. Its sidecar lists where the removed
+    copies came from.
+
+    Args:
+        directory (str): The chunk directory written by markdown_chunker.py.
+        threshold (float, optional): Jaccard similarity from which chunks are duplicates. Defaults to 0.8.
+        num_perm (int, optional): Signature length, a power of two. Defaults to 128.
+        shingle_size (int, optional): Shingle length in bytes. Defaults to 8.
+        dry_run (bool, optional): If True, only reports the clusters. Defaults to False.
+
+    Returns:
+        dict: Counts of chunks, clusters and removed chunks and bytes, and the clusters.
+    """
+    started = time.monotonic()
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names
+        if name.endswith(".md")
+    )
+    deduplicator = MinHashDeduplicator(threshold, num_perm, shingle_size)
+
+    chunks = [_read_chunk(path) for path in paths]
+    signatures = np.empty((len(paths), num_perm), dtype=np.uint64)
+    for i, (text, _) in enumerate(chunks):
+        signatures[i] = deduplicator.signature(text)
+    hashed = time.monotonic()
+
+    def relative(i):
+        return os.path.relpath(paths[i], directory).replace(os.sep, "/")
+
+    groups, removed_bytes = [], 0
+    for members in deduplicator.clusters(signatures):
+        members.sort(key=lambda i: (-len(chunks[i][0]), paths[i]))
+        kept, duplicates = members[0], members[1:]
+        groups.append(
+            {
+                "kept": relative(kept),
+                "removed": [relative(i) for i in duplicates],
+                "similarity": round(
+                    float(min(np.mean(signatures[kept] == signatures[i]) for i in duplicates)), 3
+                ),
+            }
+        )
+        removed_bytes += sum(len(chunks[i][0].encode("utf-8")) for i in duplicates)
+        if dry_run:
+            continue
+
+        sidecar = chunks[kept][1]
+        if sidecar is not None:
+            sources = [
+                chunks[i][1]["metadataAttributes"].get("source_url")
+                or chunks[i][1]["metadataAttributes"].get("source_file")
+                if chunks[i][1]
+                else relative(i)
+                for i in duplicates
+            ]
+            attributes = sidecar.setdefault("metadataAttributes", {})
+            attributes["duplicates"] = len(duplicates)
+            attributes["duplicate_sources"] = sorted(set(filter(None, sources)))[:MAX_PROVENANCE]
+            with open(paths[kept] + METADATA_SUFFIX, "w", encoding="utf-8") as f:
+                json.dump(sidecar, f, ensure_ascii=False)
+        for i in duplicates:
+            os.remove(paths[i])
+            if os.path.isfile(paths[i] + METADATA_SUFFIX):
+                os.remove(paths[i] + METADATA_SUFFIX)
+
+    removed = sum(len(group["removed"]) for group in groups)
+    total_bytes = sum(len(text.encode("utf-8")) for text, _ in chunks)
+    report = {
+        "chunks": len(paths),
+        "clusters": len(groups),
+        "removed": removed,
+        "removed_ratio": round(removed / len(paths), 3) if paths else 0.0,
+        "removed_mb": round(removed_bytes / 2**20, 2),
+        "total_mb": round(total_bytes / 2**20, 2),
+        "threshold": threshold,
+        "bands": deduplicator.bands,
+        "rows": deduplicator.rows,
+        "signature_s": round(hashed - started, 2),
+        "elapsed_s": round(time.monotonic() - started, 2),
+        "dry_run": dry_run,
+        "groups": sorted(groups, key=lambda group: group["kept"]),
+    }
+    logging.info(
+        f"Removed {removed} of {len(paths)} chunks ({report['removed_ratio']:.1%}, "
+        f"{report['removed_mb']} MB) in {len(groups)} clusters, {report['elapsed_s']}s"
+    )
+    return report
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="chunk_dedup")
+    p.add_argument("directory", help="chunk directory written by markdown_chunker.py")
+    p.add_argument("--threshold", type=float, default=0.8, help="Jaccard similarity from which chunks are duplicates")
+    p.add_argument("--num-perm", type=int, default=128, help="MinHash signature length, a power of two")
+    p.add_argument("--shingle-size", type=int, default=8, help="shingle length in bytes, at most 8")
+    p.add_argument("--report", help="write the report with every cluster to this JSON file")
+    p.add_argument("--dry-run", action="store_true", help="only report the clusters")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    report = deduplicate_directory(
+        args.directory, args.threshold, args.num_perm, args.shingle_size, args.dry_run
+    )
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
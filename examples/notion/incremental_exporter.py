@@ -0,0 +1,553 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from datetime import datetime, timezone
+
+import boto3
+
+from botocore.exceptions import ClientError
+from python_notion_exporter import NotionExporter
+
+
+class Manifest:
+    """Page id -> last-edited time and content hash of the previous export, stored locally or in S3."""
+
+    VERSION = 1
+
+    def __init__(self, path: str, checkpoint_interval: float = 30.0):
+        """
+        Initializes the Manifest class.
+
+        Args:
+            path (str): Local file path or `s3://bucket/key` of the manifest.
+            checkpoint_interval (float, optional): Minimum seconds between checkpoints written to S3. Defaults to 30.
+        """
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.pages = {}
+        self.removed_files = []
+        self.removed_pages = []
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+
+    def _s3_location(self) -> tuple[str, str]:
+        """
+        Splits an S3 manifest path into bucket and key.
+
+        Returns:
+            tuple: The bucket and key, or (None, None) for a local path.
+        """
+        if not self.path.startswith("s3://"):
+            return None, None
+        bucket, _, key = self.path[len("s3://") :].partition("/")
+        return bucket, key
+
+    def load(self) -> "Manifest":
+        """
+        Loads the manifest, starting empty if it does not exist yet.
+
+        Returns:
+            Manifest: This manifest.
+        """
+        bucket, key = self._s3_location()
+        try:
+            if bucket:
+                body = boto3.client("s3").get_object(Bucket=bucket, Key=key)["Body"]
+                data = json.loads(body.read())
+            else:
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+        except FileNotFoundError:
+            return self
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                raise
+            return self
+
+        self.pages = data.get("pages", {})
+        self.removed_files = data.get("removed_files", [])
+        self.removed_pages = data.get("removed_pages", [])
+        logging.info(f"Loaded manifest with {len(self.pages)} pages from {self.path}")
+        return self
+
+    def save(self):
+        """
+        Writes the manifest; local files are replaced atomically.
+        """
+        with self._lock:
+            body = json.dumps(
+                {
+                    "version": self.VERSION,
+                    "saved_at": datetime.now(timezone.utc).isoformat(),
+                    "pages": self.pages,
+                    "removed_files": sorted(set(self.removed_files)),
+                    "removed_pages": sorted(set(self.removed_pages)),
+                },
+                ensure_ascii=False,
+                indent=2,
+            )
+            self._saved_at = time.monotonic()
+
+        bucket, key = self._s3_location()
+        if bucket:
+            boto3.client("s3").put_object(
+                Bucket=bucket, Key=key, Body=body.encode("utf-8")
+            )
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(body)
+        os.replace(temp_path, self.path)
+
+    def checkpoint(self):
+        """
+        Saves the manifest, at most every checkpoint_interval seconds when it lives in S3.
+        """
+        bucket, _ = self._s3_location()
+        if bucket and time.monotonic() - self._saved_at < self.checkpoint_interval:
+            return
+        self.save()
+
+    def update_page(self, page_id: str, entry: dict):
+        """
+        Records a finished page and checkpoints, so an interrupted run can resume after it.
+
+        Args:
+            page_id (str): The ID of the Notion page.
+            entry (dict): The page's title, parent, children, last-edited time, hash and files.
+        """
+        with self._lock:
+            previous = self.pages.get(page_id, {})
+            entry["synced_hash"] = previous.get("synced_hash")
+            files = set(entry.get("files", []))
+            self.removed_files.extend(
+                f for f in previous.get("files", []) if f not in files
+            )
+            self.removed_files = [f for f in self.removed_files if f not in files]
+            self.pages[page_id] = entry
+        self.checkpoint()
+
+    def remove_page(self, page_id: str):
+        """
+        Forgets a page that no longer exists in Notion and queues its files for removal.
+
+        Args:
+            page_id (str): The ID of the Notion page.
+        """
+        with self._lock:
+            entry = self.pages.pop(page_id, None)
+            if entry is None:
+                return
+            self.removed_files.extend(entry.get("files", []))
+            if entry.get("synced_hash") is not None:
+                self.removed_pages.append(page_id)
+
+    def changes(self) -> dict:
+        """
+        Lists what changed since the last acknowledged sync.
+
+        Returns:
+            dict: Added and modified pages with their files, removed files and pages, and the unchanged count.
+        """
+        added, modified, unchanged = [], [], 0
+        with self._lock:
+            for page_id, entry in self.pages.items():
+                if entry.get("hash") is None:
+                    continue
+                change = {
+                    "page_id": page_id,
+                    "title": entry.get("title"),
+                    "files": entry.get("files", []),
+                }
+                if entry.get("synced_hash") is None:
+                    added.append(change)
+                elif entry["hash"] != entry["synced_hash"]:
+                    modified.append(change)
+                else:
+                    unchanged += 1
+
+            return {
+                "generated_at": datetime.now(timezone.utc).isoformat(),
+                "added": added,
+                "modified": modified,
+                "removed_files": sorted(set(self.removed_files)),
+                "removed_pages": sorted(set(self.removed_pages)),
+                "unchanged": unchanged,
+            }
+
+    def acknowledge(self):
+        """
+        Marks every current page as synced downstream and clears pending removals.
+        """
+        with self._lock:
+            for entry in self.pages.values():
+                if entry.get("hash") is not None:
+                    entry["synced_hash"] = entry["hash"]
+            self.removed_files = []
+            self.removed_pages = []
+        self.save()
+
+
+class IncrementalNotionExporter(NotionExporter):
+    """NotionExporter that only re-exports pages edited since the manifest was written."""
+
+    RECORD_BATCH_SIZE = 100
+    PAGE_ID_PATTERN = re.compile(r"([0-9a-f]{32})(?:\.[^.]+)?$")
+
+    def __init__(self, *args, manifest: Manifest, changes_path: str = None, **kwargs):
+        """
+        Initializes the IncrementalNotionExporter class.
+
+        Args:
+            *args: Positional arguments for NotionExporter.
+            manifest (Manifest): The manifest of the previous export.
+            changes_path (str, optional): Where to write the change list. Defaults to `<export_name>.changes.json` next to the export.
+            **kwargs: Keyword arguments for NotionExporter.
+        """
+        super().__init__(*args, **kwargs)
+        self.manifest = manifest
+        self.changes_path = (
+            changes_path
+            or f"{self.export_directory}{self.export_name}.changes.json"
+        )
+        self.tree = {}
+        self.jobs = {}
+
+    def _get_records(self, page_ids: list) -> dict:
+        """
+        Fetches block records for several pages in batched syncRecordValues requests.
+
+        Args:
+            page_ids (list): The IDs of the Notion pages.
+
+        Returns:
+            dict: Block records keyed by page ID. Pages Notion did not return are left out.
+        """
+        url = f"{self.api_url}/syncRecordValues"
+        records = {}
+        for i in range(0, len(page_ids), self.RECORD_BATCH_SIZE):
+            payload = json.dumps(
+                {
+                    "requests": [
+                        {"pointer": {"table": "block", "id": page_id}, "version": -1}
+                        for page_id in page_ids[i : i + self.RECORD_BATCH_SIZE]
+                    ]
+                }
+            )
+            response = self.session.request(
+                "POST", url, headers=self.query_headers, data=payload
+            )
+            response.raise_for_status()
+            blocks = response.json().get("recordMap", {}).get("block", {})
+            records.update(self._block_values(blocks))
+        return records
+
+    def _load_page_chunk(self, page_id: str) -> dict:
+        """
+        Fetches all blocks of a page, following loadPageChunk cursors.
+
+        Args:
+            page_id (str): The ID of the Notion page.
+
+        Returns:
+            dict: Block records keyed by block ID.
+        """
+        url = f"{self.api_url}/loadPageChunk"
+        blocks = {}
+        cursor = {"stack": []}
+        chunk_number = 0
+        while True:
+            payload = json.dumps(
+                {
+                    "pageId": page_id,
+                    "limit": 100,
+                    "cursor": cursor,
+                    "chunkNumber": chunk_number,
+                    "verticalColumns": False,
+                }
+            )
+            response = self.session.request(
+                "POST", url, headers=self.query_headers, data=payload
+            )
+            response.raise_for_status()
+            data = response.json()
+            blocks.update(
+                self._block_values(data.get("recordMap", {}).get("block", {}))
+            )
+
+            cursor = data.get("cursor") or {}
+            if not cursor.get("stack"):
+                return blocks
+            chunk_number += 1
+
+    @staticmethod
+    def _block_values(blocks: dict) -> dict:
+        """
+        Unwraps block records from a recordMap.
+
+        Args:
+            blocks (dict): The `block` section of a recordMap.
+
+        Returns:
+            dict: Block values keyed by block ID.
+        """
+        values = {}
+        for block_id, record in blocks.items():
+            value = record.get("value") or {}
+            # Newer responses wrap the value once more, next to the role
+            if "id" not in value and isinstance(value.get("value"), dict):
+                value = value["value"]
+            if value:
+                values[block_id] = value
+        return values
+
+    @staticmethod
+    def _title(record: dict) -> str:
+        """
+        Reads the plain-text title of a page block.
+
+        Args:
+            record (dict): The page's block record.
+
+        Returns:
+            str: The title.
+        """
+        title = record.get("properties", {}).get("title", [])
+        return "".join(segment[0] for segment in title if segment)
+
+    @staticmethod
+    def _child_pages(page_id: str, blocks: dict) -> list[str]:
+        """
+        Finds the subpages of a page among its blocks, including ones nested in columns or toggles.
+
+        Args:
+            page_id (str): The ID of the Notion page.
+            blocks (dict): The page's blocks from loadPageChunk.
+
+        Returns:
+            list: The IDs of the direct subpages.
+        """
+        children = []
+        for block_id, block in blocks.items():
+            if block_id == page_id or block.get("type") != "page" or not block.get("alive", True):
+                continue
+            parent = block.get("parent_id")
+            while parent in blocks and parent != page_id and blocks[parent].get("type") != "page":
+                parent = blocks[parent].get("parent_id")
+            if parent == page_id:
+                children.append(block_id)
+        return children
+
+    def _scan(self) -> dict:
+        """
+        Builds the current page tree, loading page contents only for pages edited since the manifest.
+
+        Returns:
+            dict: Pages keyed by ID with title, parent, children, last-edited time and a changed flag.
+        """
+        known = self.manifest.pages
+        roots = [self._to_uuid_format(page_id) for page_id in self.pages.values()]
+        records = self._get_records(list(dict.fromkeys(list(known) + roots)))
+
+        tree = {}
+        stack = [(page_id, None) for page_id in roots]
+        while stack:
+            page_id, parent = stack.pop()
+            record = records.get(page_id)
+            if page_id in tree or not record or not record.get("alive", True):
+                continue
+
+            entry = known.get(page_id, {})
+            edited = record.get("last_edited_time")
+            changed = entry.get("last_edited_time") != edited or entry.get("hash") is None
+            if changed:
+                blocks = self._load_page_chunk(page_id)
+                children = self._child_pages(page_id, blocks)
+                records.update({c: blocks[c] for c in children if c not in records})
+            else:
+                children = entry.get("children", [])
+                # Subpages whose export never finished have no manifest entry yet
+                missing = [c for c in children if c not in records]
+                if missing:
+                    records.update(self._get_records(missing))
+
+            tree[page_id] = {
+                "title": self._title(record),
+                "parent": parent,
+                "children": children,
+                "last_edited_time": edited,
+                "changed": changed,
+            }
+            if self.recursive:
+                stack.extend((child, page_id) for child in children)
+
+        return tree
+
+    def _subtree(self, page_id: str) -> list[str]:
+        """
+        Lists a page and all of its descendants in the current tree.
+
+        Args:
+            page_id (str): The ID of the Notion page.
+
+        Returns:
+            list: The page IDs.
+        """
+        pages = [page_id]
+        for child in self.tree[page_id]["children"]:
+            if child in self.tree:
+                pages.extend(self._subtree(child))
+        return pages
+
+    def _plan(self) -> dict:
+        """
+        Chooses export jobs: one recursive export for every subtree that changed entirely,
+        and a single-page export for other changed pages.
+
+        Returns:
+            dict: Tuples of page ID and recursive flag, keyed by page ID.
+        """
+        fully_changed = {}
+
+        def is_fully_changed(page_id):
+            if page_id not in fully_changed:
+                node = self.tree[page_id]
+                fully_changed[page_id] = node["changed"] and all(
+                    is_fully_changed(child)
+                    for child in node["children"]
+                    if child in self.tree
+                )
+            return fully_changed[page_id]
+
+        jobs = {}
+        stack = [self._to_uuid_format(page_id) for page_id in self.pages.values()]
+        while stack:
+            page_id = stack.pop()
+            if page_id not in self.tree or page_id in jobs:
+                continue
+            if self.recursive and is_fully_changed(page_id):
+                jobs[page_id] = (page_id, True)
+                continue
+            if self.tree[page_id]["changed"]:
+                jobs[page_id] = (page_id, False)
+            if self.recursive:
+                stack.extend(self.tree[page_id]["children"])
+        return jobs
+
+    def _page_of(self, file_name: str) -> str:
+        """
+        Reads the page ID Notion appends to exported file names.
+
+        Args:
+            file_name (str): The exported file name.
+
+        Returns:
+            str: The page ID, or None if the name carries none.
+        """
+        match = self.PAGE_ID_PATTERN.search(os.path.basename(file_name).replace(" ", ""))
+        return self._to_uuid_format(match.group(1)) if match else None
+
+    def _hash_files(self, files: list) -> str:
+        """
+        Hashes the names and contents of a page's exported files.
+
+        Args:
+            files (list): File names relative to the export directory.
+
+        Returns:
+            str: The SHA-256 hex digest.
+        """
+        directory_path = f"{self.export_directory}{self.export_name}"
+        digest = hashlib.sha256()
+        for file_name in sorted(files):
+            digest.update(file_name.encode("utf-8") + b"\0")
+            with open(os.path.join(directory_path, file_name), "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def _record_result(self, result: dict):
+        """
+        Checkpoints every page covered by a finished export job in the manifest.
+
+        Args:
+            result (dict): The job's result from `_download_page`.
+        """
+        if result["state"] == "failure":
+            return
+
+        job_page = result["name"]
+        pages = self._subtree(job_page) if self.jobs[job_page][1] else [job_page]
+        files_by_page = {page_id: [] for page_id in pages}
+        for file_name in result.get("files", []):
+            page_id = self._page_of(file_name)
+            files_by_page[page_id if page_id in files_by_page else job_page].append(
+                file_name
+            )
+
+        for page_id in pages:
+            node = self.tree[page_id]
+            self.manifest.update_page(
+                page_id,
+                {
+                    "title": node["title"],
+                    "parent": node["parent"],
+                    "children": node["children"],
+                    "last_edited_time": node["last_edited_time"],
+                    "hash": self._hash_files(files_by_page[page_id]),
+                    "files": sorted(files_by_page[page_id]),
+                },
+            )
+
+    def _remove_deleted_pages(self):
+        """
+        Drops pages that are gone from the tree and deletes their files from the export directory.
+        """
+        directory_path = f"{self.export_directory}{self.export_name}"
+        for page_id in [p for p in self.manifest.pages if p not in self.tree]:
+            self.manifest.remove_page(page_id)
+
+        for file_name in self.manifest.removed_files:
+            path = os.path.join(directory_path, file_name)
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def process(self) -> dict:
+        """
+        Exports the pages changed since the manifest and writes the change list.
+
+        Returns:
+            dict: The change list.
+        """
+        self.tree = self._scan()
+        self.jobs = self._plan()
+        changed = sum(1 for node in self.tree.values() if node["changed"])
+        logging.info(
+            f"{changed} of {len(self.tree)} pages changed, exporting {len(self.jobs)} jobs..."
+        )
+
+        results = self._run(self.jobs, on_result=self._record_result)
+        failed = [r["name"] for r in results if r["state"] == "failure"]
+
+        if self.tree:
+            self._remove_deleted_pages()
+        self.manifest.save()
+
+        changes = self.manifest.changes()
+        changes["export_name"] = self.export_name
+        changes["failed"] = failed
+        with open(self.changes_path, "w", encoding="utf-8") as f:
+            json.dump(changes, f, ensure_ascii=False, indent=2)
+
+        logging.info(
+            f"Added {len(changes['added'])}, modified {len(changes['modified'])}, "
+            f"removed {len(changes['removed_pages'])} pages, {len(failed)} failed"
+        )
+        return changes
@@ -0,0 +1,390 @@
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+from datetime import datetime, timezone
+
+import boto3
+
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+
+class KnowledgeBaseIngester:
+    """
+    Pushes only the documents a sync changed into a Bedrock Knowledge Base.
+
+    Added and modified objects from the upload change set are ingested, and
+    deleted ones removed, through the direct document ingestion APIs instead
+    of re-embedding the whole data source. Above `full_threshold` changed
+    documents a regular ingestion job is cheaper, so one is started instead.
+    Either way the call waits for the result and then bumps a version marker
+    the bot's retrieval cache keys on.
+    """
+
+    INGEST_BATCH_SIZE = 25
+    DOCUMENT_BATCH_SIZE = 10
+    METADATA_SUFFIX = ".metadata.json"
+
+    DOCUMENT_PENDING = {"STARTING", "PENDING", "IN_PROGRESS", "DELETING", "DELETE_IN_PROGRESS"}
+    DOCUMENT_FAILED = {"FAILED", "METADATA_UPDATE_FAILED", "IGNORED"}
+    JOB_PENDING = {"STARTING", "IN_PROGRESS", "STOPPING"}
+
+    def __init__(
+        self,
+        knowledge_base_id: str,
+        data_source_id: str,
+        full_threshold: int = 200,
+        poll_interval: float = 5.0,
+        max_poll_interval: float = 60.0,
+        timeout: float = 3600.0,
+        marker_table: str = None,
+        region_name: str = None,
+    ):
+        """
+        Initializes the KnowledgeBaseIngester class.
+
+        Args:
+            knowledge_base_id (str): The Knowledge Base ID.
+            data_source_id (str): The ID of its S3 data source.
+            full_threshold (int, optional): Changed documents above which a full ingestion job is started. Defaults to 200.
+            poll_interval (float, optional): Initial delay in seconds between status polls. Defaults to 5.
+            max_poll_interval (float, optional): Upper bound in seconds for the backed-off poll delay. Defaults to 60.
+            timeout (float, optional): Seconds to wait for ingestion before giving up. Defaults to 3600.
+            marker_table (str, optional): DynamoDB table of the bot to write the version marker to. Defaults to none.
+            region_name (str, optional): The AWS region. Defaults to the session's region.
+        """
+        self.knowledge_base_id = knowledge_base_id
+        self.data_source_id = data_source_id
+        self.full_threshold = full_threshold
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.marker_table = marker_table
+        self.bedrock_agent = boto3.client(
+            "bedrock-agent",
+            region_name=region_name,
+            config=Config(retries={"mode": "adaptive", "max_attempts": 10}),
+        )
+        self.s3 = boto3.client("s3", region_name=region_name)
+        self.dynamodb = boto3.resource("dynamodb", region_name=region_name)
+
+    @staticmethod
+    def _uri(bucket: str, key: str) -> str:
+        return f"s3://{bucket}/{key}"
+
+    @staticmethod
+    def _identifier(uri: str) -> dict:
+        return {"dataSourceType": "S3", "s3": {"uri": uri}}
+
+    def _batches(self, items: list, size: int):
+        for i in range(0, len(items), size):
+            yield items[i : i + size]
+
+    def _next_poll_delay(self, attempt: int) -> float:
+        """
+        Computes the delay before the next status poll, doubling up to max_poll_interval with jitter.
+
+        Args:
+            attempt (int): Number of polls so far.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        delay = min(self.max_poll_interval, self.poll_interval * (2**attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def plan(self, changes: list[dict]) -> tuple[list[str], list[str]]:
+        """
+        Merges upload change sets into the documents to ingest and delete.
+
+        A changed metadata sidecar re-ingests the document it belongs to; the
+        sidecars themselves are never ingested as documents.
+
+        Args:
+            changes (list): Change sets written by s3_uploader.py.
+
+        Returns:
+            tuple: S3 URIs of the documents to ingest and to delete.
+        """
+        ingest, delete = set(), set()
+        for change in changes:
+            bucket = change["destination"][len("s3://") :].partition("/")[0]
+            for entry in change.get("uploaded", []):
+                uri = self._uri(bucket, entry["key"])
+                ingest.add(uri.removesuffix(self.METADATA_SUFFIX))
+                delete.discard(uri.removesuffix(self.METADATA_SUFFIX))
+            for key in change.get("deleted", []):
+                uri = self._uri(bucket, key)
+                if uri.endswith(self.METADATA_SUFFIX):
+                    # The document stays; re-ingest it without the sidecar
+                    if uri.removesuffix(self.METADATA_SUFFIX) not in delete:
+                        ingest.add(uri.removesuffix(self.METADATA_SUFFIX))
+                else:
+                    ingest.discard(uri)
+                    delete.add(uri)
+        return sorted(ingest), sorted(delete)
+
+    def _sidecar(self, uri: str) -> dict:
+        """
+        Finds the metadata sidecar of a document.
+
+        Args:
+            uri (str): The document's S3 URI.
+
+        Returns:
+            dict: The metadata location for IngestKnowledgeBaseDocuments, or None.
+        """
+        bucket, _, key = uri[len("s3://") :].partition("/")
+        try:
+            self.s3.head_object(Bucket=bucket, Key=f"{key}{self.METADATA_SUFFIX}")
+        except ClientError:
+            return None
+        return {
+            "type": "S3_LOCATION",
+            "s3Location": {"uri": f"{uri}{self.METADATA_SUFFIX}"},
+        }
+
+    def _ingest_documents(self, uris: list) -> list[dict]:
+        """
+        Submits documents for ingestion, 25 per request.
+
+        Args:
+            uris (list): The documents' S3 URIs.
+
+        Returns:
+            list: Documents that were rejected, with the reason.
+        """
+        failed = []
+        for batch in self._batches(uris, self.INGEST_BATCH_SIZE):
+            documents = []
+            for uri in batch:
+                document = {
+                    "content": {
+                        "dataSourceType": "S3",
+                        "s3": {"s3Location": {"uri": uri}},
+                    }
+                }
+                metadata = self._sidecar(uri)
+                if metadata:
+                    document["metadata"] = metadata
+                documents.append(document)
+            try:
+                self.bedrock_agent.ingest_knowledge_base_documents(
+                    knowledgeBaseId=self.knowledge_base_id,
+                    dataSourceId=self.data_source_id,
+                    documents=documents,
+                )
+            except ClientError as e:
+                failed.extend({"uri": uri, "status": "REJECTED", "reason": str(e)} for uri in batch)
+        return failed
+
+    def _delete_documents(self, uris: list) -> list[dict]:
+        """
+        Removes documents from the Knowledge Base, 10 per request.
+
+        Args:
+            uris (list): The documents' S3 URIs.
+
+        Returns:
+            list: Documents that were rejected, with the reason.
+        """
+        failed = []
+        for batch in self._batches(uris, self.DOCUMENT_BATCH_SIZE):
+            try:
+                self.bedrock_agent.delete_knowledge_base_documents(
+                    knowledgeBaseId=self.knowledge_base_id,
+                    dataSourceId=self.data_source_id,
+                    documentIdentifiers=[self._identifier(uri) for uri in batch],
+                )
+            except ClientError as e:
+                failed.extend({"uri": uri, "status": "REJECTED", "reason": str(e)} for uri in batch)
+        return failed
+
+    def _wait_for_documents(self, uris: list) -> dict:
+        """
+        Polls document status with backoff until none is pending.
+
+        Args:
+            uris (list): The documents' S3 URIs.
+
+        Returns:
+            dict: Final status and reason keyed by URI.
+        """
+        pending = list(uris)
+        statuses = {}
+        started = time.monotonic()
+        attempt = 0
+
+        while pending:
+            if time.monotonic() - started > self.timeout:
+                for uri in pending:
+                    statuses[uri] = {"status": "TIMED_OUT", "reason": None}
+                break
+            time.sleep(self._next_poll_delay(attempt))
+            attempt += 1
+
+            still_pending = []
+            for batch in self._batches(pending, self.DOCUMENT_BATCH_SIZE):
+                response = self.bedrock_agent.get_knowledge_base_documents(
+                    knowledgeBaseId=self.knowledge_base_id,
+                    dataSourceId=self.data_source_id,
+                    documentIdentifiers=[self._identifier(uri) for uri in batch],
+                )
+                for detail in response.get("documentDetails", []):
+                    uri = detail["identifier"]["s3"]["uri"]
+                    if detail["status"] in self.DOCUMENT_PENDING:
+                        still_pending.append(uri)
+                    else:
+                        statuses[uri] = {
+                            "status": detail["status"],
+                            "reason": detail.get("statusReason"),
+                        }
+            pending = still_pending
+            logging.info(f"{len(statuses)} documents done, {len(pending)} pending")
+        return statuses
+
+    def _run_job(self) -> dict:
+        """
+        Starts a full ingestion job and polls it with backoff until it ends.
+
+        Returns:
+            dict: The finished ingestion job.
+        """
+        job = self.bedrock_agent.start_ingestion_job(
+            knowledgeBaseId=self.knowledge_base_id,
+            dataSourceId=self.data_source_id,
+        )["ingestionJob"]
+        logging.info(f"Started ingestion job {job['ingestionJobId']}")
+
+        started = time.monotonic()
+        attempt = 0
+        while job["status"] in self.JOB_PENDING:
+            if time.monotonic() - started > self.timeout:
+                raise TimeoutError(f"Ingestion job {job['ingestionJobId']} did not finish")
+            time.sleep(self._next_poll_delay(attempt))
+            attempt += 1
+            job = self.bedrock_agent.get_ingestion_job(
+                knowledgeBaseId=self.knowledge_base_id,
+                dataSourceId=self.data_source_id,
+                ingestionJobId=job["ingestionJobId"],
+            )["ingestionJob"]
+            logging.info(f"Ingestion job {job['ingestionJobId']} is {job['status']}")
+        return job
+
+    def _write_marker(self, result: dict):
+        """
+        Writes the `kb-version:<id>` item the bot's retrieval cache keys on.
+
+        Args:
+            result (dict): The ingestion result.
+        """
+        if not self.marker_table:
+            return
+        self.dynamodb.Table(self.marker_table).put_item(
+            Item={
+                "id": f"kb-version:{self.knowledge_base_id}",
+                "version": result["version"],
+                "mode": result["mode"],
+                "ingested": len(result["ingested"]),
+                "deleted": len(result["deleted"]),
+                "updated_at": result["finished_at"],
+            }
+        )
+        logging.info(f"Knowledge Base version is now {result['version']}")
+
+    def run(self, changes: list[dict] = None, full: bool = False) -> dict:
+        """
+        Ingests the changes, or the whole data source.
+
+        Args:
+            changes (list, optional): Change sets written by s3_uploader.py.
+            full (bool, optional): If True, starts a full ingestion job. Defaults to False.
+
+        Returns:
+            dict: The mode used, ingested and deleted documents, failures and the new version.
+        """
+        ingest, delete = self.plan(changes or [])
+        result = {"mode": "none", "ingested": [], "deleted": [], "failed": [], "version": None}
+
+        if full or len(ingest) + len(delete) > self.full_threshold:
+            job = self._run_job()
+            result.update(mode="full", ingestion_job=job)
+            if job["status"] == "COMPLETE":
+                result["ingested"], result["deleted"] = ingest, delete
+                result["version"] = job["ingestionJobId"]
+            else:
+                result["failed"].append(
+                    {"job": job["ingestionJobId"], "status": job["status"], "reason": job.get("failureReasons")}
+                )
+        elif ingest or delete:
+            result["mode"] = "documents"
+            rejected = self._delete_documents(delete) + self._ingest_documents(ingest)
+            rejected_uris = {f["uri"] for f in rejected}
+            statuses = self._wait_for_documents(
+                [uri for uri in delete + ingest if uri not in rejected_uris]
+            )
+            result["failed"] = rejected
+            for uri in delete:
+                # NOT_FOUND means the deletion went through
+                if uri in statuses and statuses[uri]["status"] != "NOT_FOUND":
+                    result["failed"].append({"uri": uri, **statuses[uri]})
+                elif uri not in rejected_uris:
+                    result["deleted"].append(uri)
+            for uri in ingest:
+                status = statuses.get(uri)
+                if status and status["status"] not in self.DOCUMENT_FAILED and status["status"] != "TIMED_OUT":
+                    result["ingested"].append(uri)
+                elif uri not in rejected_uris:
+                    result["failed"].append({"uri": uri, **(status or {})})
+
+        result["finished_at"] = datetime.now(timezone.utc).isoformat()
+        if result["ingested"] or result["deleted"] or result["version"]:
+            result["version"] = f"{result['finished_at']}/{result['version'] or 'documents'}"
+            self._write_marker(result)
+
+        logging.info(
+            f"Ingested {len(result['ingested'])}, deleted {len(result['deleted'])}, "
+            f"failed {len(result['failed'])} ({result['mode']})"
+        )
+        return result
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="kb_ingestion")
+    p.add_argument("--changes", action="append", default=[], help="upload change set JSON, may be repeated")
+    p.add_argument("--full", action="store_true", help="start a full ingestion job")
+    p.add_argument("--full-threshold", type=int, default=200, help="changed documents above which a full job is started")
+    p.add_argument("--output", help="write the result to this JSON file")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    changes = []
+    for path in args.changes:
+        with open(path, encoding="utf-8") as f:
+            changes.append(json.load(f))
+
+    result = KnowledgeBaseIngester(
+        os.environ["KNOWLEDGE_BASE_ID"],
+        os.environ["DATA_SOURCE_ID"],
+        full_threshold=args.full_threshold,
+        marker_table=os.getenv("DYNAMODB_TABLE_NAME"),
+        region_name=os.getenv("AWS_REGION"),
+    ).run(changes, full=args.full)
+
+    body = json.dumps(result, ensure_ascii=False, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(body)
+    else:
+        print(body)
+
+    sys.exit(1 if result["failed"] else 0)
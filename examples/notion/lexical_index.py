@@ -0,0 +1,301 @@
+import argparse
+import bisect
+import hashlib
+import heapq
+import json
+import logging
+import mmap
+import os
+import random
+import re
+import sys
+import time
+
+from collections import Counter
+
+import numpy as np
+
+
+MAGIC = b"GLEXIDX1"
+MAX_POSTINGS = 1000
+MIN_IMPACT_RATIO = 0.2
+
+# Must match LexicalIndex.TOKEN_PATTERN and LexicalIndex.tokens in handler.py
+TOKEN_PATTERN = re.compile(r"[가-힣]+|[^\W_가-힣]+")
+
+
+def tokens(text: str, ngram: int = 2) -> list:
+    """
+    Splits text into Hangul character n-grams and whole words of other scripts.
+
+    Korean attaches particles and endings to words, so "배포는" and "배포를"
+    share the bigram "배포" where whole words would not match.
+
+    Args:
+        text (str): The text.
+        ngram (int, optional): Length of the Hangul n-grams. Defaults to 2.
+
+    Returns:
+        list: The tokens, repeats included.
+    """
+    result = []
+    for run in TOKEN_PATTERN.findall(text.lower()):
+        if len(run) > ngram and "가" <= run[0] <= "힣":
+            result.extend(run[i : i + ngram] for i in range(len(run) - ngram + 1))
+        else:
+            result.append(run)
+    return result
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def build_index(source: str, output: str, ngram: int = 2, k1: float = 1.2, b: float = 0.75) -> dict:
+    """
+    Builds a BM25 index of the Markdown files under a directory.
+
+    The file is a header followed by flat arrays that the bot memory-maps:
+    sorted term hashes, posting offsets, posting documents and their BM25
+    weights (heaviest first within each term), and the document texts.
+
+    Args:
+        source (str): The directory of Markdown chunks.
+        output (str): The index file to write.
+        ngram (int, optional): Length of the Hangul n-grams. Defaults to 2.
+        k1 (float, optional): BM25 term frequency saturation. Defaults to 1.2.
+        b (float, optional): BM25 length normalization. Defaults to 0.75.
+
+    Returns:
+        dict: Counts of documents, terms and postings, the file size and the build time.
+    """
+    started = time.monotonic()
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(source)
+        for name in names
+        if name.endswith(".md")
+    )
+
+    vocabulary = {}
+    term_ids, doc_ids, frequencies, lengths, texts = [], [], [], [], []
+    for doc, path in enumerate(paths):
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        counts = Counter(tokens(text, ngram))
+        for term, count in counts.items():
+            term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+            doc_ids.append(doc)
+            frequencies.append(count)
+        lengths.append(sum(counts.values()))
+        texts.append(text.encode("utf-8"))
+
+    term_ids = np.array(term_ids, dtype=np.int64)
+    doc_ids = np.array(doc_ids, dtype=np.uint32)
+    frequencies = np.array(frequencies, dtype=np.float64)
+    lengths = np.array(lengths, dtype=np.float64)
+
+    document_frequency = np.bincount(term_ids, minlength=len(vocabulary))
+    idf = np.log1p((len(paths) - document_frequency + 0.5) / (document_frequency + 0.5))
+    norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1.0)) if len(paths) else lengths
+    weights = (idf[term_ids] * frequencies * (k1 + 1) / (frequencies + norm[doc_ids])).astype(np.float32)
+
+    hashes = np.array([term_hash(term) for term in vocabulary], dtype=np.uint64)
+    if len(np.unique(hashes)) < len(hashes):
+        logging.warning("Term hash collision, the colliding terms share postings")
+    order = np.lexsort((-weights, hashes[term_ids]))
+    posting_hashes = hashes[term_ids][order]
+    terms = np.unique(posting_hashes)
+    offsets = np.searchsorted(posting_hashes, terms).astype(np.uint64)
+    offsets = np.append(offsets, np.uint64(len(order)))
+    doc_offsets = np.cumsum([0] + [len(text) for text in texts], dtype=np.uint64)
+
+    sections, blobs, position = {}, [], 0
+    for name, data, fmt in [
+        ("terms", terms.astype("<u8"), "Q"),
+        ("offsets", offsets.astype("<u8"), "Q"),
+        ("postings", doc_ids[order].astype("<u4"), "I"),
+        ("weights", weights[order].astype("<f4"), "f"),
+        ("doc_offsets", doc_offsets.astype("<u8"), "Q"),
+        ("texts", np.frombuffer(b"".join(texts), dtype=np.uint8), "B"),
+    ]:
+        blob = data.tobytes()
+        sections[name] = [position, len(blob), fmt]
+        blobs.append(blob + b"\0" * (-len(blob) % 8))
+        position += len(blobs[-1])
+
+    header = json.dumps(
+        {
+            "byteorder": "little",
+            "ngram": ngram,
+            "k1": k1,
+            "b": b,
+            "docs": len(paths),
+            "sections": sections,
+        }
+    ).encode("utf-8")
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(f"{output}.tmp", "wb") as f:
+        f.write(MAGIC + len(header).to_bytes(8, "little") + header)
+        f.write(b"\0" * (-(16 + len(header)) % 8))
+        for blob in blobs:
+            f.write(blob)
+    os.replace(f"{output}.tmp", output)
+
+    stats = {
+        "docs": len(paths),
+        "terms": len(terms),
+        "postings": len(order),
+        "size_mb": round(os.path.getsize(output) / 2**20, 2),
+        "elapsed_s": round(time.monotonic() - started, 2),
+    }
+    logging.info(
+        f"Indexed {stats['docs']} documents, {stats['terms']} terms and {stats['postings']} postings "
+        f"into {output} ({stats['size_mb']} MB) in {stats['elapsed_s']}s"
+    )
+    return stats
+
+
+class LexicalSearcher:
+    """
+    Reads an index written by build_index, for checking it offline.
+
+    Reads and scores the file the same way as LexicalIndex in handler.py,
+    with mmap and memoryview only, so the bot does not need numpy and the
+    benchmark measures what the Lambda does.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initializes the LexicalSearcher class.
+
+        Args:
+            path (str): The index file.
+        """
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if bytes(view[:8]) != MAGIC:
+            raise ValueError(f"Not a lexical index: {path}")
+        header_size = int.from_bytes(view[8:16], "little")
+        header = json.loads(bytes(view[16 : 16 + header_size]))
+
+        base = (16 + header_size + 7) // 8 * 8
+        self.sections = {
+            name: view[base + offset : base + offset + size].cast(fmt)
+            for name, (offset, size, fmt) in header["sections"].items()
+        }
+        self.ngram = header["ngram"]
+        self.docs = header["docs"]
+
+    def passage(self, doc: int) -> str:
+        offsets = self.sections["doc_offsets"]
+        return bytes(self.sections["texts"][offsets[doc] : offsets[doc + 1]]).decode("utf-8")
+
+    def search(self, query: str, limit: int = 5) -> list:
+        """
+        Finds the best-scoring documents for a query.
+
+        Terms whose heaviest posting weighs less than MIN_IMPACT_RATIO of the
+        strongest term's are skipped, and each posting list is read heaviest
+        first up to MAX_POSTINGS.
+
+        Args:
+            query (str): The query.
+            limit (int, optional): Number of results. Defaults to 5.
+
+        Returns:
+            list: (score, share of the query's weight matched, document) per result, best first.
+        """
+        terms, offsets = self.sections["terms"], self.sections["offsets"]
+        postings, weights = self.sections["postings"], self.sections["weights"]
+        lists, missing = [], 0
+        for term, count in Counter(tokens(query, self.ngram)).items():
+            key = term_hash(term)
+            i = bisect.bisect_left(terms, key)
+            if i == len(terms) or terms[i] != key:
+                missing += 1
+                continue
+            start = offsets[i]
+            end = min(offsets[i + 1], start + MAX_POSTINGS)
+            lists.append((start, end, count, weights[start] * count))
+        if not lists:
+            return []
+
+        strongest = max(impact for _, _, _, impact in lists)
+        scores, matched = {}, {}
+        for start, end, count, impact in lists:
+            if impact < strongest * MIN_IMPACT_RATIO:
+                continue
+            for doc, weight in zip(postings[start:end].tolist(), weights[start:end].tolist()):
+                scores[doc] = scores.get(doc, 0.0) + weight * count
+                matched[doc] = matched.get(doc, 0.0) + impact
+
+        total = sum(impact for _, _, _, impact in lists) + missing * strongest
+        ranked = heapq.nlargest(limit, scores, key=scores.__getitem__)
+        return [(round(scores[doc], 3), round(matched[doc] / total, 3), doc) for doc in ranked]
+
+
+def benchmark(searcher: LexicalSearcher, queries: int, seed: int = 7) -> dict:
+    """
+    Times lookups with queries sampled from the indexed documents.
+
+    Args:
+        searcher (LexicalSearcher): The index.
+        queries (int): Number of queries.
+        seed (int, optional): The random seed. Defaults to 7.
+
+    Returns:
+        dict: Median and 99th percentile lookup times in microseconds.
+    """
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(queries):
+        words = searcher.passage(rng.randrange(searcher.docs)).split()
+        start = rng.randrange(max(len(words) - 6, 1))
+        samples.append(" ".join(words[start : start + 6]))
+
+    timings = []
+    for query in samples:
+        started = time.perf_counter()
+        searcher.search(query)
+        timings.append((time.perf_counter() - started) * 1e6)
+    timings.sort()
+    return {
+        "queries": queries,
+        "p50_us": round(timings[len(timings) // 2]),
+        "p99_us": round(timings[int(len(timings) * 0.99)]),
+    }
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="lexical_index")
+    p.add_argument("path", help="index file to build or search")
+    p.add_argument("--source", help="directory of Markdown chunks to index")
+    p.add_argument("--ngram", type=int, default=2, help="length of the Hangul character n-grams")
+    p.add_argument("--query", action="append", help="search the index offline")
+    p.add_argument("--limit", type=int, default=5, help="results per query")
+    p.add_argument("--benchmark", type=int, metavar="N", help="time N sampled lookups")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    if args.source:
+        build_index(args.source, args.path, args.ngram)
+
+    if args.query or args.benchmark:
+        searcher = LexicalSearcher(args.path)
+        for query in args.query or []:
+            print(f"# {query}")
+            for score, coverage, doc in searcher.search(query, args.limit):
+                first_line = searcher.passage(doc).strip().splitlines()[0]
+                print(f"{score:8.3f} {coverage:.2f} {first_line}")
+        if args.benchmark:
+            print(json.dumps(benchmark(searcher, args.benchmark), indent=2))
+
+    if not (args.source or args.query or args.benchmark):
+        sys.exit("Nothing to do: give --source to build, --query or --benchmark to search")
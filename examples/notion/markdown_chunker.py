@@ -0,0 +1,537 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+
+Block = namedtuple("Block", ["kind", "text", "level"])
+
+FENCE_PATTERN = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+HEADING_PATTERN = re.compile(r"^ {0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+TABLE_SEPARATOR_PATTERN = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?。])\s+")
+PAGE_ID_PATTERN = re.compile(r"([0-9a-f]{32})(?:\.[^.]+)?$")
+
+METADATA_SUFFIX = ".metadata.json"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimates the token count of a text, like the bot does.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: About 4 ASCII or 1.5 other characters per token.
+    """
+    if not text:
+        return 0
+    # Counted in C instead of a Python loop over every character
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return int(ascii_chars / 4 + (len(text) - ascii_chars) / 1.5) + 1
+
+
+def parse_blocks(markdown: str) -> list[Block]:
+    """
+    Splits Markdown into headings, paragraphs, tables and fenced code blocks.
+
+    Args:
+        markdown (str): The Markdown text.
+
+    Returns:
+        list: The blocks in document order. Code blocks keep their fences.
+    """
+    blocks = []
+    lines = []
+    kind = None
+    fence = None
+
+    def flush():
+        nonlocal lines, kind
+        if lines:
+            blocks.append(Block(kind, "\n".join(lines), 0))
+        lines, kind = [], None
+
+    for line in markdown.splitlines():
+        if fence:
+            lines.append(line)
+            match = FENCE_PATTERN.match(line)
+            closes = (
+                match
+                and match.group(1)[0] == fence[0]
+                and len(match.group(1)) >= len(fence)
+                and not line.strip()[len(match.group(1)) :]
+            )
+            if closes:
+                fence = None
+                flush()
+            continue
+
+        first = line.lstrip()[:1]
+        if not first:
+            flush()
+            continue
+
+        # Only lines starting with these can open a fence or be a heading
+        if first in "`~#":
+            match = FENCE_PATTERN.match(line)
+            if match:
+                flush()
+                fence, kind, lines = match.group(1), "code", [line]
+                continue
+
+            match = HEADING_PATTERN.match(line)
+            if match:
+                flush()
+                blocks.append(Block("heading", match.group(2), len(match.group(1))))
+                continue
+
+        line_kind = "table" if first == "|" else "paragraph"
+        if kind != line_kind:
+            flush()
+            kind = line_kind
+        lines.append(line)
+
+    # An unclosed fence runs to the end of the document
+    flush()
+    return blocks
+
+
+class MarkdownChunker:
+    """
+    Splits Markdown into chunks of at most `max_tokens` at heading, paragraph and fence boundaries.
+
+    A chunk ends at a heading once it holds at least `min_tokens`, so short
+    sections are merged instead of embedded alone. Code blocks and tables are
+    only split when a single one exceeds the budget, and then along lines or
+    rows, with the fence or header row repeated in every piece.
+    """
+
+    def __init__(self, max_tokens: int = 500, min_tokens: int = 100):
+        """
+        Initializes the MarkdownChunker class.
+
+        Args:
+            max_tokens (int, optional): Token budget of a chunk. Defaults to 500.
+            min_tokens (int, optional): Size a chunk must reach before a heading starts a new one. Defaults to 100.
+        """
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+
+    def _split_lines(self, lines: list, budget: int, head: list = None, tail: list = None) -> list[str]:
+        """
+        Groups lines into pieces within the budget, wrapping each in head and tail lines.
+
+        Args:
+            lines (list): The lines to group.
+            budget (int): Token budget of a piece.
+            head (list, optional): Lines repeated at the start of every piece, e.g. an opening fence.
+            tail (list, optional): Lines repeated at the end of every piece, e.g. a closing fence.
+
+        Returns:
+            list: The pieces.
+        """
+        head, tail = head or [], tail or []
+        overhead = estimate_tokens("\n".join(head + tail))
+        pieces, current, tokens = [], [], overhead
+        for line in lines:
+            line_tokens = estimate_tokens(line)
+            if current and tokens + line_tokens > budget:
+                pieces.append("\n".join(head + current + tail))
+                current, tokens = [], overhead
+            if overhead + line_tokens > budget:
+                # A single line over budget is split on sentences, then cut
+                for part in self._split_text(line, budget - overhead):
+                    pieces.append("\n".join(head + [part] + tail))
+                continue
+            current.append(line)
+            tokens += line_tokens
+        if current:
+            pieces.append("\n".join(head + current + tail))
+        return pieces
+
+    def _split_text(self, text: str, budget: int) -> list[str]:
+        """
+        Splits a single line on sentence ends, cutting sentences that still exceed the budget.
+
+        Args:
+            text (str): The line.
+            budget (int): Token budget of a piece.
+
+        Returns:
+            list: The pieces.
+        """
+        pieces, current = [], ""
+        for sentence in SENTENCE_PATTERN.split(text):
+            while estimate_tokens(sentence) > budget:
+                # Characters per token vary; cut at a size that fits either way
+                cut = max(1, int(budget * 1.5))
+                pieces.append(sentence[:cut])
+                sentence = sentence[cut:]
+            candidate = f"{current} {sentence}" if current else sentence
+            if current and estimate_tokens(candidate) > budget:
+                pieces.append(current)
+                candidate = sentence
+            current = candidate
+        if current:
+            pieces.append(current)
+        return pieces
+
+    def _split_block(self, block: Block, budget: int) -> list[str]:
+        """
+        Splits a block that exceeds the budget.
+
+        Args:
+            block (Block): The block.
+            budget (int): Token budget of a piece.
+
+        Returns:
+            list: The pieces.
+        """
+        lines = block.text.split("\n")
+        if block.kind == "code":
+            closed = len(lines) > 1 and FENCE_PATTERN.match(lines[-1])
+            fence = FENCE_PATTERN.match(lines[0]).group(1)
+            body = lines[1:-1] if closed else lines[1:]
+            return self._split_lines(body, budget, head=[lines[0]], tail=[fence])
+        if block.kind == "table" and len(lines) > 2 and TABLE_SEPARATOR_PATTERN.match(lines[1]):
+            return self._split_lines(lines[2:], budget, head=lines[:2])
+        return self._split_lines(lines, budget)
+
+    def chunk(self, markdown: str, title_path: list = None) -> list[dict]:
+        """
+        Splits a Markdown document into chunks.
+
+        Args:
+            markdown (str): The document.
+            title_path (list, optional): Titles of the page and its ancestors, prepended to every chunk.
+
+        Returns:
+            list: Chunks with their text and the headings they fall under.
+        """
+        title_path = title_path or []
+        chunks = []
+        headings = []
+        current, tokens, current_headings = [], 0, []
+
+        def breadcrumb():
+            # Headings that open the chunk are in its text already
+            inside = {b.text for b in current if b.kind == "heading"}
+            return " > ".join(title_path + [h for h in current_headings if h not in inside])
+
+        def has_body():
+            return any(b.kind != "heading" for b in current)
+
+        def flush():
+            nonlocal current, tokens
+            if not has_body():
+                return
+            text = "\n\n".join(
+                "#" * b.level + " " + b.text if b.kind == "heading" else b.text
+                for b in current
+            )
+            prefix = breadcrumb()
+            chunks.append(
+                {
+                    "text": f"{prefix}\n\n{text}" if prefix else text,
+                    "headings": list(current_headings),
+                }
+            )
+            current, tokens = [], 0
+
+        for block in parse_blocks(markdown):
+            if block.kind == "heading":
+                if tokens >= self.min_tokens:
+                    flush()
+                headings = [h for h in headings if h[0] < block.level] + [(block.level, block.text)]
+                if not has_body():
+                    # Headings without a body yet are replaced by the new one
+                    current = [b for b in current if b.level < block.level] + [block]
+                    current_headings = [h[1] for h in headings]
+                    tokens = sum(estimate_tokens(b.text) + 1 for b in current)
+                else:
+                    current.append(block)
+                    tokens += estimate_tokens(block.text) + 1
+                continue
+
+            budget = self.max_tokens - estimate_tokens(breadcrumb())
+            block_tokens = estimate_tokens(block.text) + 1
+            if tokens + block_tokens > budget and has_body():
+                flush()
+                current_headings = [h[1] for h in headings]
+                budget = self.max_tokens - estimate_tokens(breadcrumb())
+
+            if tokens + block_tokens > budget:
+                for piece in self._split_block(block, max(budget - tokens, self.max_tokens // 2)):
+                    current.append(Block(block.kind, piece, 0))
+                    flush()
+                current_headings = [h[1] for h in headings]
+                continue
+
+            current.append(block)
+            tokens += block_tokens
+
+        flush()
+        return chunks
+
+
+def page_metadata(manifest_pages: dict) -> dict:
+    """
+    Maps exported files to the metadata of their Notion page.
+
+    Args:
+        manifest_pages (dict): The `pages` of an incremental export manifest.
+
+    Returns:
+        dict: Page ID, title path and last-edited time keyed by exported file name.
+    """
+
+    def title_path(page_id):
+        path, seen = [], set()
+        while page_id in manifest_pages and page_id not in seen:
+            seen.add(page_id)
+            path.insert(0, manifest_pages[page_id].get("title") or "")
+            page_id = manifest_pages[page_id].get("parent")
+        return [title for title in path if title]
+
+    files = {}
+    for page_id, entry in manifest_pages.items():
+        for file_name in entry.get("files", []):
+            files[file_name] = {
+                "page_id": page_id,
+                "title_path": title_path(page_id),
+                "last_edited_time": entry.get("last_edited_time"),
+            }
+    return files
+
+
+def _chunk_file(task: tuple) -> tuple[list[str], int, int]:
+    """
+    Chunks one exported file into the output directory; runs in a worker process.
+
+    Args:
+        task (tuple): Source directory, output directory, relative path, page metadata and token budgets.
+
+    Returns:
+        tuple: The written paths relative to the output directory, chunk count and bytes read.
+    """
+    source, output, relative, page, max_tokens, min_tokens = task
+    path = os.path.join(source, relative)
+    stem, extension = os.path.splitext(relative)
+    written = []
+
+    if extension.lower() != ".md":
+        os.makedirs(os.path.dirname(os.path.join(output, relative)), exist_ok=True)
+        shutil.copyfile(path, os.path.join(output, relative))
+        return [relative], 0, os.path.getsize(path)
+
+    with open(path, encoding="utf-8") as f:
+        markdown = f.read()
+
+    page = page or {}
+    match = PAGE_ID_PATTERN.search(os.path.basename(relative).replace(" ", ""))
+    page_id = page.get("page_id") or (match.group(1) if match else None)
+    title = os.path.basename(stem)
+    if match:
+        title = title.replace(match.group(1), "").strip()
+    title_path = page.get("title_path") or [title]
+
+    chunks = MarkdownChunker(max_tokens, min_tokens).chunk(markdown, title_path)
+    os.makedirs(os.path.dirname(os.path.join(output, stem)), exist_ok=True)
+    for number, chunk in enumerate(chunks, 1):
+        chunk_path = f"{stem}.{number:03d}.md"
+        attributes = {
+            "title": title_path[-1],
+            "title_path": " > ".join(title_path + chunk["headings"]),
+            "source_file": relative,
+            "chunk": number,
+            "chunks": len(chunks),
+        }
+        if page_id:
+            attributes["page_id"] = page_id.replace("-", "")
+            attributes["source_url"] = f"https://www.notion.so/{page_id.replace('-', '')}"
+        if page.get("last_edited_time"):
+            # Notion reports milliseconds; seconds compare with numeric filters
+            attributes["last_edited"] = int(page["last_edited_time"]) // 1000
+
+        with open(os.path.join(output, chunk_path), "w", encoding="utf-8") as f:
+            f.write(chunk["text"])
+        with open(os.path.join(output, chunk_path + METADATA_SUFFIX), "w", encoding="utf-8") as f:
+            json.dump({"metadataAttributes": attributes}, f, ensure_ascii=False)
+        written.extend([chunk_path, chunk_path + METADATA_SUFFIX])
+
+    return written, len(chunks), len(markdown.encode("utf-8"))
+
+
+def chunk_directory(
+    source: str,
+    output: str,
+    manifest_pages: dict = None,
+    max_tokens: int = 500,
+    min_tokens: int = 100,
+    workers: int = None,
+) -> dict:
+    """
+    Chunks every exported file in a process pool and removes outputs of files that are gone.
+
+    Args:
+        source (str): The export directory.
+        output (str): The directory to write chunks and sidecars to.
+        manifest_pages (dict, optional): The `pages` of an incremental export manifest, for page metadata.
+        max_tokens (int, optional): Token budget of a chunk. Defaults to 500.
+        min_tokens (int, optional): Size a chunk must reach before a heading starts a new one. Defaults to 100.
+        workers (int, optional): Worker processes. Defaults to the number of CPUs.
+
+    Returns:
+        dict: Counts of files, chunks, bytes and removed outputs, and the throughput.
+    """
+    started = time.monotonic()
+    metadata = page_metadata(manifest_pages or {})
+    relatives = sorted(
+        os.path.relpath(os.path.join(root, name), source)
+        for root, _, names in os.walk(source)
+        for name in names
+    )
+    tasks = [
+        (source, output, relative, metadata.get(relative.replace(os.sep, "/")), max_tokens, min_tokens)
+        for relative in relatives
+    ]
+
+    written, chunks, size = set(), 0, 0
+    workers = workers or multiprocessing.cpu_count()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_chunk_file, tasks, chunksize=max(1, len(tasks) // (workers * 8))))
+    else:
+        results = [_chunk_file(task) for task in tasks]
+    for paths, count, read in results:
+        written.update(paths)
+        chunks += count
+        size += read
+
+    removed = 0
+    for root, _, names in os.walk(output):
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.relpath(path, output) not in written:
+                os.remove(path)
+                removed += 1
+
+    elapsed = time.monotonic() - started
+    stats = {
+        "files": len(tasks),
+        "chunks": chunks,
+        "removed": removed,
+        "mb": round(size / 2**20, 1),
+        "elapsed_s": round(elapsed, 2),
+        "mb_per_s": round(size / 2**20 / elapsed, 1) if elapsed else 0.0,
+        "workers": workers,
+    }
+    logging.info(f"Chunked {json.dumps(stats)}")
+    return stats
+
+
+def synthetic_page(rng: random.Random, sections: int) -> str:
+    """
+    Generates a Notion-like Markdown page with headings, prose, lists, code and tables.
+
+    Args:
+        rng (random.Random): The random source.
+        sections (int): Number of sections.
+
+    Returns:
+        str: The page.
+    """
+    words = "notion lambda bedrock slack 구루미 지식 검색 답변 서버리스 배포 이벤트 모델 the of and to".split()
+
+    def sentence():
+        return " ".join(rng.choice(words) for _ in range(rng.randint(6, 20))).capitalize() + "."
+
+    parts = [f"# Page {rng.randrange(10**6)}"]
+    for i in range(sections):
+        parts.append(f"{'#' * rng.randint(2, 3)} Section {i}")
+        for _ in range(rng.randint(1, 4)):
+            kind = rng.random()
+            if kind < 0.55:
+                parts.append(" ".join(sentence() for _ in range(rng.randint(2, 8))))
+            elif kind < 0.7:
+                parts.append("\n".join(f"- {sentence()}" for _ in range(rng.randint(2, 6))))
+            elif kind < 0.85:
+                body = "\n".join(f"    value_{n} = call('{rng.choice(words)}', {n})" for n in range(rng.randint(3, 60)))
+                parts.append(f"```python\ndef handler(event):\n{body}\n```")
+            else:
+                rows = "\n".join(
+                    f"| {rng.choice(words)} | {rng.randint(0, 999)} | {sentence()} |"
+                    for _ in range(rng.randint(2, 40))
+                )
+                parts.append(f"| Name | Count | Note |\n|---|---|---|\n{rows}")
+    return "\n\n".join(parts) + "\n"
+
+
+def benchmark(pages: int, max_tokens: int, workers: int = None) -> dict:
+    """
+    Chunks a synthetic corpus serially and in the process pool.
+
+    Args:
+        pages (int): Number of pages to generate.
+        max_tokens (int): Token budget of a chunk.
+        workers (int, optional): Worker processes for the parallel run. Defaults to the number of CPUs.
+
+    Returns:
+        dict: The statistics of both runs.
+    """
+    rng = random.Random(42)
+    directory = tempfile.mkdtemp(prefix="chunker-")
+    try:
+        source = os.path.join(directory, "export")
+        for i in range(pages):
+            path = os.path.join(source, f"space-{i % 20}", f"Page {i} {rng.getrandbits(128):032x}.md")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(synthetic_page(rng, rng.randint(2, 30)))
+
+        return {
+            "serial": chunk_directory(source, os.path.join(directory, "serial"), max_tokens=max_tokens, workers=1),
+            "parallel": chunk_directory(source, os.path.join(directory, "parallel"), max_tokens=max_tokens, workers=workers),
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="markdown_chunker")
+    p.add_argument("source", nargs="?", help="export directory")
+    p.add_argument("output", nargs="?", help="directory for chunks and metadata sidecars")
+    p.add_argument("--manifest", help="incremental export manifest, local path or s3://bucket/key")
+    p.add_argument("--max-tokens", type=int, default=500, help="token budget of a chunk")
+    p.add_argument("--min-tokens", type=int, default=100, help="size a chunk must reach before a heading starts a new one")
+    p.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    p.add_argument("--benchmark", type=int, metavar="PAGES", help="chunk a synthetic corpus of this many pages")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    if args.benchmark:
+        print(json.dumps(benchmark(args.benchmark, args.max_tokens, args.workers), indent=2))
+    else:
+        if not args.source or not args.output:
+            raise SystemExit("source and output directories are required")
+        pages = None
+        if args.manifest:
+            from incremental_exporter import Manifest
+
+            pages = Manifest(args.manifest).load().pages
+        chunk_directory(args.source, args.output, pages, args.max_tokens, args.min_tokens, args.workers)
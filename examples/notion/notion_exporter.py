@@ -1,5 +1,10 @@
+import argparse
+import logging
 import os
+import sys
 
+from async_notion_exporter import AsyncIncrementalNotionExporter, AsyncNotionExporter
+from incremental_exporter import IncrementalNotionExporter, Manifest
 from python_notion_exporter import NotionExporter, ExportType, ViewExportType
 
 
@@ -9,9 +14,23 @@ NOTION_FILE_TOKEN = os.getenv("NOTION_FILE_TOKEN")
 NOTION_PAGE_NAME = os.getenv("NOTION_PAGE_NAME", "demo")
 NOTION_PAGE_ID = os.getenv("NOTION_PAGE_ID", "7aace0412a82431996f61a29225a95ec")
 
+# Local path or s3://bucket/key of the page manifest used for incremental exports
+NOTION_MANIFEST = os.getenv("NOTION_MANIFEST") or f"build/{NOTION_PAGE_NAME}.manifest.json"
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="notion_exporter")
+    p.add_argument("--full", action="store_true", help="export every page and skip the manifest")
+    p.add_argument("--acknowledge", action="store_true", help="mark the current change list as synced")
+    p.add_argument("--async", dest="use_async", action="store_true", help="export on the asyncio engine")
+    return p.parse_args()
+
 
 if __name__ == "__main__":
-    exporter = NotionExporter(
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    options = dict(
         token_v2=NOTION_TOKEN_V2,
         file_token=NOTION_FILE_TOKEN,
         pages={NOTION_PAGE_NAME: NOTION_PAGE_ID},
@@ -23,4 +42,16 @@ if __name__ == "__main__":
         recursive=True,
         export_name=NOTION_PAGE_NAME,
     )
-    exporter.process()
+
+    failed = []
+    if args.acknowledge:
+        Manifest(NOTION_MANIFEST).load().acknowledge()
+    elif args.full:
+        exporter = AsyncNotionExporter if args.use_async else NotionExporter
+        failed = exporter(**options).process()
+    else:
+        exporter = AsyncIncrementalNotionExporter if args.use_async else IncrementalNotionExporter
+        manifest = Manifest(NOTION_MANIFEST).load()
+        failed = exporter(manifest=manifest, **options).process()["failed"]
+
+    sys.exit(1 if failed else 0)
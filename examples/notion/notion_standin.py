@@ -0,0 +1,300 @@
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+
+from collections import Counter
+
+from aiohttp import web
+
+
+class NotionStandIn:
+    """
+    Local stand-in for the Notion export endpoints.
+
+    Serves enqueueTask, getTasks and the exported zips, and throttles like the
+    real API: requests over `rate_limit` per second or `max_in_flight` at once
+    get 429 with Retry-After, and `error_ratio` of requests fail with 502.
+    """
+
+    def __init__(
+        self,
+        rate_limit: float = 5.0,
+        max_in_flight: int = 8,
+        retry_after: float = 1.0,
+        error_ratio: float = 0.0,
+        export_seconds: float = 2.0,
+        latency: float = 0.05,
+        pages_per_export: int = 3,
+        page_size: int = 16 * 1024,
+    ):
+        """
+        Initializes the NotionStandIn class.
+
+        Args:
+            rate_limit (float, optional): Requests per second before answering 429. Defaults to 5.
+            max_in_flight (int, optional): Concurrent requests before answering 429. Defaults to 8.
+            retry_after (float, optional): Retry-After sent with 429. Defaults to 1.
+            error_ratio (float, optional): Share of requests answered with 502. Defaults to 0.
+            export_seconds (float, optional): Mean time an export task takes. Defaults to 2.
+            latency (float, optional): Time each API request takes. Defaults to 0.05.
+            pages_per_export (int, optional): Markdown files in each exported zip. Defaults to 3.
+            page_size (int, optional): Size in bytes of each exported file. Defaults to 16 KiB.
+        """
+        self.rate_limit = rate_limit
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.error_ratio = error_ratio
+        self.export_seconds = export_seconds
+        self.latency = latency
+        self.pages_per_export = pages_per_export
+        self.page_size = page_size
+        self.tasks = {}
+        self.in_flight = 0
+        self.statuses = Counter()
+        self._tokens = rate_limit
+        self._refilled = time.monotonic()
+        self.base_url = None
+
+    def _admit(self) -> int:
+        """
+        Decides how to answer the next API request.
+
+        Returns:
+            int: 200, 429 or 502.
+        """
+        now = time.monotonic()
+        self._tokens = min(
+            self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit
+        )
+        self._refilled = now
+        if self.in_flight >= self.max_in_flight or self._tokens < 1:
+            return 429
+        self._tokens -= 1
+        if random.random() < self.error_ratio:
+            return 502
+        return 200
+
+    @web.middleware
+    async def throttle(self, request: web.Request, handler):
+        """Answers API requests with 429 or 502 as configured before handling them."""
+        if not request.path.startswith("/api/"):
+            return await handler(request)
+
+        status = self._admit()
+        self.statuses[status] += 1
+        if status == 429:
+            return web.json_response(
+                {"errorId": "rate_limited"},
+                status=429,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.latency)
+            if status == 502:
+                return web.Response(status=502, text="Bad Gateway")
+            return await handler(request)
+        finally:
+            self.in_flight -= 1
+
+    async def enqueue_task(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        task_id = str(uuid.uuid4())
+        self.tasks[task_id] = {
+            "block_id": body["task"]["request"]["block"]["id"],
+            "done_at": time.monotonic() + random.uniform(0, 2 * self.export_seconds),
+        }
+        return web.json_response({"taskId": task_id})
+
+    async def get_tasks(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        results = []
+        for task_id in body["taskIds"]:
+            task = self.tasks.get(task_id)
+            if not task:
+                results.append(None)
+            elif time.monotonic() < task["done_at"]:
+                results.append({"id": task_id, "state": "in_progress"})
+            else:
+                results.append(
+                    {
+                        "id": task_id,
+                        "state": "success",
+                        "status": {
+                            "exportURL": f"{self.base_url}/exports/{task_id}.zip",
+                            "pagesExported": self.pages_per_export,
+                        },
+                    }
+                )
+        return web.json_response({"results": results})
+
+    async def download(self, request: web.Request) -> web.Response:
+        task_id = request.match_info["task_id"]
+        task = self.tasks.get(task_id)
+        if not task:
+            raise web.HTTPNotFound()
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for i in range(self.pages_per_export):
+                page_id = uuid.uuid5(uuid.NAMESPACE_URL, f"{task['block_id']}/{i}").hex
+                text = f"# Page {i}\n\n" + "lorem ipsum " * (self.page_size // 12)
+                archive.writestr(f"Page {i} {page_id}.md", text)
+        return web.Response(body=buffer.getvalue(), content_type="application/zip")
+
+    def app(self) -> web.Application:
+        """
+        Builds the aiohttp application.
+
+        Returns:
+            web.Application: The stand-in server.
+        """
+        app = web.Application(middlewares=[self.throttle])
+        app.router.add_post("/api/v3/enqueueTask", self.enqueue_task)
+        app.router.add_post("/api/v3/getTasks", self.get_tasks)
+        app.router.add_get("/exports/{task_id}.zip", self.download)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+        """
+        Starts the server in the running event loop.
+
+        Args:
+            host (str, optional): The address to bind. Defaults to 127.0.0.1.
+            port (int, optional): The port to bind, 0 for any free port. Defaults to 0.
+
+        Returns:
+            web.AppRunner: The runner, to clean up when done.
+        """
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return runner
+
+
+def check_zip_stream():
+    """
+    Streams a zip whose first member inflates past one write pass through ZipStreamExtractor.
+
+    The bytes left over when the first member's deflate stream ends belong to the next
+    record, so the second member spans a chunk boundary and must still come out intact.
+
+    Raises:
+        AssertionError: If a member is missing or differs at any chunk size.
+    """
+    from python_notion_exporter import ZipStreamExtractor
+
+    members = {
+        "large.md": b"ab" * (3 * ZipStreamExtractor.WRITE_SIZE // 2) + b"c",
+        "next.md": os.urandom(50 * 1024).hex().encode(),
+    }
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    data = buffer.getvalue()
+
+    for chunk_size in (1024, 8 * 1024, 64 * 1024):
+        chunks = [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+        with tempfile.TemporaryDirectory() as directory:
+            names = ZipStreamExtractor(chunks, directory).extract()
+            assert names == list(members), f"{chunk_size} byte chunks: extracted {names}"
+            for name, content in members.items():
+                with open(os.path.join(directory, name), "rb") as f:
+                    assert f.read() == content, f"{chunk_size} byte chunks: {name} differs"
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="notion_standin")
+    p.add_argument("--pages", type=int, default=50, help="number of pages to export")
+    p.add_argument("--engine", choices=["sync", "async"], default="async")
+    p.add_argument("--rate-limit", type=float, default=5.0, help="requests per second before 429")
+    p.add_argument("--max-in-flight", type=int, default=8, help="concurrent requests before 429")
+    p.add_argument("--error-ratio", type=float, default=0.02, help="share of requests failing with 502")
+    p.add_argument("--export-seconds", type=float, default=2.0, help="mean export task duration")
+    p.add_argument("--rps", type=float, default=5.0, help="requests per second the exporter sends")
+    p.add_argument("--export-directory", default="build/standin")
+    return p.parse_args()
+
+
+async def serve(standin: NotionStandIn, ready: asyncio.Future, stop: asyncio.Event):
+    runner = await standin.start()
+    ready.set_result(standin.base_url)
+    await stop.wait()
+    await runner.cleanup()
+
+
+def main():
+    from async_notion_exporter import AsyncNotionExporter
+    from python_notion_exporter import NotionExporter
+
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    check_zip_stream()
+
+    standin = NotionStandIn(
+        rate_limit=args.rate_limit,
+        max_in_flight=args.max_in_flight,
+        error_ratio=args.error_ratio,
+        export_seconds=args.export_seconds,
+    )
+    options = dict(
+        token_v2="token",
+        file_token="token",
+        pages={f"page-{i}": uuid.uuid4().hex for i in range(args.pages)},
+        export_directory=args.export_directory,
+        export_name="standin",
+        poll_interval=0.5,
+        max_poll_interval=5.0,
+    )
+
+    # The server runs on its own loop so the sync engine can be measured too
+    loop = asyncio.new_event_loop()
+    ready = loop.create_future()
+    stop = asyncio.Event()
+    thread = threading.Thread(
+        target=lambda: loop.run_until_complete(serve(standin, ready, stop)), daemon=True
+    )
+    thread.start()
+    while not ready.done():
+        time.sleep(0.01)
+    options["api_url"] = f"{ready.result()}/api/v3"
+
+    started = time.monotonic()
+    if args.engine == "async":
+        exporter = AsyncNotionExporter(requests_per_second=args.rps, **options)
+    else:
+        exporter = NotionExporter(**options)
+    results = exporter._run({name: (page_id, True) for name, page_id in options["pages"].items()})
+
+    loop.call_soon_threadsafe(stop.set)
+    thread.join()
+
+    report = {
+        "engine": args.engine,
+        "elapsed_s": round(time.monotonic() - started, 1),
+        "pages_done": sum(1 for r in results if r["state"] != "failure"),
+        "pages_failed": sum(1 for r in results if r["state"] == "failure"),
+        "server_statuses": dict(sorted(standin.statuses.items())),
+    }
+    if args.engine == "async":
+        report["exporter"] = exporter.metrics.summary(exporter.controller)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
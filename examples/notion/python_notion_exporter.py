@@ -3,13 +3,18 @@ import json
 import logging
 import multiprocessing
 import os
+import random
 import shutil
+import struct
 import time
+import zipfile
+import zlib
 import requests
 
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
 
@@ -28,9 +33,231 @@ class ViewExportType:
     ALL = "all"
 
 
+class ZipStreamExtractor:
+    """Extracts a zip archive from a stream of byte chunks without seeking or buffering it."""
+
+    LOCAL_FILE_HEADER = b"PK\x03\x04"
+    DATA_DESCRIPTOR = b"PK\x07\x08"
+    STORED = 0
+    DEFLATED = 8
+    ZIP64_EXTRA_ID = 0x0001
+    WRITE_SIZE = 1024 * 1024
+
+    def __init__(self, chunks, directory: str):
+        """
+        Initializes the ZipStreamExtractor class.
+
+        Args:
+            chunks (iterable): The archive as an iterable of bytes, e.g. `response.iter_content()`.
+            directory (str): Directory the archive members are extracted into.
+        """
+        self.chunks = iter(chunks)
+        self.directory = os.path.realpath(directory)
+        self.buffer = b""
+
+    def _read_some(self) -> bytes:
+        """
+        Returns the buffered bytes, or the next chunk if the buffer is empty.
+
+        Returns:
+            bytes: Up to one chunk of the archive, empty at the end of the stream.
+        """
+        if not self.buffer:
+            self.buffer = next(self.chunks, b"")
+        data, self.buffer = self.buffer, b""
+        return data
+
+    def _read(self, size: int) -> bytes:
+        """
+        Reads exactly `size` bytes from the stream.
+
+        Args:
+            size (int): The number of bytes to read.
+
+        Returns:
+            bytes: The bytes read.
+        """
+        parts = []
+        while size > 0:
+            data = self._read_some()
+            if not data:
+                raise EOFError("Unexpected end of zip stream.")
+            parts.append(data[:size])
+            self.buffer = data[size:]
+            size -= len(parts[-1])
+        return b"".join(parts)
+
+    def _target_path(self, name: str) -> str:
+        """
+        Resolves a member name to a path inside the target directory.
+
+        Args:
+            name (str): The member name from the archive.
+
+        Returns:
+            str: The path to extract the member to.
+        """
+        path = os.path.realpath(os.path.join(self.directory, name))
+        if os.path.commonpath([self.directory, path]) != self.directory:
+            raise ValueError(f"Zip member escapes the export directory: {name}")
+        return path
+
+    def _zip64_sizes(self, extra: bytes, compressed: int, uncompressed: int) -> tuple[int, int, bool]:
+        """
+        Reads 64-bit sizes from the extra field of a local file header.
+
+        Args:
+            extra (bytes): The extra field.
+            compressed (int): The 32-bit compressed size from the header.
+            uncompressed (int): The 32-bit uncompressed size from the header.
+
+        Returns:
+            tuple: The compressed size, the uncompressed size, and whether the entry uses zip64.
+        """
+        offset = 0
+        while offset + 4 <= len(extra):
+            header_id, length = struct.unpack_from("<HH", extra, offset)
+            if header_id == self.ZIP64_EXTRA_ID:
+                values = extra[offset + 4 : offset + 4 + length]
+                if uncompressed == 0xFFFFFFFF and len(values) >= 8:
+                    (uncompressed,) = struct.unpack_from("<Q", values)
+                    values = values[8:]
+                if compressed == 0xFFFFFFFF and len(values) >= 8:
+                    (compressed,) = struct.unpack_from("<Q", values)
+                return compressed, uncompressed, True
+            offset += 4 + length
+        return compressed, uncompressed, False
+
+    def _copy_stored(self, f, size: int) -> int:
+        """
+        Copies an uncompressed member to a file.
+
+        Args:
+            f (file): The file to write to.
+            size (int): The member size.
+
+        Returns:
+            int: The CRC-32 of the member.
+        """
+        crc = 0
+        while size > 0:
+            data = self._read(min(size, self.WRITE_SIZE))
+            crc = zlib.crc32(data, crc)
+            f.write(data)
+            size -= len(data)
+        return crc
+
+    def _inflate(self, f) -> int:
+        """
+        Decompresses a deflated member to a file, stopping at the end of its deflate stream.
+
+        Args:
+            f (file): The file to write to.
+
+        Returns:
+            int: The CRC-32 of the member.
+        """
+        crc = 0
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        while not decompressor.eof:
+            data = self._read_some()
+            if not data:
+                raise EOFError("Unexpected end of zip stream.")
+            while data and not decompressor.eof:
+                output = decompressor.decompress(data, self.WRITE_SIZE)
+                crc = zlib.crc32(output, crc)
+                f.write(output)
+                data = decompressor.unconsumed_tail
+            # Bytes past the end of the member belong to the next record; once the stream
+            # has ended, unconsumed_tail repeats them, so only unused_data is pushed back
+            self.buffer = (decompressor.unused_data if decompressor.eof else data) + self.buffer
+        return crc
+
+    def _read_data_descriptor(self, zip64: bool) -> int:
+        """
+        Reads the data descriptor that follows a member written without sizes.
+
+        Args:
+            zip64 (bool): Whether the descriptor holds 64-bit sizes.
+
+        Returns:
+            int: The CRC-32 recorded for the member.
+        """
+        signature = self._read(4)
+        if signature == self.DATA_DESCRIPTOR:
+            signature = self._read(4)
+        (crc,) = struct.unpack("<I", signature)
+        self._read(16 if zip64 else 8)
+        return crc
+
+    def extract(self) -> list[str]:
+        """
+        Extracts every member of the archive.
+
+        Returns:
+            list: The names of the extracted files.
+        """
+        names = []
+        while self._read(4) == self.LOCAL_FILE_HEADER:
+            (
+                _,
+                flags,
+                method,
+                _,
+                _,
+                crc,
+                compressed,
+                uncompressed,
+                name_length,
+                extra_length,
+            ) = struct.unpack("<HHHHHIIIHH", self._read(26))
+            raw_name = self._read(name_length)
+            name = raw_name.decode("utf-8" if flags & 0x800 else "cp437")
+            compressed, uncompressed, zip64 = self._zip64_sizes(
+                self._read(extra_length), compressed, uncompressed
+            )
+            has_descriptor = bool(flags & 0x08)
+
+            path = self._target_path(name)
+            if name.endswith("/"):
+                os.makedirs(path, exist_ok=True)
+                self._read(compressed)
+                if has_descriptor:
+                    self._read_data_descriptor(zip64)
+                continue
+
+            if flags & 0x01:
+                raise ValueError(f"Encrypted zip member is not supported: {name}")
+            if method == self.STORED and has_descriptor:
+                raise ValueError(f"Stored zip member without sizes cannot be streamed: {name}")
+            if method not in (self.STORED, self.DEFLATED):
+                raise ValueError(f"Unsupported compression method {method}: {name}")
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                if method == self.STORED:
+                    actual_crc = self._copy_stored(f, compressed)
+                else:
+                    actual_crc = self._inflate(f)
+
+            if has_descriptor:
+                crc = self._read_data_descriptor(zip64)
+
+            if actual_crc != crc:
+                raise ValueError(f"CRC mismatch in zip member: {name}")
+            names.append(name)
+
+        # The central directory follows the last member and is not needed
+        for _ in self.chunks:
+            pass
+        return names
+
+
 class NotionExporter:
     """Class to handle exporting Notion content."""
 
+    API_URL = "https://www.notion.so/api/v3"
+
     def __init__(
         self,
         token_v2: str,
@@ -44,6 +271,13 @@ class NotionExporter:
         recursive: bool = True,
         workers: int = multiprocessing.cpu_count(),
         export_name: str = None,
+        poll_interval: float = 1.0,
+        max_poll_interval: float = 30.0,
+        task_timeout: float = 1800.0,
+        poll_batch_size: int = 100,
+        stream_unzip: bool = True,
+        download_chunk_size: int = 1024 * 1024,
+        api_url: str = None,
     ):
         """
         Initializes the NotionExporter class.
@@ -60,6 +294,13 @@ class NotionExporter:
             recursive (bool, optional): If True, exports will be recursive. Defaults to True.
             workers (int, optional): Number of worker threads for exporting. Defaults to the number of CPUs available.
             export_name (str, optional): Name of the export. Defaults to the current date and time.
+            poll_interval (float, optional): Initial delay in seconds between export status polls. Defaults to 1.
+            max_poll_interval (float, optional): Upper bound in seconds for the backed-off poll delay. Defaults to 30.
+            task_timeout (float, optional): Seconds after which an unfinished export is reported as failed. Defaults to 1800.
+            poll_batch_size (int, optional): Maximum number of task IDs per getTasks request. Defaults to 100.
+            stream_unzip (bool, optional): If True, extracts exports while downloading them instead of saving the zip first. Defaults to True.
+            download_chunk_size (int, optional): Size in bytes of each chunk read from a download. Defaults to 1 MiB.
+            api_url (str, optional): Base URL of the Notion API, e.g. a local stand-in. Defaults to API_URL.
         """
 
         self.export_name = (
@@ -85,6 +326,16 @@ class NotionExporter:
             "cookie": f"token_v2={self.token_v2};",
         }
         self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.task_timeout = task_timeout
+        self.poll_batch_size = poll_batch_size
+        self.stream_unzip = stream_unzip
+        self.download_chunk_size = download_chunk_size
+        self.api_url = api_url or self.API_URL
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(workers, 1))
+        self.session.mount("https://", adapter)
         os.makedirs(f"{self.export_directory}{self.export_name}", exist_ok=True)
 
     def _to_uuid_format(self, input_string: str) -> str:
@@ -128,17 +379,17 @@ class NotionExporter:
 
         return format_options
 
-    def _export(self, page_id: str) -> str:
+    def _export_payload(self, page_id: str, recursive: bool = None) -> dict:
         """
-        Initiates the export of a Notion page.
+        Builds the enqueueTask request for exporting a Notion page.
 
         Args:
             page_id (str): The ID of the Notion page.
+            recursive (bool, optional): If True, includes subpages. Defaults to the exporter's `recursive`.
 
         Returns:
-            str: The task ID of the initiated export.
+            dict: The request payload.
         """
-        url = "https://www.notion.so/api/v3/enqueueTask"
         page_id = self._to_uuid_format(input_string=page_id)
         export_options = {
             "exportType": self.export_type,
@@ -155,88 +406,132 @@ class NotionExporter:
             )
         )
 
-        payload = json.dumps(
-            {
-                "task": {
-                    "eventName": "exportBlock",
-                    "request": {
-                        "block": {
-                            "id": page_id,
-                        },
-                        "recursive": self.recursive,
-                        "exportOptions": export_options,
+        return {
+            "task": {
+                "eventName": "exportBlock",
+                "request": {
+                    "block": {
+                        "id": page_id,
                     },
-                }
+                    "recursive": self.recursive if recursive is None else recursive,
+                    "exportOptions": export_options,
+                },
             }
-        )
+        }
+
+    def _export(self, page_id: str, recursive: bool = None) -> str:
+        """
+        Initiates the export of a Notion page.
 
-        response = requests.request(
+        Args:
+            page_id (str): The ID of the Notion page.
+            recursive (bool, optional): If True, includes subpages. Defaults to the exporter's `recursive`.
+
+        Returns:
+            str: The task ID of the initiated export.
+        """
+        url = f"{self.api_url}/enqueueTask"
+        payload = json.dumps(self._export_payload(page_id, recursive))
+
+        response = self.session.request(
             "POST", url, headers=self.query_headers, data=payload
         ).json()
         return response["taskId"]
 
-    def _get_status(self, task_id: str) -> dict:
+    def _get_statuses(self, task_ids: list) -> dict:
         """
-        Fetches the status of an export task.
+        Fetches the status of several export tasks in one request.
 
         Args:
-            task_id (str): The ID of the export task.
+            task_ids (list): The IDs of the export tasks.
 
         Returns:
-            dict: A dictionary containing details about the task status.
+            dict: Task statuses keyed by task ID. Tasks without a result are left out.
         """
-        url = "https://www.notion.so/api/v3/getTasks"
+        url = f"{self.api_url}/getTasks"
 
-        payload = json.dumps({"taskIds": [task_id]})
+        payload = json.dumps({"taskIds": task_ids})
 
-        response = requests.request(
+        response = self.session.request(
             "POST", url, headers=self.query_headers, data=payload
-        ).json()
+        )
+        response.raise_for_status()
+        return self._statuses_by_id(task_ids, response.json())
 
-        if not response["results"]:
-            # print(response)
-            return {"state": "failure", "error": "No results found."}
+    @staticmethod
+    def _statuses_by_id(task_ids: list, response: dict) -> dict:
+        """
+        Keys the results of a getTasks response by task ID.
 
-        return response["results"][0]
+        Args:
+            task_ids (list): The task IDs in the order they were requested.
+            response (dict): The getTasks response.
 
-    def _download(self, url: str):
+        Returns:
+            dict: Task statuses keyed by task ID. Tasks without a result are left out.
         """
-        Downloads an exported file from a given URL.
+        statuses = {}
+        for task_id, status in zip(task_ids, response.get("results") or []):
+            if status:
+                statuses[status.get("id", task_id)] = status
+        return statuses
+
+    def _download(self, url: str) -> list[str]:
+        """
+        Downloads an exported file from a given URL and unpacks it.
+
+        The response is read in chunks on the shared session. With stream_unzip
+        the chunks are extracted as they arrive; otherwise they are written to
+        the zip file, which is unpacked and removed right after.
 
         Args:
             url (str): The URL of the exported file.
-        """
-        response = requests.request("GET", url, headers=self.download_headers)
-        file_name = url.split("/")[-1][100:]
-        with open(
-            f"{self.export_directory}{self.export_name}/{file_name}",
-            "wb",
-        ) as f:
-            f.write(response.content)
 
-    def _process_page(self, page_details: tuple) -> dict:
+        Returns:
+            list: The extracted file names, relative to the export directory.
+        """
+        directory_path = f"{self.export_directory}{self.export_name}"
+        with self.session.get(
+            url, headers=self.download_headers, stream=True
+        ) as response:
+            response.raise_for_status()
+            chunks = response.iter_content(chunk_size=self.download_chunk_size)
+
+            if self.stream_unzip:
+                return ZipStreamExtractor(chunks, directory_path).extract()
+
+            file_name = url.split("/")[-1][100:]
+            full_file_path = os.path.join(directory_path, file_name)
+            with open(full_file_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        return self._unpack(full_file_path)
+
+    def _download_page(self, name: str, status: dict) -> dict:
         """
-        Processes an individual Notion page for export.
+        Downloads the result of a finished export task.
 
         Args:
-            page_details (tuple): Tuple containing the name and ID of the Notion page.
+            name (str): The name of the Notion page.
+            status (dict): The final status of the page's export task.
 
         Returns:
             dict: Details about the export status and any errors.
         """
-        name, id = page_details
-        task_id = self._export(id)
-
-        status, state, error, pages_exported = self._wait_for_export_completion(
-            task_id=task_id
-        )
+        state = status.get("state")
         if state == "failure":
+            error = status.get("error")
             logging.error(f"Export failed for {name} with error: {error}")
             return {"state": state, "name": name, "error": error}
 
+        files = []
         export_url = status.get("status", {}).get("exportURL")
         if export_url:
-            self._download(export_url)
+            try:
+                files = self._download(export_url)
+            except Exception as e:
+                logging.error(f"Download failed for {name} with error: {e}")
+                return {"state": "failure", "name": name, "error": str(e)}
         else:
             logging.warning(f"Failed to get exportURL for {name}")
 
@@ -244,63 +539,151 @@ class NotionExporter:
             "state": state,
             "name": name,
             "exportURL": export_url,
-            "pagesExported": pages_exported,
+            "pagesExported": status.get("status", {}).get("pagesExported"),
+            "files": files,
         }
 
-    def _wait_for_export_completion(self, task_id: str) -> tuple[dict, str, str, int]:
+    def _next_poll_delay(self, attempt: int) -> float:
         """
-        Waits until a given export task completes or fails.
+        Computes the delay before the next status poll.
+
+        The delay doubles with every poll that finishes nothing, up to
+        max_poll_interval, and half of it is random so that several exporters
+        do not poll in lockstep.
 
         Args:
-            task_id (str): The ID of the export task.
+            attempt (int): Number of polls since a task last finished.
 
         Returns:
-            tuple: A tuple containing the status, state, error, and number of pages exported.
+            float: The delay in seconds.
         """
-        while True:
-            status = self._get_status(task_id)
+        delay = min(self.max_poll_interval, self.poll_interval * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
 
-            if not status:
-                time.sleep(5)
-                continue
-            state = status.get("state")
-            error = status.get("error")
-            if state == "failure" or status.get("status", {}).get("exportURL"):
-                return (
-                    status,
-                    state,
-                    error,
-                    status.get("status", {}).get("pagesExported"),
-                )
-            time.sleep(5)
+    @staticmethod
+    def _is_finished(status: dict) -> bool:
+        """
+        Checks whether an export task has finished, successfully or not.
+
+        Args:
+            status (dict): The task status from getTasks.
 
-    def _unpack(self):
+        Returns:
+            bool: True if the task will not change any more.
         """
-        Unpacks and saves exported content from zip archives.
+        return status.get("state") in ("success", "failure") or bool(
+            status.get("status", {}).get("exportURL")
+        )
+
+    def _poll_exports(self, tasks: dict):
         """
+        Polls all outstanding export tasks together until each one finishes.
+
+        Every round asks getTasks about all unfinished tasks at once, in batches
+        of poll_batch_size, and yields the tasks that finished right away so
+        they can be downloaded while the rest are still exporting. Tasks still
+        unfinished after task_timeout seconds are yielded as failures.
+
+        Args:
+            tasks (dict): Page names keyed by export task ID.
+
+        Yields:
+            tuple: The page name and the final status of its export task.
+        """
+        outstanding = {task_id: time.monotonic() for task_id in tasks}
+        attempt = 0
+
+        while outstanding:
+            time.sleep(self._next_poll_delay(attempt))
+            attempt += 1
+
+            task_ids = list(outstanding)
+            statuses = {}
+            try:
+                for i in range(0, len(task_ids), self.poll_batch_size):
+                    statuses.update(
+                        self._get_statuses(task_ids[i : i + self.poll_batch_size])
+                    )
+            except (requests.RequestException, ValueError) as e:
+                logging.warning(f"Failed to poll {len(task_ids)} export tasks: {e}")
+
+            now = time.monotonic()
+            for task_id in task_ids:
+                status = statuses.get(task_id, {})
+                if self._is_finished(status):
+                    del outstanding[task_id]
+                    attempt = 0
+                    yield tasks[task_id], status
+                elif now - outstanding[task_id] > self.task_timeout:
+                    del outstanding[task_id]
+                    yield tasks[task_id], {
+                        "state": "failure",
+                        "error": f"Export did not finish within {self.task_timeout:.0f} seconds.",
+                    }
+
+    def _unpack(self, full_file_path: str) -> list[str]:
+        """
+        Unpacks and saves exported content from a zip archive, then removes it.
+
+        Args:
+            full_file_path (str): Path of the downloaded zip archive.
+
+        Returns:
+            list: The extracted file names, relative to the export directory.
+        """
+        if not full_file_path.endswith(".zip"):
+            return [os.path.basename(full_file_path)]
+
         directory_path = f"{self.export_directory}{self.export_name}"
-        for file in os.listdir(directory_path):
-            if file.endswith(".zip"):
-                full_file_path = os.path.join(directory_path, file)
-                shutil.unpack_archive(full_file_path, directory_path, "zip")
-                os.remove(full_file_path)
+        with zipfile.ZipFile(full_file_path) as archive:
+            names = [name for name in archive.namelist() if not name.endswith("/")]
+        shutil.unpack_archive(full_file_path, directory_path, "zip")
+        os.remove(full_file_path)
+        return names
 
-    def process(self):
+    def _run(self, jobs: dict, on_result=None) -> list[dict]:
         """
-        Processes and exports all provided Notion pages.
+        Exports a set of pages and downloads each one as soon as it finishes.
+
+        Args:
+            jobs (dict): Tuples of page ID and recursive flag, keyed by name.
+            on_result (callable, optional): Called from the worker thread with each page's result.
+
+        Returns:
+            list: The result of every page that was enqueued.
         """
-        logging.info(f"Exporting {len(self.pages)} pages...")
+        results = []
 
         with ThreadPoolExecutor(max_workers=self.workers) as executor:
-            with tqdm(total=len(self.pages), dynamic_ncols=True) as pbar:
-                futures = {
-                    executor.submit(self._process_page, item): item
-                    for item in self.pages.items()
-                }
-                for future in concurrent.futures.as_completed(futures):
-                    result = future.result()
+            enqueued = {
+                executor.submit(self._export, page_id, recursive): name
+                for name, (page_id, recursive) in jobs.items()
+            }
+            tasks = {}
+            for future in concurrent.futures.as_completed(enqueued):
+                name = enqueued[future]
+                try:
+                    tasks[future.result()] = name
+                except Exception as e:
+                    logging.error(f"Export failed for {name} with error: {e}")
+                    results.append({"state": "failure", "name": name, "error": str(e)})
+
+            with tqdm(total=len(tasks), dynamic_ncols=True) as pbar:
+
+                def on_downloaded(future):
+                    # Exceptions raised in a done callback are only logged by the executor,
+                    # so a page that could not be downloaded or recorded becomes a failure
+                    name = downloads[future]
+                    try:
+                        result = future.result()
+                        if on_result:
+                            on_result(result)
+                    except Exception as e:
+                        logging.error(f"Download failed for {name} with error: {e}")
+                        result = {"state": "failure", "name": name, "error": str(e)}
+                    results.append(result)
                     if result["state"] == "failure":
-                        continue
+                        return
                     name = result["name"]
                     pagesExported = result["pagesExported"]
 
@@ -309,4 +692,28 @@ class NotionExporter:
                     )
                     pbar.update(1)
 
-        self._unpack()
+                # One poller for every task; downloads and unpacking start as soon as a task finishes
+                downloads = {}
+                for name, status in self._poll_exports(tasks):
+                    future = executor.submit(self._download_page, name, status)
+                    downloads[future] = name
+                    future.add_done_callback(on_downloaded)
+                concurrent.futures.wait(downloads)
+
+        return results
+
+    def process(self) -> list[str]:
+        """
+        Processes and exports all provided Notion pages.
+
+        Returns:
+            list: The names of the pages that failed to export or download.
+        """
+        logging.info(f"Exporting {len(self.pages)} pages...")
+
+        results = self._run(
+            {name: (page_id, self.recursive) for name, page_id in self.pages.items()}
+        )
+        failed = [r["name"] for r in results if r["state"] == "failure"]
+        logging.info(f"Exported {len(results) - len(failed)} pages, {len(failed)} failed")
+        return failed
@@ -0,0 +1,326 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+
+from collections import Counter
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from aiohttp import web
+
+
+class S3StandIn:
+    """
+    Local stand-in for the S3 calls the uploader makes.
+
+    Serves ListObjectsV2, PutObject, HeadObject, multipart uploads and
+    DeleteObjects for path-style requests, with ETags computed like S3.
+    """
+
+    def __init__(self, max_keys: int = 1000):
+        """
+        Initializes the S3StandIn class.
+
+        Args:
+            max_keys (int, optional): Objects per ListObjectsV2 page. Defaults to 1000.
+        """
+        self.max_keys = max_keys
+        self.objects = {}
+        self.uploads = {}
+        self.calls = Counter()
+        self.base_url = None
+
+    @staticmethod
+    async def _body(request: web.Request) -> bytes:
+        """
+        Reads a request body, decoding aws-chunked uploads.
+
+        Args:
+            request (web.Request): The request.
+
+        Returns:
+            bytes: The payload.
+        """
+        body = await request.read()
+        if "aws-chunked" not in request.headers.get("Content-Encoding", ""):
+            return body
+
+        payload, position = bytearray(), 0
+        while True:
+            line_end = body.index(b"\r\n", position)
+            size = int(body[position:line_end].split(b";")[0], 16)
+            if size == 0:
+                return bytes(payload)
+            payload += body[line_end + 2 : line_end + 2 + size]
+            position = line_end + 2 + size + 2
+
+    def _object_headers(self, item: dict) -> dict:
+        headers = {"ETag": f'"{item["etag"]}"', "Content-Length": str(len(item["body"]))}
+        headers.update({f"x-amz-meta-{k}": v for k, v in item["metadata"].items()})
+        return headers
+
+    @staticmethod
+    def _metadata(request: web.Request) -> dict:
+        return {
+            k[len("x-amz-meta-") :]: v
+            for k, v in request.headers.items()
+            if k.lower().startswith("x-amz-meta-")
+        }
+
+    async def bucket(self, request: web.Request) -> web.Response:
+        """Handles ListObjectsV2 and DeleteObjects."""
+        bucket = request.match_info["bucket"]
+        if request.method == "POST" and "delete" in request.query:
+            self.calls["DeleteObjects"] += 1
+            root = ElementTree.fromstring(await self._body(request))
+            keys = [e.text for e in root.iter() if e.tag.endswith("Key")]
+            for key in keys:
+                self.objects.pop((bucket, key), None)
+            return web.Response(
+                text="<DeleteResult></DeleteResult>", content_type="application/xml"
+            )
+
+        self.calls["ListObjectsV2"] += 1
+        prefix = request.query.get("prefix", "")
+        start = request.query.get("continuation-token", "")
+        keys = sorted(
+            key for b, key in self.objects if b == bucket and key.startswith(prefix) and key > start
+        )
+        page, truncated = keys[: self.max_keys], len(keys) > self.max_keys
+        contents = "".join(
+            f"<Contents><Key>{escape(key)}</Key><ETag>&quot;{self.objects[(bucket, key)]['etag']}&quot;</ETag>"
+            f"<Size>{len(self.objects[(bucket, key)]['body'])}</Size>"
+            f"<LastModified>2024-01-01T00:00:00.000Z</LastModified></Contents>"
+            for key in page
+        )
+        token = f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if truncated else ""
+        return web.Response(
+            text=f"<ListBucketResult><Name>{bucket}</Name><Prefix>{escape(prefix)}</Prefix>"
+            f"<KeyCount>{len(page)}</KeyCount><IsTruncated>{str(truncated).lower()}</IsTruncated>"
+            f"{token}{contents}</ListBucketResult>",
+            content_type="application/xml",
+        )
+
+    async def object(self, request: web.Request) -> web.Response:
+        """Handles PutObject, HeadObject, GetObject and multipart uploads."""
+        bucket, key = request.match_info["bucket"], request.match_info["key"]
+        query = request.query
+
+        if request.method == "POST" and "uploads" in query:
+            self.calls["CreateMultipartUpload"] += 1
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {"parts": {}, "metadata": self._metadata(request)}
+            return web.Response(
+                text=f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key>"
+                f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>",
+                content_type="application/xml",
+            )
+
+        if request.method == "PUT" and "uploadId" in query:
+            self.calls["UploadPart"] += 1
+            body = await self._body(request)
+            self.uploads[query["uploadId"]]["parts"][int(query["partNumber"])] = body
+            return web.Response(headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+        if request.method == "POST" and "uploadId" in query:
+            self.calls["CompleteMultipartUpload"] += 1
+            upload = self.uploads.pop(query["uploadId"])
+            parts = [upload["parts"][n] for n in sorted(upload["parts"])]
+            digest = hashlib.md5(b"".join(hashlib.md5(p).digest() for p in parts)).hexdigest()
+            etag = f"{digest}-{len(parts)}"
+            self.objects[(bucket, key)] = {
+                "body": b"".join(parts),
+                "etag": etag,
+                "metadata": upload["metadata"],
+            }
+            return web.Response(
+                text=f"<CompleteMultipartUploadResult><Key>{escape(key)}</Key>"
+                f"<ETag>&quot;{etag}&quot;</ETag></CompleteMultipartUploadResult>",
+                content_type="application/xml",
+            )
+
+        if request.method == "DELETE" and "uploadId" in query:
+            self.calls["AbortMultipartUpload"] += 1
+            self.uploads.pop(query["uploadId"], None)
+            return web.Response(status=204)
+
+        if request.method == "PUT":
+            self.calls["PutObject"] += 1
+            body = await self._body(request)
+            etag = hashlib.md5(body).hexdigest()
+            self.objects[(bucket, key)] = {
+                "body": body,
+                "etag": etag,
+                "metadata": self._metadata(request),
+            }
+            return web.Response(headers={"ETag": f'"{etag}"'})
+
+        item = self.objects.get((bucket, key))
+        if request.method == "HEAD":
+            self.calls["HeadObject"] += 1
+            if not item:
+                return web.Response(status=404)
+            return web.Response(headers=self._object_headers(item))
+
+        self.calls["GetObject"] += 1
+        if not item:
+            return web.Response(
+                status=404,
+                text="<Error><Code>NoSuchKey</Code></Error>",
+                content_type="application/xml",
+            )
+        return web.Response(body=item["body"], headers={"ETag": f'"{item["etag"]}"'})
+
+    def app(self) -> web.Application:
+        """
+        Builds the aiohttp application.
+
+        Returns:
+            web.Application: The stand-in server.
+        """
+        app = web.Application(client_max_size=1024**3)
+        app.router.add_route("*", "/{bucket}", self.bucket)
+        app.router.add_route("*", "/{bucket}/{key:.+}", self.object)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+        """
+        Starts the server in the running event loop.
+
+        Args:
+            host (str, optional): The address to bind. Defaults to 127.0.0.1.
+            port (int, optional): The port to bind, 0 for any free port. Defaults to 0.
+
+        Returns:
+            web.AppRunner: The runner, to clean up when done.
+        """
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return runner
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="s3_standin")
+    p.add_argument("--files", type=int, default=500, help="number of files to upload")
+    p.add_argument("--large-files", type=int, default=2, help="files above the multipart threshold")
+    p.add_argument("--changed", type=int, default=10, help="files modified before the second sync")
+    p.add_argument("--removed", type=int, default=5, help="files removed before the second sync")
+    p.add_argument("--directory", default="build/s3-standin")
+    return p.parse_args()
+
+
+async def serve(standin: S3StandIn, ready: asyncio.Future, stop: asyncio.Event):
+    runner = await standin.start()
+    ready.set_result(standin.base_url)
+    await stop.wait()
+    await runner.cleanup()
+
+
+def write_tree(directory: str, files: int, large_files: int):
+    shutil.rmtree(directory, ignore_errors=True)
+    for i in range(files):
+        path = os.path.join(directory, f"section-{i % 10}", f"Page {i} {uuid.uuid4().hex}.md")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = 20 * 1024 * 1024 if i < large_files else random.randint(1024, 16 * 1024)
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+
+
+def main():
+    import boto3
+
+    from botocore.config import Config
+    from s3_uploader import S3DeltaUploader
+
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    standin = S3StandIn()
+    loop = asyncio.new_event_loop()
+    ready = loop.create_future()
+    stop = asyncio.Event()
+    thread = threading.Thread(
+        target=lambda: loop.run_until_complete(serve(standin, ready, stop)), daemon=True
+    )
+    thread.start()
+    while not ready.done():
+        time.sleep(0.01)
+
+    s3 = boto3.client(
+        "s3",
+        endpoint_url=ready.result(),
+        region_name="us-east-1",
+        aws_access_key_id="standin",
+        aws_secret_access_key="standin",
+        config=Config(s3={"addressing_style": "path"}, max_pool_connections=50),
+    )
+
+    write_tree(args.directory, args.files, args.large_files)
+    report = {}
+
+    def run(name, **options):
+        standin.calls.clear()
+        started = time.monotonic()
+        changes = S3DeltaUploader(args.directory, "s3://standin/notion/demo/", s3=s3, **options).sync()
+        report[name] = {
+            "elapsed_s": round(time.monotonic() - started, 2),
+            "uploaded": len(changes["uploaded"]),
+            "deleted": len(changes["deleted"]),
+            "unchanged": changes["unchanged"],
+            "failed": len(changes["failed"]),
+            "calls": dict(sorted(standin.calls.items())),
+        }
+
+    run("first")
+
+    # A fresh export rewrites every file with the same content
+    for root, _, names in os.walk(args.directory):
+        for name in names:
+            os.utime(os.path.join(root, name))
+    run("touched")
+    assert report["touched"]["uploaded"] == 0, f"touched: uploaded {report['touched']['uploaded']} files"
+
+    # Parts of another size give the large files other ETags, so their stored sha256 is compared
+    run("repartitioned", multipart_chunksize=5 * 1024 * 1024)
+    repartitioned = report["repartitioned"]
+    assert repartitioned["uploaded"] == 0, f"repartitioned: uploaded {repartitioned['uploaded']} files"
+    assert repartitioned["calls"].get("HeadObject", 0) == args.large_files, (
+        f"repartitioned: {repartitioned['calls'].get('HeadObject', 0)} sha256 lookups"
+        f" for {args.large_files} multipart files"
+    )
+
+    paths = sorted(
+        os.path.join(root, name) for root, _, names in os.walk(args.directory) for name in names
+    )
+    random.shuffle(paths)
+    for path in paths[: args.changed]:
+        with open(path, "ab") as f:
+            f.write(b"\nedited\n")
+    for path in paths[args.changed : args.changed + args.removed]:
+        os.remove(path)
+    run("edited")
+
+    loop.call_soon_threadsafe(stop.set)
+    thread.join()
+    print(json.dumps(report, indent=2))
+
+    edited = report["edited"]
+    assert edited["uploaded"] == args.changed, f"edited: uploaded {edited['uploaded']} of {args.changed} changed files"
+    assert edited["deleted"] == args.removed, f"edited: deleted {edited['deleted']} of {args.removed} removed files"
+    assert not any(changes["failed"] for changes in report.values()), "some uploads or deletes failed"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import boto3
+
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+
+class S3DeltaUploader:
+    """
+    Mirrors a local directory to an S3 prefix by content instead of mtime.
+
+    `aws s3 sync` compares size and modification time, and every Notion export
+    rewrites the files, so it uploads everything on every run. This compares
+    each file's ETag, computed locally the way S3 computes it for the same
+    part size, with the ETag in the bucket listing. Objects whose ETag cannot
+    be reproduced (multipart with another part size) fall back to the sha256
+    stored in their metadata by a previous upload.
+    """
+
+    DELETE_BATCH_SIZE = 1000
+    HASH_METADATA = "sha256"
+
+    def __init__(
+        self,
+        directory: str,
+        destination: str,
+        workers: int = 8,
+        multipart_threshold: int = 8 * 1024 * 1024,
+        multipart_chunksize: int = 8 * 1024 * 1024,
+        delete: bool = True,
+        dry_run: bool = False,
+        s3=None,
+    ):
+        """
+        Initializes the S3DeltaUploader class.
+
+        Args:
+            directory (str): The local directory to upload.
+            destination (str): The `s3://bucket/prefix` to mirror it to.
+            workers (int, optional): Files uploaded in parallel. Defaults to 8.
+            multipart_threshold (int, optional): Size in bytes from which files are uploaded in parts. Defaults to 8 MiB.
+            multipart_chunksize (int, optional): Size in bytes of each part. Defaults to 8 MiB.
+            delete (bool, optional): If True, deletes objects that no longer exist locally. Defaults to True.
+            dry_run (bool, optional): If True, only computes the change set. Defaults to False.
+            s3 (optional): The S3 client. Defaults to a new boto3 client.
+        """
+        if not destination.startswith("s3://"):
+            raise ValueError(f"Destination must be an s3:// URL: {destination}")
+        self.directory = directory
+        self.bucket, _, prefix = destination[len("s3://") :].partition("/")
+        self.prefix = f"{prefix.rstrip('/')}/" if prefix.strip("/") else ""
+        self.workers = workers
+        self.delete = delete
+        self.dry_run = dry_run
+        self.s3 = s3 or boto3.client(
+            "s3", config=Config(max_pool_connections=max(workers * 4, 10))
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=4,
+        )
+
+    def _local_files(self) -> dict:
+        """
+        Lists the files under the directory.
+
+        Returns:
+            dict: Local paths keyed by object key.
+        """
+        files = {}
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                files[f"{self.prefix}{relative}"] = path
+        return files
+
+    def _remote_objects(self) -> dict:
+        """
+        Lists the objects under the prefix.
+
+        Returns:
+            dict: ETag and size keyed by object key.
+        """
+        objects = {}
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                objects[item["Key"]] = {
+                    "etag": item["ETag"].strip('"'),
+                    "size": item["Size"],
+                }
+        return objects
+
+    def _hash_file(self, path: str) -> tuple[str, str]:
+        """
+        Computes a file's sha256 and the ETag S3 gives it when uploaded with this part size.
+
+        Args:
+            path (str): The local file.
+
+        Returns:
+            tuple: The sha256 hex digest and the ETag.
+        """
+        sha256 = hashlib.sha256()
+        parts = []
+        chunksize = self.transfer_config.multipart_chunksize
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunksize), b""):
+                sha256.update(chunk)
+                parts.append(hashlib.md5(chunk).digest())
+
+        size = os.path.getsize(path)
+        if size < self.transfer_config.multipart_threshold:
+            etag = parts[0].hex() if parts else hashlib.md5(b"").hexdigest()
+        else:
+            etag = f"{hashlib.md5(b''.join(parts)).hexdigest()}-{len(parts)}"
+        return sha256.hexdigest(), etag
+
+    def _is_unchanged(self, key: str, path: str, remote: dict) -> tuple[bool, str]:
+        """
+        Compares a local file with the object at the same key.
+
+        Args:
+            key (str): The object key.
+            path (str): The local file.
+            remote (dict): The listed ETag and size of the object.
+
+        Returns:
+            tuple: Whether the content is the same, and the file's sha256.
+        """
+        sha256, etag = self._hash_file(path)
+        if remote["size"] != os.path.getsize(path):
+            return False, sha256
+        if remote["etag"] == etag:
+            return True, sha256
+        if "-" not in remote["etag"]:
+            return False, sha256
+
+        # Uploaded in parts of another size; use the hash stored with it
+        try:
+            metadata = self.s3.head_object(Bucket=self.bucket, Key=key).get("Metadata", {})
+        except ClientError:
+            return False, sha256
+        return metadata.get(self.HASH_METADATA) == sha256, sha256
+
+    def _upload(self, key: str, path: str, sha256: str):
+        """
+        Uploads a file, in parallel parts when it is large.
+
+        Args:
+            key (str): The object key.
+            path (str): The local file.
+            sha256 (str): The file's sha256, stored in the object metadata.
+        """
+        extra_args = {"Metadata": {self.HASH_METADATA: sha256}}
+        content_type, _ = mimetypes.guess_type(path)
+        if content_type:
+            extra_args["ContentType"] = content_type
+        self.s3.upload_file(
+            path, self.bucket, key, ExtraArgs=extra_args, Config=self.transfer_config
+        )
+
+    def _delete(self, keys: list) -> list[dict]:
+        """
+        Deletes objects in batched DeleteObjects calls.
+
+        Args:
+            keys (list): The object keys.
+
+        Returns:
+            list: The keys that could not be deleted, with the error.
+        """
+        failed = []
+        for i in range(0, len(keys), self.DELETE_BATCH_SIZE):
+            batch = keys[i : i + self.DELETE_BATCH_SIZE]
+            try:
+                response = self.s3.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+                )
+            except ClientError as e:
+                failed.extend({"key": key, "error": str(e)} for key in batch)
+                continue
+            failed.extend(
+                {"key": error["Key"], "error": error.get("Message", error.get("Code"))}
+                for error in response.get("Errors", [])
+            )
+        return failed
+
+    def sync(self) -> dict:
+        """
+        Uploads new and changed files and deletes removed ones.
+
+        Returns:
+            dict: The change set: uploaded and deleted keys, failures and the unchanged count.
+        """
+        local = self._local_files()
+        if not local and self.delete:
+            raise ValueError(
+                f"Refusing to delete everything under s3://{self.bucket}/{self.prefix}: {self.directory} is empty"
+            )
+        remote = self._remote_objects()
+        logging.info(f"Comparing {len(local)} files with {len(remote)} objects")
+
+        uploaded, failed, unchanged = [], [], 0
+
+        def compare(key):
+            if key not in remote:
+                return key, False, self._hash_file(local[key])[0], "added"
+            same, sha256 = self._is_unchanged(key, local[key], remote[key])
+            return key, same, sha256, "modified"
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            uploads = {}
+            for key, same, sha256, change in executor.map(compare, sorted(local)):
+                if same:
+                    unchanged += 1
+                    continue
+                entry = {"key": key, "change": change, "size": os.path.getsize(local[key])}
+                if self.dry_run:
+                    uploaded.append(entry)
+                    continue
+                uploads[executor.submit(self._upload, key, local[key], sha256)] = entry
+
+            for future in concurrent.futures.as_completed(uploads):
+                entry = uploads[future]
+                try:
+                    future.result()
+                    uploaded.append(entry)
+                except Exception as e:
+                    logging.error(f"Upload failed for {entry['key']} with error: {e}")
+                    failed.append({"key": entry["key"], "error": str(e)})
+
+        deleted = sorted(key for key in remote if key not in local) if self.delete else []
+        if deleted and not self.dry_run:
+            delete_failed = self._delete(deleted)
+            failed_keys = {f["key"] for f in delete_failed}
+            deleted = [key for key in deleted if key not in failed_keys]
+            failed.extend(delete_failed)
+
+        logging.info(
+            f"Uploaded {len(uploaded)}, deleted {len(deleted)}, unchanged {unchanged}, failed {len(failed)}"
+        )
+        return {
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "destination": f"s3://{self.bucket}/{self.prefix}",
+            "dry_run": self.dry_run,
+            "uploaded": sorted(uploaded, key=lambda entry: entry["key"]),
+            "deleted": deleted,
+            "failed": failed,
+            "unchanged": unchanged,
+        }
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="s3_uploader")
+    p.add_argument("directory", help="local directory to upload")
+    p.add_argument("destination", help="s3://bucket/prefix to mirror it to")
+    p.add_argument("--changes", help="write the change set to this JSON file")
+    p.add_argument("--workers", type=int, default=8, help="files uploaded in parallel")
+    p.add_argument("--no-delete", action="store_true", help="keep objects that no longer exist locally")
+    p.add_argument("--dry-run", action="store_true", help="only print what would change")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    changes = S3DeltaUploader(
+        args.directory,
+        args.destination,
+        workers=args.workers,
+        delete=not args.no_delete,
+        dry_run=args.dry_run,
+    ).sync()
+
+    body = json.dumps(changes, ensure_ascii=False, indent=2)
+    if args.changes:
+        with open(args.changes, "w", encoding="utf-8") as f:
+            f.write(body)
+    else:
+        print(body)
+
+    sys.exit(1 if changes["failed"] else 0)
@@ -1,15 +1,50 @@
+import base64
+import bisect
 import boto3
+import hashlib
+import heapq
+import io
 import json
+import logging
+import math
+import mmap
 import os
 import re
+import requests
+import sys
+import threading
 import time
+import uuid
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
 from datetime import datetime, timezone, timedelta
-from typing import List, Optional, Dict, Any, Union
-
-from slack_bolt import App, Say
-from slack_bolt.adapter.aws_lambda import SlackRequestHandler
+from decimal import Decimal
+from typing import Collection, Iterator, List, NamedTuple, Optional, Dict, Any, Tuple, Union
+
+from slack_bolt import App, BoltRequest, Say
+from slack_bolt.adapter.aws_lambda.handler import to_aws_response, to_bolt_request
+from slack_bolt.authorization import AuthorizeResult
+from slack_bolt.authorization.authorize import Authorize
+from slack_bolt.oauth.oauth_settings import OAuthSettings
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+from slack_sdk.oauth.installation_store import Bot, Installation, InstallationStore
+from slack_sdk.oauth.state_store import OAuthStateStore
+from slack_sdk.signature import SignatureVerifier
 
 from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import Binary
+from botocore.exceptions import ClientError
+
+from profile_registry import InferenceProfileRegistry
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, uploaded images are then sent as they are
+    Image = None
 
 
 # Helper functions for environment variable parsing
@@ -31,17 +66,60 @@ def get_env_str(key: str, default: str) -> str:
     return value if value else default
 
 
+def get_env_list(key: str, default: str = "None") -> List[str]:
+    """Get comma-separated environment variable as a list, empty when set to None"""
+    value = get_env_str(key, default)
+    if value == "None":
+        return []
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def get_env_map(key: str, default: str = "None") -> Dict[str, List[str]]:
+    """Get `key=a+b,key2=c` environment variable as a dict of lists, empty when set to None"""
+    mapping = {}
+    for entry in get_env_list(key, default):
+        name, _, values = entry.partition("=")
+        mapping[name.strip()] = [value.strip() for value in values.split("+") if value.strip()]
+    return mapping
+
+
 # Environment configuration
 class Config:
     """Configuration settings loaded from environment variables"""
     AWS_REGION = get_env_str("AWS_REGION", "us-east-1")
     SLACK_BOT_TOKEN = os.environ.get("SLACK_BOT_TOKEN")
     SLACK_SIGNING_SECRET = os.environ.get("SLACK_SIGNING_SECRET")
+    SLACK_CLIENT_ID = get_env_str("SLACK_CLIENT_ID", "None")  # Installs into many workspaces when set
+    SLACK_CLIENT_SECRET = os.environ.get("SLACK_CLIENT_SECRET")
+    SLACK_SCOPES = get_env_list(
+        "SLACK_SCOPES",
+        "app_mentions:read,channels:history,channels:join,channels:read,chat:write,"
+        "files:read,files:write,im:read,im:write,reactions:read,users:read",
+    )
+    TEAM_CACHE_SIZE = get_env_int("TEAM_CACHE_SIZE", 256)
+    OAUTH_STATE_TTL = get_env_int("OAUTH_STATE_TTL", 600)
     DYNAMODB_TABLE_NAME = get_env_str("DYNAMODB_TABLE_NAME", "gurumi-ai-bot-dev")
     KAKAO_BOT_TOKEN = get_env_str("KAKAO_BOT_TOKEN", "None")
     AGENT_ID = get_env_str("AGENT_ID", "None")
     AGENT_ALIAS_ID = get_env_str("AGENT_ALIAS_ID", "None")
+    MODEL_ID = get_env_str("MODEL_ID", "None")  # Converse instead of the Agent when set
+    MODEL_MAX_TOKENS = get_env_int("MODEL_MAX_TOKENS", 4096)
+    INFERENCE_PROFILE_NAME = get_env_str("INFERENCE_PROFILE_NAME", "gurumi-ai-bot-inference-profile")
+    INFERENCE_PROFILE_CROSS_REGION = get_env_str("INFERENCE_PROFILE_CROSS_REGION", "Yes")
+    PROMPT_CACHE = get_env_str("PROMPT_CACHE", "Yes")
+    PROMPT_CACHE_MIN_TOKENS = get_env_int("PROMPT_CACHE_MIN_TOKENS", 1024)
+    IMAGE_MAX_EDGE = get_env_int("IMAGE_MAX_EDGE", 1568)
+    IMAGE_MAX_PIXELS = get_env_int("IMAGE_MAX_PIXELS", 1150000)
+    IMAGE_MAX_COUNT = get_env_int("IMAGE_MAX_COUNT", 5)
+    IMAGE_DOWNLOAD_LIMIT = get_env_int("IMAGE_DOWNLOAD_LIMIT", 20971520)  # 20 MB
+    IMAGE_CACHE_SIZE = get_env_int("IMAGE_CACHE_SIZE", 32)
+    IMAGE_COMMAND = get_env_str("IMAGE_COMMAND", "!image")
+    IMAGE_MODEL_ID = get_env_str("IMAGE_MODEL_ID", "stability.stable-diffusion-xl-v1")
+    IMAGE_STYLE = get_env_str("IMAGE_STYLE", "photographic")
+    IMAGE_BUCKET_NAME = get_env_str("IMAGE_BUCKET_NAME", "None")
+    IMAGE_FUNCTION_NAME = get_env_str("IMAGE_FUNCTION_NAME", "None")  # Runs inline when None
     ALLOWED_CHANNEL_IDS = get_env_str("ALLOWED_CHANNEL_IDS", "None")
+    ALLOWED_CHANNEL_LIST = get_env_list("ALLOWED_CHANNEL_IDS")
     ALLOWED_CHANNEL_MESSAGE = get_env_str(
         "ALLOWED_CHANNEL_MESSAGE", "Sorry, I'm not allowed to respond in this channel."
     )
@@ -54,19 +132,72 @@ class Config:
     MAX_THROTTLE_COUNT = get_env_int("MAX_THROTTLE_COUNT", 100)
     SLACK_SAY_INTERVAL = get_env_float("SLACK_SAY_INTERVAL", 0)
     BOT_CURSOR = get_env_str("BOT_CURSOR", ":robot_face:")
-    REACTION_EMOJIS = get_env_str("REACTION_EMOJIS", "refund-done")
+    REACTION_EMOJIS = get_env_str("REACTION_EMOJIS", "refund-done,refund-done-all")
+    KNOWLEDGE_BASE_ID = get_env_str("KNOWLEDGE_BASE_ID", "None")
+    KNOWLEDGE_BASE_CHANNELS = get_env_map("KNOWLEDGE_BASE_CHANNELS")
+    KB_RETRIEVE_COUNT = get_env_int("KB_RETRIEVE_COUNT", 5)
+    KB_QUERY_VARIANTS = get_env_int("KB_QUERY_VARIANTS", 3)
+    KB_RETRIEVE_TIMEOUT = get_env_float("KB_RETRIEVE_TIMEOUT", 3.0)
+    KB_RETRIEVE_WORKERS = get_env_int("KB_RETRIEVE_WORKERS", 8)
+    KB_CACHE_SIZE = get_env_int("KB_CACHE_SIZE", 256)
+    KB_VERSION_TTL = get_env_int("KB_VERSION_TTL", 60)
+    LEXICAL_INDEX_PATH = get_env_str("LEXICAL_INDEX_PATH", "None")
+    LEXICAL_MODE = get_env_str("LEXICAL_MODE", "first")  # first, fusion
+    LEXICAL_MIN_COVERAGE = get_env_float("LEXICAL_MIN_COVERAGE", 0.8)
+    KB_CONTEXT_TOKENS = get_env_int("KB_CONTEXT_TOKENS", 2000)
+    KB_SCORE_RATIO = get_env_float("KB_SCORE_RATIO", 0.5)
+    KB_RERANK_WEIGHT = get_env_float("KB_RERANK_WEIGHT", 0.3)
+    PIPELINE_WORKERS = get_env_int("PIPELINE_WORKERS", 4)
+    EVENT_CACHE_SIZE = get_env_int("EVENT_CACHE_SIZE", 1024)
+    RECORD_TTL = get_env_int("RECORD_TTL", 604800)  # 7 days
+    RECORD_COMPRESS_THRESHOLD = get_env_int("RECORD_COMPRESS_THRESHOLD", 1024)
+    THREAD_DEBOUNCE_SECONDS = get_env_float("THREAD_DEBOUNCE_SECONDS", 1.0)
+    THREAD_LEASE_TTL = get_env_int("THREAD_LEASE_TTL", 120)
+    CANCEL_CHECK_INTERVAL = get_env_float("CANCEL_CHECK_INTERVAL", 2.0)
+    REFUND_CHANNEL_ID = get_env_str("REFUND_CHANNEL_ID", "None")
+    REFUND_BATCH_DAYS = get_env_int("REFUND_BATCH_DAYS", 31)
+    REFUND_BATCH_RATE = get_env_float("REFUND_BATCH_RATE", 1.0)
+    REFUND_BATCH_BUDGET = get_env_int("REFUND_BATCH_BUDGET", 70)
+
+    # Parsed once per container for the event router
+    ALLOWED_CHANNEL_SET = frozenset(ALLOWED_CHANNEL_LIST)
+    REACTION_EMOJI_SET = frozenset(get_env_list("REACTION_EMOJIS", "refund-done,refund-done-all"))
 
     @classmethod
-    def get_reaction_emojis(cls) -> List[str]:
-        """Parse comma-separated reaction emojis into a list"""
-        if not cls.REACTION_EMOJIS or cls.REACTION_EMOJIS == "None":
-            return []
-        return [emoji.strip() for emoji in cls.REACTION_EMOJIS.split(",") if emoji.strip()]
+    def has_retrieval(cls) -> bool:
+        """Return True if a Knowledge Base or a lexical index is configured"""
+        return (
+            cls.KNOWLEDGE_BASE_ID != "None"
+            or bool(cls.KNOWLEDGE_BASE_CHANNELS)
+            or cls.LEXICAL_INDEX_PATH != "None"
+        )
+
+    @classmethod
+    def knowledge_base_ids(cls, channel: Optional[str] = None) -> List[str]:
+        """Return the channel's Knowledge Bases followed by the default one"""
+        ids = list(cls.KNOWLEDGE_BASE_CHANNELS.get(channel, [])) if channel else []
+        if cls.KNOWLEDGE_BASE_ID != "None" and cls.KNOWLEDGE_BASE_ID not in ids:
+            ids.append(cls.KNOWLEDGE_BASE_ID)
+        return ids
+
+    @classmethod
+    def model_name(cls) -> str:
+        """Return the model that answers, as recorded with each conversation"""
+        if cls.MODEL_ID != "None":
+            return cls.MODEL_ID
+        return f"agent/{cls.AGENT_ID}/{cls.AGENT_ALIAS_ID}"
+
+    @classmethod
+    def is_multi_team(cls) -> bool:
+        """Return True if workspaces install the bot through OAuth instead of sharing SLACK_BOT_TOKEN"""
+        return cls.SLACK_CLIENT_ID != "None"
 
     @classmethod
     def validate(cls) -> bool:
         """Validate required configuration settings"""
         required_vars = ["SLACK_BOT_TOKEN", "SLACK_SIGNING_SECRET"]
+        if cls.is_multi_team():
+            required_vars = ["SLACK_CLIENT_SECRET", "SLACK_SIGNING_SECRET"]
         missing = [var for var in required_vars if not getattr(cls, var)]
         if missing:
             print(f"Missing required environment variables: {', '.join(missing)}")
@@ -78,66 +209,461 @@ class Config:
 dynamodb = boto3.resource("dynamodb")
 table = dynamodb.Table(Config.DYNAMODB_TABLE_NAME)
 bedrock_agent_client = boto3.client("bedrock-agent-runtime", region_name=Config.AWS_REGION)
+bedrock_runtime_client = boto3.client("bedrock-runtime", region_name=Config.AWS_REGION)
+bedrock_client = boto3.client("bedrock", region_name=Config.AWS_REGION)
+s3_client = boto3.client("s3", region_name=Config.AWS_REGION)
+lambda_client = boto3.client("lambda", region_name=Config.AWS_REGION)
 
-# Initialize Slack app
-app = App(
-    token=Config.SLACK_BOT_TOKEN,
-    signing_secret=Config.SLACK_SIGNING_SECRET,
-    process_before_response=True,
-)
 
-# Lazy initialization for bot_id to avoid API call at module load time
-_bot_id: Optional[str] = None
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """Thread pool whose tasks run in a copy of the submitter's context, so they act for its workspace"""
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        return super().submit(copy_context().run, fn, *args, **kwargs)
+
+
+# Shared worker pool for the I/O stages of a conversation (history, user, retrieval)
+pipeline_executor = ContextThreadPoolExecutor(max_workers=Config.PIPELINE_WORKERS)
+
+# Separate pool for the Knowledge Base calls a retrieval stage fans out, so they never
+# wait behind the pipeline stage that is waiting for them
+retrieval_executor = ContextThreadPoolExecutor(max_workers=Config.KB_RETRIEVE_WORKERS)
+
+
+class DynamoDBInstallationStore(InstallationStore):
+    """OAuth installations in the bot's table, one item per workspace or org-wide install
+
+    Only the latest installation is kept, the bot never acts with user tokens.
+    Every change drops the workspace from TeamRegistry, so a reinstall or a
+    revoked token takes effect on the next request.
+    """
+
+    @property
+    def logger(self) -> logging.Logger:
+        return logging.getLogger(__name__)
+
+    @staticmethod
+    def key(enterprise_id: Optional[str], team_id: Optional[str], is_enterprise_install: bool = False) -> str:
+        if is_enterprise_install:
+            team_id = None
+        return f"installation:{enterprise_id or '-'}:{team_id or '-'}"
+
+    @staticmethod
+    def bot_from_item(item: Optional[Dict[str, Any]]) -> Optional[Bot]:
+        """Return the bot of an installation item, or None"""
+        if not item or not item.get("bot"):
+            return None
+        return Bot(**json.loads(item["bot"]))
+
+    def save(self, installation: Installation) -> None:
+        key = self.key(installation.enterprise_id, installation.team_id, installation.is_enterprise_install)
+        table.put_item(Item={
+            "id": key,
+            "installation": json.dumps(installation.__dict__),
+            "bot": json.dumps(installation.to_bot().__dict__),
+        })
+        TeamRegistry.evict(key)
+
+    def save_bot(self, bot: Bot) -> None:
+        key = self.key(bot.enterprise_id, bot.team_id, bot.is_enterprise_install)
+        table.update_item(
+            Key={"id": key},
+            UpdateExpression="SET #bot = :bot",
+            ExpressionAttributeNames={"#bot": "bot"},
+            ExpressionAttributeValues={":bot": json.dumps(bot.__dict__)},
+        )
+        TeamRegistry.evict(key)
+
+    def find_bot(self, *, enterprise_id: Optional[str], team_id: Optional[str],
+                 is_enterprise_install: Optional[bool] = False) -> Optional[Bot]:
+        key = self.key(enterprise_id, team_id, bool(is_enterprise_install))
+        return self.bot_from_item(table.get_item(Key={"id": key}).get("Item"))
+
+    def find_installation(self, *, enterprise_id: Optional[str], team_id: Optional[str],
+                          user_id: Optional[str] = None,
+                          is_enterprise_install: Optional[bool] = False) -> Optional[Installation]:
+        key = self.key(enterprise_id, team_id, bool(is_enterprise_install))
+        item = table.get_item(Key={"id": key}).get("Item")
+        if not item or not item.get("installation"):
+            return None
+        return Installation(**json.loads(item["installation"]))
+
+    def delete_bot(self, *, enterprise_id: Optional[str], team_id: Optional[str]) -> None:
+        key = self.key(enterprise_id, team_id)
+        table.update_item(
+            Key={"id": key},
+            UpdateExpression="REMOVE #bot",
+            ExpressionAttributeNames={"#bot": "bot"},
+        )
+        TeamRegistry.evict(key)
+
+    def delete_installation(self, *, enterprise_id: Optional[str], team_id: Optional[str],
+                            user_id: Optional[str] = None) -> None:
+        key = self.key(enterprise_id, team_id)
+        table.delete_item(Key={"id": key})
+        TeamRegistry.evict(key)
+
+
+class DynamoDBOAuthStateStore(OAuthStateStore):
+    """OAuth state parameters in the bot's table, each usable once until OAUTH_STATE_TTL"""
+
+    @property
+    def logger(self) -> logging.Logger:
+        return logging.getLogger(__name__)
+
+    def issue(self, *args, **kwargs) -> str:
+        state = uuid.uuid4().hex
+        table.put_item(Item={"id": f"oauth-state:{state}", "expire_at": int(time.time()) + Config.OAUTH_STATE_TTL})
+        return state
+
+    def consume(self, state: str) -> bool:
+        try:
+            table.delete_item(
+                Key={"id": f"oauth-state:{state}"},
+                ConditionExpression="attribute_exists(id) AND expire_at >= :now",
+                ExpressionAttributeValues={":now": int(time.time())},
+            )
+            return True
+        except ClientError as e:
+            if is_conditional_check_failed(e):
+                return False
+            raise
+
+
+class DynamoDBProfileStore:
+    """Inference profile ARNs resolved by InferenceProfileRegistry, kept in the bot's table for every container"""
+
+    @staticmethod
+    def key(key: str) -> str:
+        return f"inference-profile:{key}"
+
+    def get(self, key: str) -> Optional[str]:
+        item = table.get_item(Key={"id": self.key(key)}).get("Item")
+        return item["arn"] if item else None
+
+    def put(self, key: str, arn: str) -> None:
+        table.put_item(Item={"id": self.key(key), "arn": arn})
+
+    def delete(self, key: str) -> None:
+        table.delete_item(Key={"id": self.key(key)})
+
+
+class SlackTeam(NamedTuple):
+    """A workspace the bot acts in, with its client and bot ids"""
+    enterprise_id: Optional[str]
+    team_id: Optional[str]
+    is_enterprise_install: bool
+    client: Any
+    bot_user_id: Optional[str]
+    bot_id: Optional[str]
 
 
+class TeamRegistry:
+    """Per-workspace Slack clients, resolved from team_id through an in-container LRU
+
+    Without SLACK_CLIENT_ID every request uses `app.client` and SLACK_BOT_TOKEN.
+    With OAuth, the bot token and ids of a workspace are read from the installation
+    store once; warm requests get the cached client and bot user id without any
+    Slack or DynamoDB call. The workspace of the request being handled is kept in
+    a context variable, which pipeline tasks inherit.
+    """
+
+    _teams: "OrderedDict[str, SlackTeam]" = OrderedDict()
+    _lock = threading.Lock()
+    _current: ContextVar = ContextVar("slack_team", default=None)
+    _default: Optional[SlackTeam] = None
+
+    @staticmethod
+    def ids(body: Dict[str, Any]) -> Tuple[Optional[str], Optional[str], bool]:
+        """Return the enterprise_id, team_id and is_enterprise_install of a Slack request body"""
+        authorization = (body.get("authorizations") or [{}])[0]
+        enterprise_id = body.get("enterprise_id") or authorization.get("enterprise_id")
+        team_id = body.get("team_id") or authorization.get("team_id")
+        return enterprise_id, team_id, bool(authorization.get("is_enterprise_install"))
+
+    @staticmethod
+    def new_client(token: str) -> Any:
+        return WebClient(token=token)
+
+    @classmethod
+    def default(cls) -> SlackTeam:
+        """The single workspace of SLACK_BOT_TOKEN"""
+        if cls._default is None:
+            cls._default = SlackTeam(None, None, False, app.client, None, None)
+        return cls._default
+
+    @classmethod
+    def from_bot(cls, bot: Bot) -> SlackTeam:
+        return SlackTeam(
+            bot.enterprise_id, bot.team_id, bool(bot.is_enterprise_install),
+            cls.new_client(bot.bot_token), bot.bot_user_id, bot.bot_id,
+        )
+
+    @classmethod
+    def cached(cls, key: str) -> Optional[SlackTeam]:
+        """Return a cached workspace, marking it as recently used"""
+        with cls._lock:
+            team = cls._teams.get(key)
+            if team is not None:
+                cls._teams.move_to_end(key)
+            return team
+
+    @classmethod
+    def cache(cls, key: str, team: SlackTeam) -> SlackTeam:
+        """Cache a workspace, evicting the least recently used ones over TEAM_CACHE_SIZE"""
+        with cls._lock:
+            cls._teams[key] = team
+            cls._teams.move_to_end(key)
+            while len(cls._teams) > Config.TEAM_CACHE_SIZE:
+                cls._teams.popitem(last=False)
+        return team
+
+    @classmethod
+    def evict(cls, key: str) -> None:
+        with cls._lock:
+            cls._teams.pop(key, None)
+
+    @classmethod
+    def with_bot_user_id(cls, team: SlackTeam, bot_user_id: str) -> SlackTeam:
+        """Keep a bot user id looked up with auth.test on the workspace's own cache entry"""
+        team = team._replace(bot_user_id=bot_user_id)
+        if not Config.is_multi_team():
+            cls._default = team
+            return team
+        key = DynamoDBInstallationStore.key(team.enterprise_id, team.team_id, team.is_enterprise_install)
+        return cls.cache(key, team)
+
+    @classmethod
+    def get(cls, enterprise_id: Optional[str], team_id: Optional[str],
+            is_enterprise_install: bool = False) -> Optional[SlackTeam]:
+        """Return the workspace, or None if the bot is not installed there"""
+        if not Config.is_multi_team():
+            return cls.default()
+
+        key = DynamoDBInstallationStore.key(enterprise_id, team_id, is_enterprise_install)
+        team = cls.cached(key)
+        if team is not None:
+            return team
+
+        bot = installation_store.find_bot(
+            enterprise_id=enterprise_id, team_id=team_id, is_enterprise_install=is_enterprise_install
+        )
+        if bot is None:
+            print(f"TeamRegistry: no installation for {key}")
+            return None
+        return cls.cache(key, cls.from_bot(bot))
+
+    @classmethod
+    def resolve(cls, body: Dict[str, Any]) -> Optional[SlackTeam]:
+        """Return the workspace a Slack request body came from"""
+        return cls.get(*cls.ids(body))
+
+    @classmethod
+    def current(cls) -> SlackTeam:
+        """Return the workspace of the request being handled"""
+        return cls._current.get() or cls.default()
+
+    @classmethod
+    @contextmanager
+    def using(cls, team: Optional[SlackTeam]) -> Iterator[None]:
+        """Act for the workspace within the block"""
+        token = cls._current.set(team)
+        try:
+            yield
+        finally:
+            cls._current.reset(token)
+
+
+class TeamAuthorize(Authorize):
+    """Bolt authorize answered from TeamRegistry, so warm requests skip the installation store"""
+
+    def __call__(self, *, context: Any, enterprise_id: Optional[str], team_id: Optional[str],
+                 user_id: Optional[str], **kwargs) -> Optional[AuthorizeResult]:
+        team = TeamRegistry.get(enterprise_id, team_id, bool(context.is_enterprise_install))
+        if team is None:
+            return None
+        return AuthorizeResult(
+            enterprise_id=enterprise_id,
+            team_id=team_id,
+            bot_token=team.client.token,
+            bot_user_id=team.bot_user_id,
+            bot_id=team.bot_id,
+        )
+
+
+installation_store = DynamoDBInstallationStore()
+
+# Resolves MODEL_ID to its application inference profile once, for every Converse path
+inference_profiles = InferenceProfileRegistry(bedrock_client, Config.AWS_REGION, DynamoDBProfileStore())
+
+# Initialize Slack app, for one workspace or for every workspace that installed it
+if Config.is_multi_team():
+    app = App(
+        signing_secret=Config.SLACK_SIGNING_SECRET,
+        process_before_response=True,
+        authorize=TeamAuthorize(),
+        oauth_settings=OAuthSettings(
+            client_id=Config.SLACK_CLIENT_ID,
+            client_secret=Config.SLACK_CLIENT_SECRET,
+            scopes=Config.SLACK_SCOPES,
+            installation_store=installation_store,
+            state_store=DynamoDBOAuthStateStore(),
+        ),
+    )
+    # Uninstalls and revoked tokens remove the installation
+    app.enable_token_revocation_listeners()
+else:
+    app = App(
+        token=Config.SLACK_BOT_TOKEN,
+        signing_secret=Config.SLACK_SIGNING_SECRET,
+        process_before_response=True,
+    )
+
+# Slack request signature verifier, used before any event is routed
+signature_verifier = SignatureVerifier(Config.SLACK_SIGNING_SECRET) if Config.SLACK_SIGNING_SECRET else None
+
+# Lazy initialization for bot_id to avoid API call at module load time
 def get_bot_id() -> str:
-    """Get Slack bot ID with lazy initialization"""
-    global _bot_id
-    if _bot_id is None:
-        _bot_id = app.client.api_call("auth.test")["user_id"]
-    return _bot_id
+    """Get the Slack bot user ID of the current workspace, looked up once per workspace"""
+    team = TeamRegistry.current()
+    if team.bot_user_id:
+        return team.bot_user_id
+    user_id = team.client.api_call("auth.test")["user_id"]
+    return TeamRegistry.with_bot_user_id(team, user_id).bot_user_id
+
+
+def slack_client() -> WebClient:
+    """Get the Slack client of the workspace the current request came from"""
+    return TeamRegistry.current().client
 
 # Status messages
 MSG_PREVIOUS = f"이전 대화 내용 확인 중... {Config.BOT_CURSOR}"
 MSG_RESPONSE = f"응답 기다리는 중... {Config.BOT_CURSOR}"
 MSG_ERROR = f"오류가 발생했습니다. 잠시 후 다시 시도해주세요. {Config.BOT_CURSOR}"
+MSG_IMAGE_QUESTION = "첨부한 이미지를 설명해 주세요."
+MSG_IMAGE = f"그림 그리는 중... {Config.BOT_CURSOR}"
+MSG_IMAGE_USAGE = f"사용법: `{Config.IMAGE_COMMAND} 그릴 내용 [--seed 숫자] [--style 스타일]`"
+MSG_IMAGE_STYLE = "지원하지 않는 스타일입니다: `{}`\n사용할 수 있는 스타일: {}"
+MSG_IMAGE_FILTERED = "요청한 내용으로는 그림을 만들 수 없습니다. 다른 표현으로 다시 시도해주세요."
+MSG_IMAGE_DONE = "<@{}> seed `{}`, style `{}`"
+MSG_GENERATE_ERROR = "죄송합니다. 응답을 생성하는 중 오류가 발생했습니다. 잠시 후 다시 시도해주세요. (오류: {})"
+
+
+class StageTrace:
+    """Records the start and end of each conversation stage to show the critical path"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def run(self, stage: str, func, *args, **kwargs) -> Any:
+        """Run a stage function and record its timing"""
+        start = time.perf_counter() - self.started
+        try:
+            return func(*args, **kwargs)
+        finally:
+            end = time.perf_counter() - self.started
+            with self._lock:
+                self.stages[stage] = (start, end)
+
+    async def arun(self, stage: str, awaitable) -> Any:
+        """Await a stage coroutine and record its timing"""
+        start = time.perf_counter() - self.started
+        try:
+            return await awaitable
+        finally:
+            end = time.perf_counter() - self.started
+            with self._lock:
+                self.stages[stage] = (start, end)
+
+    def elapsed_ms(self) -> Dict[str, int]:
+        """Return the duration of each recorded stage in milliseconds"""
+        with self._lock:
+            return {stage: int((end - start) * 1000) for stage, (start, end) in self.stages.items()}
+
+    def report(self) -> str:
+        """Format stage offsets, wall time and the sequential sum of all stages"""
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: item[1][0])
+        wall = time.perf_counter() - self.started
+        sequential = sum(end - start for _, (start, end) in stages)
+        parts = [f"{stage}={start * 1000:.0f}-{end * 1000:.0f}ms" for stage, (start, end) in stages]
+        return f"{self.name}: trace: {' '.join(parts)} wall={wall * 1000:.0f}ms sequential={sequential * 1000:.0f}ms"
+
+
+def is_conditional_check_failed(error: ClientError) -> bool:
+    """Check if a DynamoDB error is a failed conditional write"""
+    return error.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException"
 
 
 class DynamoDBManager:
     """Handles DynamoDB operations for conversation context"""
 
     @staticmethod
-    def get_context(thread_ts: Optional[str], user: str, default: str = "") -> str:
-        """Retrieve conversation context from DynamoDB"""
+    def has_context(thread_ts: Optional[str], user: str) -> bool:
+        """Check whether a dedup marker exists in DynamoDB"""
         try:
             key = {"id": thread_ts or user}
-            item = table.get_item(Key=key).get("Item")
-            return item["conversation"] if item else default
+            return "Item" in table.get_item(Key=key, ProjectionExpression="id")
         except Exception as e:
             print(f"Error retrieving context: {e}")
-            return default
+            return False
 
     @staticmethod
-    def put_context(thread_ts: Optional[str], user: str, conversation: str = "") -> None:
-        """Store conversation context in DynamoDB with TTL"""
-        try:
-            expire_at = int(time.time()) + 3600  # 1 hour TTL
-            expire_dt = datetime.fromtimestamp(expire_at).isoformat()
-
-            item = {
-                "id": thread_ts or user,
-                "conversation": conversation,
-                "expire_dt": expire_dt,
-                "expire_at": expire_at,
-            }
+    def context_item(thread_ts: Optional[str], user: str) -> Dict[str, Any]:
+        """Build a minimal dedup marker with a 1 hour TTL
+
+        The message text is not stored here; complete turns are kept as
+        separate conversation records.
+        """
+        expire_at = int(time.time()) + 3600  # 1 hour TTL
+        item = {
+            "id": thread_ts or user,
+            "expire_dt": datetime.fromtimestamp(expire_at).isoformat(),
+            "expire_at": expire_at,
+        }
+        if thread_ts:
+            item["user"] = user
+        return item
 
-            if thread_ts:
-                item["user"] = user
+    @staticmethod
+    def event_item(event_id: str) -> Dict[str, Any]:
+        """Build an event id marker with a 1 hour TTL"""
+        expire_at = int(time.time()) + 3600  # 1 hour TTL
+        return {
+            "id": event_id,
+            "expire_dt": datetime.fromtimestamp(expire_at).isoformat(),
+            "expire_at": expire_at,
+        }
 
-            table.put_item(Item=item)
+    @classmethod
+    def put_context(cls, thread_ts: Optional[str], user: str) -> None:
+        """Store a minimal dedup marker in DynamoDB with TTL"""
+        try:
+            table.put_item(Item=cls.context_item(thread_ts, user))
         except Exception as e:
             print(f"Error storing context: {e}")
 
+    @classmethod
+    def claim_event(cls, event_id: str) -> bool:
+        """Record an event id with a conditional write, returning False if it already exists"""
+        try:
+            table.put_item(
+                Item=cls.event_item(event_id),
+                ConditionExpression="attribute_not_exists(id)",
+            )
+            return True
+        except ClientError as e:
+            if is_conditional_check_failed(e):
+                return False
+            print(f"Error claiming event: {e}")
+            return True
+        except Exception as e:
+            print(f"Error claiming event: {e}")
+            return True
+
     @staticmethod
     def count_user_contexts(user: str) -> int:
         """Count contexts belonging to a specific user using GSI"""
@@ -153,6 +679,819 @@ class DynamoDBManager:
             return 0
 
 
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the token count of a text (about 4 ASCII or 1.5 other chars per token)"""
+    if not text:
+        return 0
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return int(ascii_chars / 4 + (len(text) - ascii_chars) / 1.5) + 1
+
+
+class ConversationRecord:
+    """Stores complete conversation turns in DynamoDB
+
+    Text fields larger than RECORD_COMPRESS_THRESHOLD bytes are zlib-compressed into
+    binary `<field>_z` attributes to keep consumed write capacity low. Records use
+    `user_id` rather than `user` so they are not counted by the throttle index.
+    """
+
+    TEXT_FIELDS = ("question", "answer")
+
+    @staticmethod
+    def encode_text(item: Dict[str, Any], field: str, text: str) -> None:
+        """Set a text attribute, compressing it when above the threshold"""
+        data = text.encode("utf-8")
+        if len(data) > Config.RECORD_COMPRESS_THRESHOLD:
+            item[f"{field}_z"] = Binary(zlib.compress(data, 6))
+        else:
+            item[field] = text
+
+    @classmethod
+    def decode(cls, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a record with compressed text attributes expanded"""
+        record = dict(item)
+        for field in cls.TEXT_FIELDS:
+            compressed = record.pop(f"{field}_z", None)
+            if compressed is not None:
+                record[field] = zlib.decompress(bytes(compressed)).decode("utf-8")
+        return record
+
+    @classmethod
+    def build_item(cls, record_id: str, question: str, answer: str, prompt: str,
+                   timings: Dict[str, int], channel: Optional[str] = None,
+                   thread_ts: Optional[str] = None, user_id: Optional[str] = None,
+                   usage: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """Build a conversation record item with TTL
+
+        usage holds the token counts reported by Converse, including prompt cache
+        reads and writes, and is added next to the estimated counts.
+        """
+        now = int(time.time())
+        expire_at = now + Config.RECORD_TTL
+
+        item = {
+            "id": f"conv:{record_id}",
+            "model": Config.model_name(),
+            "created_at": now,
+            "timings": timings,
+            "tokens": {
+                "prompt": estimate_tokens(prompt),
+                "question": estimate_tokens(question),
+                "answer": estimate_tokens(answer),
+                **(usage or {}),
+            },
+            "expire_dt": datetime.fromtimestamp(expire_at).isoformat(),
+            "expire_at": expire_at,
+        }
+
+        for key, value in (("channel", channel), ("thread_ts", thread_ts), ("user_id", user_id)):
+            if value:
+                item[key] = value
+
+        cls.encode_text(item, "question", question)
+        cls.encode_text(item, "answer", answer)
+
+        return item
+
+    @classmethod
+    def put(cls, record_id: str, question: str, answer: str, prompt: str,
+            timings: Dict[str, int], channel: Optional[str] = None,
+            thread_ts: Optional[str] = None, user_id: Optional[str] = None,
+            usage: Optional[Dict[str, int]] = None) -> None:
+        """Store a conversation record"""
+        try:
+            table.put_item(Item=cls.build_item(
+                record_id, question, answer, prompt, timings, channel, thread_ts, user_id, usage
+            ))
+        except Exception as e:
+            print(f"Error storing conversation record: {e}")
+
+    @classmethod
+    def get(cls, record_id: str) -> Optional[Dict[str, Any]]:
+        """Retrieve and decode a conversation record"""
+        try:
+            item = table.get_item(Key={"id": f"conv:{record_id}"}).get("Item")
+            return cls.decode(item) if item else None
+        except Exception as e:
+            print(f"Error retrieving conversation record: {e}")
+            return None
+
+
+class EventDeduplicator:
+    """In-container LRU of recently handled Slack event ids and client_msg_ids
+
+    Warm containers see most Slack retries of the events they handled, so duplicates
+    are dropped here before any DynamoDB call is made.
+    """
+
+    _seen: "OrderedDict[str, bool]" = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def is_duplicate(cls, key: str) -> bool:
+        """Return True if the key was seen before, otherwise remember it"""
+        with cls._lock:
+            if key in cls._seen:
+                cls._seen.move_to_end(key)
+                return True
+            cls._seen[key] = True
+            if len(cls._seen) > Config.EVENT_CACHE_SIZE:
+                cls._seen.popitem(last=False)
+            return False
+
+
+class RetrievalCache:
+    """In-container LRU of Knowledge Base passages keyed by KB version and query
+
+    The ingestion stage writes a `kb-version:<knowledge base id>` marker item after
+    every sync of that Knowledge Base. Each queried KB's marker is re-read at most
+    every KB_VERSION_TTL seconds, and a new version drops the passages cached for
+    that KB, since the documents they came from may have changed.
+    """
+
+    _entries: "OrderedDict[Tuple[str, str, str], List[Tuple[str, float]]]" = OrderedDict()
+    _lock = threading.Lock()
+    _versions: Dict[str, str] = {}
+    _versions_checked: Dict[str, float] = {}
+
+    @staticmethod
+    def marker_params(scope: str) -> Dict[str, Any]:
+        return {
+            "Key": {"id": f"kb-version:{scope}"},
+            "ProjectionExpression": "#version",
+            "ExpressionAttributeNames": {"#version": "version"},
+        }
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    @classmethod
+    def expired_scopes(cls, scopes: Collection[str]) -> List[str]:
+        """Return the Knowledge Bases whose version marker should be read again"""
+        now = time.monotonic()
+        return [
+            scope for scope in dict.fromkeys(scopes)
+            if now - cls._versions_checked.get(scope, float("-inf")) >= Config.KB_VERSION_TTL
+        ]
+
+    @classmethod
+    def set_version(cls, scope: str, item: Optional[Dict[str, Any]]) -> None:
+        """Remember a Knowledge Base's marker version, dropping its passages when it changed"""
+        version = str(item.get("version", "0")) if item else "0"
+        with cls._lock:
+            cls._versions_checked[scope] = time.monotonic()
+            if version != cls._versions.get(scope):
+                for key in [key for key in cls._entries if key[1] == scope]:
+                    del cls._entries[key]
+                cls._versions[scope] = version
+
+    @classmethod
+    def refresh_versions(cls, scopes: Collection[str]) -> None:
+        """Read the version markers of the Knowledge Bases from DynamoDB where the cached ones are stale"""
+        for scope in cls.expired_scopes(scopes):
+            try:
+                item = table.get_item(**cls.marker_params(scope)).get("Item")
+                cls.set_version(scope, item)
+            except Exception as e:
+                print(f"Error reading knowledge base version of {scope}: {e}")
+
+    @classmethod
+    def get(cls, query: str, scope: str) -> Optional[List[Tuple[str, float]]]:
+        """Return cached passages for the query in a scope (Knowledge Base), or None"""
+        with cls._lock:
+            version = cls._versions.get(scope)
+            if version is None:
+                return None
+            key = (version, scope, cls.normalize(query))
+            if key not in cls._entries:
+                return None
+            cls._entries.move_to_end(key)
+            return cls._entries[key]
+
+    @classmethod
+    def put(cls, query: str, passages: List[Tuple[str, float]], scope: str) -> None:
+        """Cache passages retrieved under the scope's current version"""
+        with cls._lock:
+            version = cls._versions.get(scope)
+            if version is None or Config.KB_CACHE_SIZE <= 0:
+                return
+            cls._entries[(version, scope, cls.normalize(query))] = passages
+            if len(cls._entries) > Config.KB_CACHE_SIZE:
+                cls._entries.popitem(last=False)
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[str, float]]], limit: int,
+                           k: int = 60) -> List[Tuple[str, float]]:
+    """Merge ranked (passage, score) lists by reciprocal rank, keeping each passage once"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, (passage, _) in enumerate(ranking):
+            scores[passage] = scores.get(passage, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: -item[1])[:limit]
+
+
+class LexicalIndex:
+    """Memory-mapped BM25 index of the exported Notion chunks, searched in-process
+
+    examples/notion/lexical_index.py builds the file at export time. Terms are Hangul
+    character n-grams and whole words of other scripts, stored as sorted 64-bit hashes.
+    Posting lists hold precomputed BM25 weights, heaviest first, so a lookup is one
+    bisect per query term and a sum over at most MAX_POSTINGS postings per term.
+    """
+
+    MAGIC = b"GLEXIDX1"
+    MAX_POSTINGS = 1000
+    MIN_IMPACT_RATIO = 0.2
+    TOKEN_PATTERN = re.compile(r"[가-힣]+|[^\W_가-힣]+")
+
+    _lock = threading.Lock()
+    _loaded = False
+    _index: Optional["LexicalIndex"] = None
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if bytes(view[:8]) != self.MAGIC:
+            raise ValueError(f"Not a lexical index: {path}")
+        header_size = int.from_bytes(view[8:16], "little")
+        header = json.loads(bytes(view[16:16 + header_size]))
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"Lexical index was built for {header['byteorder']}-endian machines")
+
+        base = (16 + header_size + 7) // 8 * 8
+        sections = {
+            name: view[base + offset:base + offset + size].cast(fmt)
+            for name, (offset, size, fmt) in header["sections"].items()
+        }
+        self.ngram = header["ngram"]
+        self.terms = sections["terms"]
+        self.offsets = sections["offsets"]
+        self.postings = sections["postings"]
+        self.weights = sections["weights"]
+        self.doc_offsets = sections["doc_offsets"]
+        self.texts = sections["texts"]
+
+    @classmethod
+    def tokens(cls, text: str, ngram: int = 2) -> List[str]:
+        """Split text into Hangul character n-grams and whole words of other scripts"""
+        tokens = []
+        for run in cls.TOKEN_PATTERN.findall(text.lower()):
+            if len(run) > ngram and "가" <= run[0] <= "힣":
+                tokens.extend(run[i:i + ngram] for i in range(len(run) - ngram + 1))
+            else:
+                tokens.append(run)
+        return tokens
+
+    @staticmethod
+    def term_hash(term: str) -> int:
+        return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+    def passage(self, doc: int) -> str:
+        return bytes(self.texts[self.doc_offsets[doc]:self.doc_offsets[doc + 1]]).decode("utf-8")
+
+    def search(self, query: str, limit: int) -> Tuple[List[Tuple[str, float]], float]:
+        """Return the best (passage, score) pairs and the share of the query's weight the best one matches
+
+        Terms whose heaviest posting weighs less than MIN_IMPACT_RATIO of the strongest
+        term's are skipped, which bounds the cost of common terms at little loss of ranking.
+        Terms missing from the index count as strong as the strongest one.
+        """
+        lists = []
+        missing = 0
+        for term, count in Counter(self.tokens(query, self.ngram)).items():
+            key = self.term_hash(term)
+            i = bisect.bisect_left(self.terms, key)
+            if i == len(self.terms) or self.terms[i] != key:
+                missing += 1
+                continue
+            start = self.offsets[i]
+            end = min(self.offsets[i + 1], start + self.MAX_POSTINGS)
+            lists.append((start, end, count, self.weights[start] * count))
+        if not lists:
+            return [], 0.0
+
+        strongest = max(impact for _, _, _, impact in lists)
+        scores: Dict[int, float] = {}
+        matched: Dict[int, float] = {}
+        for start, end, count, impact in lists:
+            if impact < strongest * self.MIN_IMPACT_RATIO:
+                continue
+            for doc, weight in zip(self.postings[start:end].tolist(), self.weights[start:end].tolist()):
+                scores[doc] = scores.get(doc, 0.0) + weight * count
+                matched[doc] = matched.get(doc, 0.0) + impact
+
+        ranked = heapq.nlargest(limit, scores, key=scores.__getitem__)
+        total = sum(impact for _, _, _, impact in lists) + missing * strongest
+        return [(self.passage(doc), scores[doc]) for doc in ranked], matched[ranked[0]] / total
+
+    @classmethod
+    def load(cls) -> Optional["LexicalIndex"]:
+        """Open the index once per container, or return None without one"""
+        if cls._loaded:
+            return cls._index
+        with cls._lock:
+            if not cls._loaded:
+                if Config.LEXICAL_INDEX_PATH != "None":
+                    try:
+                        cls._index = cls(Config.LEXICAL_INDEX_PATH)
+                    except Exception as e:
+                        print(f"Error loading lexical index: {e}")
+                cls._loaded = True
+        return cls._index
+
+    @classmethod
+    def lookup(cls, query: str) -> Tuple[List[Tuple[str, float]], float]:
+        """Search the container's index, returning no passages without one"""
+        index = cls.load()
+        if index is None:
+            return [], 0.0
+        try:
+            return index.search(query, Config.KB_RETRIEVE_COUNT)
+        except Exception as e:
+            print(f"Error searching lexical index: {e}")
+            return [], 0.0
+
+    @staticmethod
+    def is_sufficient(passages: List[Tuple[str, float]], coverage: float,
+                      knowledge_base_ids: List[str]) -> bool:
+        """Return True if the lexical passages answer the query without the Knowledge Bases"""
+        if not knowledge_base_ids:
+            return True
+        return Config.LEXICAL_MODE == "first" and bool(passages) and coverage >= Config.LEXICAL_MIN_COVERAGE
+
+    @staticmethod
+    def merge(lexical: List[Tuple[str, float]],
+              knowledge: List[Tuple[str, float]]) -> List[Tuple[str, float]]:
+        """Combine lexical and Knowledge Base passages according to LEXICAL_MODE"""
+        if Config.LEXICAL_MODE == "fusion":
+            return reciprocal_rank_fusion([knowledge, lexical], Config.KB_RETRIEVE_COUNT)
+        return knowledge or lexical
+
+
+class QueryExpander:
+    """Builds cheap local variants of a question for retrieval
+
+    Mixed Korean and English questions embed poorly as one string, so besides the
+    question itself the Knowledge Bases are asked with its known terms swapped to the
+    other language (GLOSSARY) and with its keywords, without particles or the predicate
+    closing each sentence when it is a question or request ending (ENDINGS).
+    """
+
+    GLOSSARY = {
+        "람다": "lambda",
+        "서버리스": "serverless",
+        "배포": "deploy",
+        "버킷": "bucket",
+        "테이블": "table",
+        "함수": "function",
+        "권한": "permission",
+        "역할": "role",
+        "정책": "policy",
+        "리전": "region",
+        "인스턴스": "instance",
+        "컨테이너": "container",
+        "쿠버네티스": "kubernetes",
+        "데이터베이스": "database",
+        "네트워크": "network",
+        "보안": "security",
+        "비용": "cost",
+        "요금": "pricing",
+        "모델": "model",
+        "지식 기반": "knowledge base",
+        "스터디": "study",
+        "밋업": "meetup",
+        "행사": "event",
+        "발표": "talk",
+        "모니터링": "monitoring",
+        "로그": "log",
+    }
+    PARTICLES = (
+        "하려면", "하는데", "에서는", "으로는", "에게서", "이라고", "에서", "으로", "에게", "까지",
+        "부터", "하고", "하는", "하기", "하면", "해서", "이랑", "처럼", "보다", "라고", "은", "는",
+        "이", "가", "을", "를", "에", "의", "도", "와", "과", "로", "랑", "만", "한",
+    )
+    ENDINGS = ("요", "까", "니다", "줘", "죠", "해", "야")
+    STOPWORDS = frozenset(
+        "어떻게 어떤 무엇 무슨 뭐 뭔가 언제 어디 누가 왜 좀 그리고 그냥 혹시 "
+        "a an the is are was were be do does did how what when where who why which "
+        "can could should would i you we it to of in on for with and or please".split()
+    )
+    WORD_PATTERN = re.compile(r"[가-힣]+|[A-Za-z0-9][A-Za-z0-9.+#-]*")
+    SENTENCE_END = re.compile(r"[^\w\n]*(?:[?!.\n]|$)")
+    _ENGLISH = {english: korean for korean, english in GLOSSARY.items()}
+    _GLOSSARY_PATTERN = re.compile(
+        "|".join(sorted(map(re.escape, GLOSSARY), key=len, reverse=True))
+        + r"|(?<![A-Za-z])(?:" + "|".join(sorted(map(re.escape, _ENGLISH), key=len, reverse=True))
+        + r")(?![A-Za-z])",
+        re.IGNORECASE,
+    )
+
+    @classmethod
+    def keywords(cls, query: str) -> List[str]:
+        """Extract content words, stripping Korean particles and dropping question predicates
+
+        ENDINGS are only checked on the last word of each sentence, so nouns such as
+        개요 or 분야 elsewhere in the question are kept.
+        """
+        keywords = []
+        for match in cls.WORD_PATTERN.finditer(query):
+            word = match.group(0)
+            lowered = word.lower()
+            if lowered in cls.STOPWORDS:
+                continue
+            if "가" <= word[0] <= "힣":
+                predicate = cls.SENTENCE_END.match(query, match.end()) is not None
+                if word in cls.PARTICLES or (predicate and word.endswith(cls.ENDINGS)):
+                    continue
+                for particle in cls.PARTICLES:
+                    if word.endswith(particle) and len(word) - len(particle) >= 2:
+                        word = word[:-len(particle)]
+                        break
+            if word not in keywords:
+                keywords.append(word)
+        return keywords
+
+    @classmethod
+    def translated(cls, query: str) -> str:
+        """Swap glossary terms to the other language in one pass"""
+        def swap(match: "re.Match") -> str:
+            term = match.group(0)
+            return f" {cls.GLOSSARY.get(term) or cls._ENGLISH[term.lower()]} "
+
+        return " ".join(cls._GLOSSARY_PATTERN.sub(swap, query).split())
+
+    @classmethod
+    def variants(cls, query: str) -> List[str]:
+        """Return the question and up to KB_QUERY_VARIANTS - 1 distinct variants of it"""
+        variants, seen = [], set()
+        for variant in (query, cls.translated(query), " ".join(cls.keywords(query))):
+            key = RetrievalCache.normalize(variant)
+            if key and key not in seen:
+                seen.add(key)
+                variants.append(variant)
+        return variants[:max(Config.KB_QUERY_VARIANTS, 1)]
+
+
+class ContextPacker:
+    """Reranks retrieved passages and packs the best of them into the prompt's context budget
+
+    Each candidate's retrieval score, relative to the best candidate's, is blended with
+    the share of query terms it contains (KB_RERANK_WEIGHT). Candidates below KB_SCORE_RATIO
+    of the best blended score, and candidates mostly contained in a better one, are
+    dropped; the rest are added best first while they fit in KB_CONTEXT_TOKENS.
+    """
+
+    OVERLAP_RATIO = 0.8
+
+    @classmethod
+    def overlaps(cls, terms: set, other: set) -> bool:
+        """Return True if most terms of the smaller passage appear in the other"""
+        smaller = min(len(terms), len(other))
+        return smaller > 0 and len(terms & other) >= cls.OVERLAP_RATIO * smaller
+
+    @classmethod
+    def pack(cls, query: str, candidates: List[Tuple[str, float]]) -> List[str]:
+        """Return the passages worth adding to the prompt, best first"""
+        candidates = [(text, score) for text, score in candidates if text and text.strip()]
+        if not candidates:
+            return []
+
+        query_terms = set(LexicalIndex.tokens(query))
+        best = max(score for _, score in candidates)
+        best = best if best > 0 else 1.0
+        ranked = []
+        for text, score in candidates:
+            terms = set(LexicalIndex.tokens(text))
+            overlap = len(query_terms & terms) / len(query_terms) if query_terms else 0.0
+            blended = (1 - Config.KB_RERANK_WEIGHT) * score / best + Config.KB_RERANK_WEIGHT * overlap
+            ranked.append((blended, text, terms))
+        ranked.sort(key=lambda item: -item[0])
+
+        cutoff = ranked[0][0] * Config.KB_SCORE_RATIO
+        budget = Config.KB_CONTEXT_TOKENS
+        packed, packed_terms = [], []
+        for blended, text, terms in ranked:
+            if blended < cutoff:
+                break
+            if any(cls.overlaps(terms, other) for other in packed_terms):
+                continue
+            tokens = estimate_tokens(text)
+            if tokens > budget:
+                continue
+            packed.append(text)
+            packed_terms.append(terms)
+            budget -= tokens
+
+        if not packed:
+            # The best passage alone is over the budget, keep its beginning
+            text = ranked[0][1]
+            packed.append(text[:len(text) * Config.KB_CONTEXT_TOKENS // estimate_tokens(text)])
+        return packed
+
+
+class ThreadLease:
+    """Per-thread lease that lets one generation answer messages sent in quick succession
+
+    The first message of a burst takes the lease with a conditional write and leads.
+    Messages arriving while the lease is held are appended to its `pending` list instead
+    of starting their own generation. The leader waits THREAD_DEBOUNCE_SECONDS, drains
+    the pending messages into one prompt (moving them to `answering`), and only releases
+    the lease once nothing is pending. An expired lease (crashed leader) can be taken over.
+    """
+
+    @staticmethod
+    def key(channel: str, thread_ts: Optional[str], user: str) -> str:
+        """Lease id for a thread, or for a user's top-level messages in a channel"""
+        return f"lease:{channel}:{thread_ts or user}"
+
+    @staticmethod
+    def message_id(event: Dict[str, Any]) -> str:
+        """Id of a question: its client_msg_id, or its ts for file uploads that have none"""
+        return event.get("client_msg_id") or f"ts:{event.get('ts', '')}"
+
+    @classmethod
+    def message(cls, event: Dict[str, Any], text: str) -> Dict[str, str]:
+        """Pending entry for a Slack message (an event or the `message` of an edit)
+
+        Attached images are kept as a JSON list under `files`.
+        """
+        message = {
+            "client_msg_id": cls.message_id(event),
+            "user": event.get("user", ""),
+            "ts": event.get("ts", ""),
+            "version": event.get("edited", {}).get("ts", "0"),
+            "text": text or (MSG_IMAGE_QUESTION if event.get("files") else ""),
+        }
+        files = SlackImage.attachments(event)
+        if files:
+            message["files"] = json.dumps(files)
+        return message
+
+    @staticmethod
+    def files(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Return the images attached to coalesced messages, oldest first, up to IMAGE_MAX_COUNT"""
+        files: Dict[str, Dict[str, str]] = {}
+        for message in sorted(messages, key=lambda m: m.get("ts", "")):
+            for file in json.loads(message.get("files") or "[]"):
+                files.setdefault(file["id"], file)
+        return list(files.values())[:Config.IMAGE_MAX_COUNT]
+
+    @staticmethod
+    def merge(messages: List[Dict[str, str]]) -> str:
+        """Merge coalesced messages into one query, naming authors when there are several"""
+        messages = sorted(messages, key=lambda m: m.get("ts", ""))
+        if len({m["user"] for m in messages}) > 1:
+            return "\n\n".join(f"<@{m['user']}>: {m['text']}" for m in messages)
+        return "\n\n".join(m["text"] for m in messages)
+
+    @staticmethod
+    def acquire_params(key: str, owner: str) -> Dict[str, Any]:
+        now = int(time.time())
+        expire_at = now + Config.THREAD_LEASE_TTL
+        return {
+            "Item": {
+                "id": key,
+                "owner": owner,
+                "pending": [],
+                "answering": [],
+                "expire_dt": datetime.fromtimestamp(expire_at).isoformat(),
+                "expire_at": expire_at,
+            },
+            "ConditionExpression": "attribute_not_exists(id) OR expire_at < :now",
+            "ExpressionAttributeValues": {":now": now},
+        }
+
+    @staticmethod
+    def append_params(key: str, message: Dict[str, str]) -> Dict[str, Any]:
+        return {
+            "Key": {"id": key},
+            "UpdateExpression": "SET pending = list_append(pending, :message)",
+            "ConditionExpression": "attribute_exists(id) AND expire_at >= :now",
+            "ExpressionAttributeValues": {":message": [message], ":now": int(time.time())},
+        }
+
+    @staticmethod
+    def drain_params(key: str) -> Dict[str, Any]:
+        expire_at = int(time.time()) + Config.THREAD_LEASE_TTL
+        return {
+            "Key": {"id": key},
+            "UpdateExpression": (
+                "SET answering = list_append(if_not_exists(answering, :empty), pending), "
+                "pending = :empty, expire_at = :expire_at"
+            ),
+            "ConditionExpression": "attribute_exists(id)",
+            "ExpressionAttributeValues": {":empty": [], ":expire_at": expire_at},
+            "ReturnValues": "UPDATED_OLD",
+        }
+
+    @staticmethod
+    def release_params(key: str) -> Dict[str, Any]:
+        return {
+            "Key": {"id": key},
+            "ConditionExpression": "attribute_not_exists(id) OR size(pending) = :zero",
+            "ExpressionAttributeValues": {":zero": 0},
+        }
+
+    @staticmethod
+    def recent(message: Dict[str, Any]) -> bool:
+        """Check if a message was sent within the debounce window, so it may not be leased yet"""
+        return time.time() - float(message.get("ts") or 0) < Config.THREAD_DEBOUNCE_SECONDS
+
+    @staticmethod
+    def holds(item: Optional[Dict[str, Any]], client_msg_id: str) -> bool:
+        """Check if a live lease item is waiting to answer, or answering, a message"""
+        if not item or item.get("expire_at", 0) < int(time.time()):
+            return False
+        messages = list(item.get("pending", [])) + list(item.get("answering", []))
+        return client_msg_id == item.get("owner") or any(m["client_msg_id"] == client_msg_id for m in messages)
+
+    @classmethod
+    def in_flight(cls, key: str, client_msg_id: str) -> bool:
+        """Check if a message is still debounced or being answered under the lease"""
+        try:
+            return cls.holds(table.get_item(Key={"id": key}).get("Item"), client_msg_id)
+        except Exception as e:
+            print(f"Error reading thread lease: {e}")
+            return False
+
+    @classmethod
+    def acquire(cls, key: str, message: Dict[str, str]) -> bool:
+        """Take the lease, or append the message to the holder's pending list
+
+        Returns True when the caller leads and must answer the message.
+        """
+        try:
+            for _ in range(3):
+                try:
+                    table.put_item(**cls.acquire_params(key, message["client_msg_id"]))
+                    return True
+                except ClientError as e:
+                    if not is_conditional_check_failed(e):
+                        raise
+
+                try:
+                    table.update_item(**cls.append_params(key, message))
+                    return False
+                except ClientError as e:
+                    # The lease was released in between; try to take it again
+                    if not is_conditional_check_failed(e):
+                        raise
+        except Exception as e:
+            print(f"Error acquiring thread lease: {e}")
+
+        # Answer on our own rather than dropping the message
+        return True
+
+    @classmethod
+    def drain(cls, key: str) -> List[Dict[str, str]]:
+        """Take the pending messages and extend the lease"""
+        try:
+            response = table.update_item(**cls.drain_params(key))
+            return response.get("Attributes", {}).get("pending", [])
+        except Exception as e:
+            print(f"Error draining thread lease: {e}")
+            return []
+
+    @classmethod
+    def release(cls, key: str) -> bool:
+        """Release the lease, returning False if messages arrived in the meantime"""
+        try:
+            table.delete_item(**cls.release_params(key))
+            return True
+        except ClientError as e:
+            if is_conditional_check_failed(e):
+                return False
+            print(f"Error releasing thread lease: {e}")
+            return True
+        except Exception as e:
+            print(f"Error releasing thread lease: {e}")
+            return True
+
+
+class GenerationCancelled(Exception):
+    """Raised when a question being answered was edited or deleted"""
+
+
+class CancelToken:
+    """Cancellation check for the generation answering a set of messages
+
+    Edits and deletes write a `cancel:{client_msg_id}` item whose version is the edit
+    timestamp (DELETED_VERSION for deletes). A generation answering an older version
+    of any of its messages is cancelled. DynamoDB is read at most every
+    CANCEL_CHECK_INTERVAL seconds; cancellations made in this process are seen at once.
+    """
+
+    DELETED_VERSION = Decimal(10 ** 12)
+
+    # Cancellations seen by this process: client_msg_id -> version, an LRU of
+    # EVENT_CACHE_SIZE entries; older ones are still read from DynamoDB
+    _local: "OrderedDict[str, Decimal]" = OrderedDict()
+    _local_lock = threading.Lock()
+
+    def __init__(self, messages: List[Dict[str, str]]):
+        self.messages = messages
+        self.versions: Dict[str, Decimal] = {}
+        self._checked_at = time.monotonic()
+
+    @staticmethod
+    def version(message: Dict[str, Any]) -> Decimal:
+        """Version of a pending message, the edit timestamp or 0"""
+        return Decimal(str(message.get("version") or "0"))
+
+    @staticmethod
+    def cancel_params(client_msg_id: str, version: Decimal) -> Dict[str, Any]:
+        expire_at = int(time.time()) + 3600  # 1 hour TTL
+        return {
+            "Item": {
+                "id": f"cancel:{client_msg_id}",
+                "version": version,
+                "expire_dt": datetime.fromtimestamp(expire_at).isoformat(),
+                "expire_at": expire_at,
+            },
+            # Keep the newest version when edits arrive out of order
+            "ConditionExpression": "attribute_not_exists(id) OR #version < :version",
+            "ExpressionAttributeNames": {"#version": "version"},
+            "ExpressionAttributeValues": {":version": version},
+        }
+
+    @classmethod
+    def remember(cls, client_msg_id: str, version: Decimal) -> None:
+        """Record a cancellation for generations running in this process"""
+        with cls._local_lock:
+            if version > cls._local.get(client_msg_id, Decimal(0)):
+                cls._local[client_msg_id] = version
+                cls._local.move_to_end(client_msg_id)
+                if len(cls._local) > Config.EVENT_CACHE_SIZE:
+                    cls._local.popitem(last=False)
+
+    @classmethod
+    def cancel(cls, client_msg_id: str, version: Any) -> None:
+        """Cancel generations answering versions of a message older than `version`"""
+        version = Decimal(str(version))
+        cls.remember(client_msg_id, version)
+        try:
+            table.put_item(**cls.cancel_params(client_msg_id, version))
+        except ClientError as e:
+            if not is_conditional_check_failed(e):
+                print(f"Error storing cancel token: {e}")
+        except Exception as e:
+            print(f"Error storing cancel token: {e}")
+
+    def merge_versions(self, versions: Dict[str, Decimal]) -> None:
+        """Merge cancel versions read from DynamoDB with those seen by this process"""
+        with self._local_lock:
+            local = {
+                message["client_msg_id"]: self._local[message["client_msg_id"]]
+                for message in self.messages if message["client_msg_id"] in self._local
+            }
+        for source in (local, versions):
+            for client_msg_id, version in source.items():
+                self.versions[client_msg_id] = max(version, self.versions.get(client_msg_id, version))
+
+    def superseded(self, message: Dict[str, str]) -> bool:
+        """Check if a message was edited or deleted after the version being answered"""
+        cancelled = self.versions.get(message["client_msg_id"])
+        return cancelled is not None and cancelled > self.version(message)
+
+    def remaining(self) -> List[Dict[str, str]]:
+        """Messages that are still current"""
+        return [message for message in self.messages if not self.superseded(message)]
+
+    def due(self) -> bool:
+        """Check if DynamoDB should be read again, resetting the interval"""
+        now = time.monotonic()
+        if now - self._checked_at < Config.CANCEL_CHECK_INTERVAL:
+            return False
+        self._checked_at = now
+        return True
+
+    def fetch(self) -> Dict[str, Decimal]:
+        """Read the cancel items of all messages"""
+        versions = {}
+        try:
+            for message in self.messages:
+                key = {"id": f"cancel:{message['client_msg_id']}"}
+                item = table.get_item(Key=key).get("Item")
+                if item:
+                    versions[message["client_msg_id"]] = Decimal(item["version"])
+        except Exception as e:
+            print(f"Error reading cancel tokens: {e}")
+        return versions
+
+    def refresh(self) -> List[Dict[str, str]]:
+        """Read all cancellations now and return the messages that are still current"""
+        self.merge_versions(self.fetch())
+        return self.remaining()
+
+    def check(self) -> None:
+        """Raise GenerationCancelled if any message was edited or deleted"""
+        self.merge_versions(self.fetch() if self.due() else {})
+        if len(self.remaining()) < len(self.messages):
+            raise GenerationCancelled()
+
+
 class MessageFormatter:
     """Handles message formatting and splitting for Slack"""
 
@@ -240,12 +1579,169 @@ class MessageFormatter:
         return result
 
 
+class SlackImage:
+    """Images attached to Slack messages, prepared for the Converse image content block
+
+    Files are streamed from Slack with the bot token, then downscaled to at most
+    IMAGE_MAX_EDGE pixels on the long edge and IMAGE_MAX_PIXELS in total, which is
+    as much as the model looks at, and re-encoded: palette PNG for screenshots and
+    other lossless sources when small enough, JPEG otherwise. The encoded images are kept
+    in an in-container LRU by Slack file id, so follow-up questions about the same
+    screenshot skip the download.
+    """
+
+    FORMATS = {"image/png": "png", "image/jpeg": "jpeg", "image/gif": "gif", "image/webp": "webp"}
+    # Converse rejects larger images
+    MAX_BYTES = 3750000
+    # Lossless output above this size is re-encoded as JPEG
+    PNG_MAX_BYTES = 1048576
+    JPEG_QUALITY = 85
+
+    _entries: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def attachments(cls, event: Dict[str, Any]) -> List[Dict[str, str]]:
+        """Return the image files of a message event, up to IMAGE_MAX_COUNT"""
+        files = []
+        for file in event.get("files") or []:
+            url = file.get("url_private_download") or file.get("url_private")
+            if file.get("mimetype") in cls.FORMATS and file.get("id") and url:
+                files.append({"id": file["id"], "mimetype": file["mimetype"], "url": url})
+        return files[:Config.IMAGE_MAX_COUNT]
+
+    @staticmethod
+    def sniff(data: bytes) -> Optional[str]:
+        """Return the image format from the file signature, or None"""
+        if data.startswith(b"\x89PNG\r\n\x1a\n"):
+            return "png"
+        if data.startswith(b"\xff\xd8\xff"):
+            return "jpeg"
+        if data[:6] in (b"GIF87a", b"GIF89a"):
+            return "gif"
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            return "webp"
+        return None
+
+    @staticmethod
+    def target_size(width: int, height: int) -> Tuple[int, int]:
+        """Return the size within IMAGE_MAX_EDGE and IMAGE_MAX_PIXELS, keeping the aspect ratio"""
+        scale = min(
+            1.0,
+            Config.IMAGE_MAX_EDGE / max(width, height, 1),
+            math.sqrt(Config.IMAGE_MAX_PIXELS / max(width * height, 1)),
+        )
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+    @classmethod
+    def encode(cls, data: bytes) -> Optional[Tuple[str, bytes]]:
+        """Downscale and re-encode an image, returning its format and bytes, or None if unusable"""
+        source_format = cls.sniff(data)
+        if Image is None:
+            if source_format and len(data) <= cls.MAX_BYTES:
+                return source_format, data
+            return None
+
+        with Image.open(io.BytesIO(data)) as image:
+            size = cls.target_size(*image.size)
+            if size == image.size and source_format and len(data) <= cls.PNG_MAX_BYTES:
+                return source_format, data
+
+            # JPEG decodes straight at 1/2, 1/4 or 1/8 scale, skipping most of the pixels
+            image.draft("RGB", size)
+            alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+            image = image.convert("RGBA" if alpha else "RGB")
+            if image.size != size:
+                image = image.resize(size, Image.LANCZOS)
+
+        output = io.BytesIO()
+        if source_format != "jpeg":
+            # Screenshots use few colors; a 256 color palette keeps text sharp at a fraction of the size
+            image.quantize(256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE).save(output, "PNG")
+            if output.tell() <= cls.PNG_MAX_BYTES:
+                return "png", output.getvalue()
+            output = io.BytesIO()
+
+        if alpha:
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        image.save(output, "JPEG", quality=cls.JPEG_QUALITY, optimize=True)
+        return "jpeg", output.getvalue()
+
+    @classmethod
+    def get(cls, file_id: str) -> Optional[Tuple[str, bytes]]:
+        """Return a cached encoded image, or None"""
+        with cls._lock:
+            if file_id not in cls._entries:
+                return None
+            cls._entries.move_to_end(file_id)
+            return cls._entries[file_id]
+
+    @classmethod
+    def put(cls, file_id: str, image: Tuple[str, bytes]) -> None:
+        """Cache an encoded image, evicting the least recently used ones"""
+        if Config.IMAGE_CACHE_SIZE <= 0:
+            return
+        with cls._lock:
+            cls._entries[file_id] = image
+            cls._entries.move_to_end(file_id)
+            while len(cls._entries) > Config.IMAGE_CACHE_SIZE:
+                cls._entries.popitem(last=False)
+
+    @staticmethod
+    def check_response(content_type: str) -> None:
+        """Raise if Slack answered with its sign-in page, sent without the files:read scope"""
+        if content_type.startswith("text/html"):
+            raise ValueError("Slack returned a web page instead of the file, check the files:read scope")
+
+    @classmethod
+    def download(cls, file: Dict[str, str]) -> bytes:
+        """Stream a file from Slack, stopping at IMAGE_DOWNLOAD_LIMIT bytes"""
+        headers = {"Authorization": f"Bearer {slack_client().token}"}
+        with requests.get(file["url"], headers=headers, stream=True, timeout=10) as response:
+            response.raise_for_status()
+            cls.check_response(response.headers.get("Content-Type", ""))
+            data = bytearray()
+            for chunk in response.iter_content(chunk_size=65536):
+                data += chunk
+                if len(data) > Config.IMAGE_DOWNLOAD_LIMIT:
+                    raise ValueError(f"Image larger than {Config.IMAGE_DOWNLOAD_LIMIT} bytes")
+            return bytes(data)
+
+    @classmethod
+    def load(cls, files: List[Dict[str, str]]) -> List[Tuple[str, bytes]]:
+        """Return the encoded images of the files, from the cache or downloaded"""
+        images = []
+        for file in files:
+            image = cls.get(file["id"])
+            if image is None:
+                try:
+                    image = cls.encode(cls.download(file))
+                except Exception as e:
+                    print(f"Error loading image {file['id']}: {e}")
+                    continue
+                if image is None:
+                    print(f"Skipping image {file['id']}: unsupported or too large")
+                    continue
+                cls.put(file["id"], image)
+            images.append(image)
+        return images
+
+
 class SlackManager:
     """Handles Slack messaging operations"""
 
     # Cache for user display names to avoid repeated API calls
     _user_name_cache: Dict[str, str] = {}
 
+    @staticmethod
+    def display_name(user_info: Dict[str, Any], user_id: str) -> str:
+        """Pick the display name from a users.info user object"""
+        profile = user_info.get("profile", {})
+        # Prefer display_name, fall back to real_name, then user_id
+        return profile.get("display_name") or profile.get("real_name") or user_id
+
     @classmethod
     def get_user_display_name(cls, user_id: str) -> str:
         """Get user display name from Slack API with caching"""
@@ -253,16 +1749,9 @@ class SlackManager:
             return cls._user_name_cache[user_id]
 
         try:
-            response = app.client.users_info(user=user_id)
+            response = slack_client().users_info(user=user_id)
             if response.get("ok"):
-                user_info = response.get("user", {})
-                profile = user_info.get("profile", {})
-                # Prefer display_name, fall back to real_name, then user_id
-                display_name = (
-                    profile.get("display_name")
-                    or profile.get("real_name")
-                    or user_id
-                )
+                display_name = cls.display_name(response.get("user", {}), user_id)
                 cls._user_name_cache[user_id] = display_name
                 return display_name
         except Exception as e:
@@ -280,7 +1769,7 @@ class SlackManager:
             for i, text in enumerate(split_messages):
                 if i == 0:
                     # Update the initial message
-                    app.client.chat_update(channel=channel, ts=latest_ts, text=text)
+                    slack_client().chat_update(channel=channel, ts=latest_ts, text=text)
                 else:
                     # Add delay if configured
                     if Config.SLACK_SAY_INTERVAL > 0:
@@ -290,70 +1779,280 @@ class SlackManager:
                     result = say(text=text, thread_ts=thread_ts)
                     latest_ts = result["ts"]
 
-            return message, latest_ts
-        except Exception as e:
-            print(f"Error updating message: {e}")
-            # Update with error message
-            app.client.chat_update(channel=channel, ts=latest_ts, text=MSG_ERROR)
-            return MSG_ERROR, latest_ts
+            return message, latest_ts
+        except Exception as e:
+            print(f"Error updating message: {e}")
+            # Update with error message
+            slack_client().chat_update(channel=channel, ts=latest_ts, text=MSG_ERROR)
+            return MSG_ERROR, latest_ts
+
+    @staticmethod
+    def format_thread_history(messages: List[Dict[str, Any]], exclude_ids: Collection[str]) -> List[str]:
+        """Format thread messages as prompt history lines, newest kept within MAX_LEN_BEDROCK
+
+        Messages whose id (ThreadLease.message_id) is in exclude_ids are the ones being answered
+        and are skipped.
+        """
+        contexts = []
+
+        # Slack API returns messages in chronological order (oldest first)
+        # Include all messages (including thread parent)
+        # Process from newest to oldest to prioritize recent context
+        thread_messages = messages.copy()
+        thread_messages.reverse()  # Now newest first
+
+        for message in thread_messages:
+            # Skip the current messages being processed
+            if ThreadLease.message_id(message) in exclude_ids:
+                continue
+
+            # Determine role and author (Slack mention format for users)
+            if message.get("bot_id"):
+                role = "assistant"
+                author = "assistant"
+            else:
+                role = "user"
+                user_id = message.get("user", "")
+                author = f"<@{user_id}>" if user_id else "unknown"
+
+            contexts.append(f"{role}({author}): {message.get('text', '')}")
+
+            # Check if we've reached the context length limit
+            context_text = "\n".join(contexts)
+            if len(context_text) > Config.MAX_LEN_BEDROCK:
+                contexts.pop(0)  # Remove oldest (first added) message
+                break
+
+        # Reverse back to chronological order for the prompt
+        contexts.reverse()
+
+        return contexts
+
+    @classmethod
+    def get_thread_history(cls, channel: str, thread_ts: str, exclude_ids: Collection[str]) -> List[str]:
+        """Retrieve conversation history from a Slack thread"""
+        contexts = []
+
+        try:
+            response = slack_client().conversations_replies(channel=channel, ts=thread_ts)
+
+            if not response.get("ok"):
+                print("Failed to retrieve thread messages")
+                return contexts
+
+            contexts = cls.format_thread_history(response.get("messages", []), exclude_ids)
+
+        except Exception as e:
+            print(f"Error retrieving thread history: {e}")
+
+        return contexts
+
+
+class StatusUpdater:
+    """Posts the cursor and status updates of a conversation on a dedicated serial lane
+
+    Slack writes for one conversation must stay ordered (cursor, status, answer), but
+    nothing else has to wait for them. Updates are queued on a single worker thread,
+    and status updates that are still queued when the final answer arrives are skipped.
+    """
+
+    def __init__(self, say: Say, channel: Optional[str], thread_ts: Optional[str],
+                 trace: StageTrace):
+        self.say = say
+        self.channel = channel
+        self.thread_ts = thread_ts
+        self.trace = trace
+        self.latest_ts: Optional[str] = None
+        self._final = False
+        self._lane = ContextThreadPoolExecutor(max_workers=1)
+
+    def post(self, text: str) -> Future:
+        """Post the initial status message"""
+        return self._lane.submit(self.trace.run, "post_cursor", self._post, text)
+
+    def update(self, text: str, stage: str = "status") -> Future:
+        """Queue a status update, skipped if the final answer is already queued"""
+        return self._lane.submit(self.trace.run, stage, self._update, text, False)
+
+    def finish(self, text: str) -> Future:
+        """Queue the final answer"""
+        self._final = True
+        return self._lane.submit(self.trace.run, "final_update", self._update, text, True)
+
+    def discard(self) -> Future:
+        """Queue removal of the status message of a cancelled conversation"""
+        self._final = True
+        return self._lane.submit(self.trace.run, "discard", self._delete)
+
+    def close(self) -> None:
+        """Wait for all queued Slack writes to complete"""
+        self._lane.shutdown(wait=True)
+
+    def _post(self, text: str) -> None:
+        try:
+            result = self.say(text=text, thread_ts=self.thread_ts)
+            self.latest_ts = result["ts"]
+        except Exception as e:
+            print(f"Error posting status message: {e}")
+
+    def _update(self, text: str, final: bool) -> None:
+        if not self.latest_ts or (self._final and not final):
+            return
+        _, self.latest_ts = SlackManager.update_message(
+            self.say, self.channel, self.thread_ts, self.latest_ts, text
+        )
+
+    def _delete(self) -> None:
+        if not self.latest_ts:
+            return
+        try:
+            slack_client().chat_delete(channel=self.channel, ts=self.latest_ts)
+        except Exception as e:
+            print(f"Error deleting status message: {e}")
+
+
+class BedrockManager:
+    """Handles Amazon Bedrock operations"""
+
+    # Token usage fields of Converse, as stored in conversation records
+    USAGE_FIELDS = {
+        "inputTokens": "input",
+        "outputTokens": "output",
+        "cacheReadInputTokens": "cache_read",
+        "cacheWriteInputTokens": "cache_write",
+    }
 
-    @classmethod
-    def get_thread_history(cls, channel: str, thread_ts: str, client_msg_id: str) -> List[str]:
-        """Retrieve conversation history from a Slack thread"""
-        contexts = []
+    CACHE_POINT = {"cachePoint": {"type": "default"}}
 
-        try:
-            response = app.client.conversations_replies(channel=channel, ts=thread_ts)
+    # Tags of the inference profiles the bot creates, for cost allocation
+    INFERENCE_PROFILE_TAGS = [{"key": "Name", "value": "gurumi-ai-bot"}]
 
-            if not response.get("ok"):
-                print("Failed to retrieve thread messages")
-                return contexts
+    @staticmethod
+    def cached_profile(model_id: str) -> Optional[str]:
+        """Return the model id or inference profile ARN to call without any lookup, or None"""
+        if Config.INFERENCE_PROFILE_NAME == "None":
+            return model_id
+        return inference_profiles.cached(
+            model_id, Config.INFERENCE_PROFILE_NAME, Config.INFERENCE_PROFILE_CROSS_REGION == "Yes"
+        )
 
-            messages = response.get("messages", [])
+    @staticmethod
+    def inference_profile(model_id: str) -> str:
+        """Return the model id or inference profile ARN to call, creating the profile if missing"""
+        return BedrockManager.cached_profile(model_id) or inference_profiles.resolve(
+            model_id,
+            Config.INFERENCE_PROFILE_NAME,
+            BedrockManager.INFERENCE_PROFILE_TAGS,
+            Config.INFERENCE_PROFILE_CROSS_REGION == "Yes",
+        )
 
-            # Slack API returns messages in chronological order (oldest first)
-            # Include all messages (including thread parent)
-            # Process from newest to oldest to prioritize recent context
-            thread_messages = messages.copy()
-            thread_messages.reverse()  # Now newest first
+    @staticmethod
+    def retrieve_params(query: str, knowledge_base_id: str) -> Dict[str, Any]:
+        """Build the Knowledge Base Retrieve request parameters"""
+        return {
+            "retrievalQuery": {"text": query},
+            "knowledgeBaseId": knowledge_base_id,
+            "retrievalConfiguration": {
+                "vectorSearchConfiguration": {
+                    "numberOfResults": Config.KB_RETRIEVE_COUNT,
+                }
+            },
+        }
 
-            for message in thread_messages:
-                # Skip the current message being processed
-                if message.get("client_msg_id") == client_msg_id:
-                    continue
+    @staticmethod
+    def knowledge_passages(response: Dict[str, Any]) -> List[Tuple[str, float]]:
+        """Extract (passage, score) pairs from a Knowledge Base Retrieve response"""
+        return [
+            (result["content"]["text"], float(result.get("score", 0.0)))
+            for result in response.get("retrievalResults", [])
+        ]
 
-                # Determine role and author (Slack mention format for users)
-                if message.get("bot_id"):
-                    role = "assistant"
-                    author = "assistant"
-                else:
-                    role = "user"
-                    user_id = message.get("user", "")
-                    author = f"<@{user_id}>" if user_id else "unknown"
+    @staticmethod
+    def retrieval_requests(query: str, channel: Optional[str] = None) -> List[Tuple[str, str]]:
+        """List the (Knowledge Base, query variant) pairs to retrieve for a question"""
+        variants = QueryExpander.variants(query)
+        return [(kb_id, variant) for kb_id in Config.knowledge_base_ids(channel) for variant in variants]
 
-                contexts.append(f"{role}({author}): {message.get('text', '')}")
+    @staticmethod
+    def fuse_rankings(requests: List[Tuple[str, str]],
+                      rankings: Dict[Tuple[str, str], List[Tuple[str, float]]]) -> List[Tuple[str, float]]:
+        """Merge the rankings that arrived, in request order, by reciprocal rank
+
+        Each passage keeps its best retrieval score rather than the fused one, which
+        is nearly flat and would defeat the score cutoff of ContextPacker.
+        """
+        arrived = [rankings[request] for request in requests if request in rankings]
+        if len(arrived) < len(requests):
+            print(f"Knowledge Base retrieval deadline passed: {len(requests) - len(arrived)} "
+                  f"of {len(requests)} calls dropped")
+        best: Dict[str, float] = {}
+        for ranking in arrived:
+            for passage, score in ranking:
+                best[passage] = max(best.get(passage, score), score)
+        fused = reciprocal_rank_fusion(arrived, Config.KB_RETRIEVE_COUNT)
+        return [(passage, best[passage]) for passage, _ in fused]
 
-                # Check if we've reached the context length limit
-                context_text = "\n".join(contexts)
-                if len(context_text) > Config.MAX_LEN_BEDROCK:
-                    contexts.pop(0)  # Remove oldest (first added) message
-                    break
+    @classmethod
+    def invoke_knowledge_base(cls, query: str, channel: Optional[str] = None) -> List[str]:
+        """Retrieve relevant passages from the lexical index and the Bedrock Knowledge Bases
+
+        The in-process index answers alone when its best passage covers enough of the
+        query (LEXICAL_MODE=first) or when no Knowledge Base is configured; otherwise
+        the Knowledge Bases are queried and used instead of, or fused with, the index.
+        The candidates are then reranked and packed into the context budget.
+        """
+        candidates, coverage = LexicalIndex.lookup(query)
+        if not LexicalIndex.is_sufficient(candidates, coverage, Config.knowledge_base_ids(channel)):
+            candidates = LexicalIndex.merge(candidates, cls.retrieve_knowledge_bases(query, channel))
+        return ContextPacker.pack(query, candidates)
 
-            # Reverse back to chronological order for the prompt
-            contexts.reverse()
+    @classmethod
+    def retrieve_knowledge_bases(cls, query: str, channel: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Retrieve every query variant from every Knowledge Base of the channel at once
+
+        The calls run in parallel under one KB_RETRIEVE_TIMEOUT deadline, so retrieval
+        takes as long as the slowest call; calls still running at the deadline are
+        left out of the reciprocal rank fusion.
+        """
+        requests = cls.retrieval_requests(query, channel)
+        if not requests:
+            return []
 
-        except Exception as e:
-            print(f"Error retrieving thread history: {e}")
+        RetrievalCache.refresh_versions([kb_id for kb_id, _ in requests])
+        rankings, futures = {}, {}
+        for kb_id, variant in requests:
+            passages = RetrievalCache.get(variant, kb_id)
+            if passages is not None:
+                rankings[(kb_id, variant)] = passages
+            else:
+                future = retrieval_executor.submit(cls.retrieve_knowledge_base, variant, kb_id)
+                futures[future] = (kb_id, variant)
 
-        return contexts
+        done, _ = wait(futures, timeout=Config.KB_RETRIEVE_TIMEOUT)
+        for future in done:
+            rankings[futures[future]] = future.result()
+        return cls.fuse_rankings(requests, rankings)
 
+    @staticmethod
+    def retrieve_knowledge_base(query: str, knowledge_base_id: str) -> List[Tuple[str, float]]:
+        """Retrieve relevant passages from one Bedrock Knowledge Base"""
+        try:
+            response = bedrock_agent_client.retrieve(**BedrockManager.retrieve_params(query, knowledge_base_id))
+            passages = BedrockManager.knowledge_passages(response)
+        except Exception as e:
+            print(f"Error retrieving from knowledge base {knowledge_base_id}: {e}")
+            return []
 
-class BedrockManager:
-    """Handles Amazon Bedrock operations"""
+        RetrievalCache.put(query, passages, knowledge_base_id)
+        return passages
 
     @staticmethod
-    def invoke_agent(prompt: str) -> str:
-        """Invoke Amazon Bedrock Agent with prompt and return response"""
+    def invoke_agent(prompt: str, cancel: Optional[CancelToken] = None) -> str:
+        """Invoke Amazon Bedrock Agent with prompt and return response
+
+        With a cancel token, the stream is checked between chunks and closed
+        with GenerationCancelled once the question is edited or deleted.
+        """
         try:
             # Create a unique session ID
             now = datetime.now()
@@ -369,52 +2068,161 @@ class BedrockManager:
 
             # Process streaming response
             completion = ""
-            for event in response.get("completion"):
-                chunk = event["chunk"]
-                completion += chunk["bytes"].decode()
+            stream = response.get("completion")
+            try:
+                for event in stream:
+                    if cancel:
+                        cancel.check()
+                    chunk = event["chunk"]
+                    completion += chunk["bytes"].decode()
+            except GenerationCancelled:
+                stream.close()
+                raise
 
             return completion
 
+        except GenerationCancelled:
+            raise
         except Exception as e:
             print(f"Error invoking Bedrock Agent: {e}")
-            return f"죄송합니다. 응답을 생성하는 중 오류가 발생했습니다. 잠시 후 다시 시도해주세요. (오류: {type(e).__name__})"
+            return MSG_GENERATE_ERROR.format(type(e).__name__)
 
     @staticmethod
-    def create_prompt(say: Optional[Say], query: str, thread_ts: Optional[str] = None,
-                    channel: Optional[str] = None, client_msg_id: Optional[str] = None,
-                    latest_ts: Optional[str] = None, user_id: Optional[str] = None) -> str:
-        """Create a prompt for the AI model with context and query"""
-        prompts = []
-        prompts.append(f"User: {Config.PERSONAL_MESSAGE}")
+    def converse(request: Dict[str, Any], cancel: Optional[CancelToken] = None) -> Tuple[str, Dict[str, int]]:
+        """Generate an answer with ConverseStream and return it with the token usage
+
+        The request's model is called through its inference profile from
+        inference_profiles. With a cancel token, the stream is checked
+        between events and closed with GenerationCancelled once the question
+        is edited or deleted.
+        """
+        try:
+            model_id = request["modelId"]
+            arn = BedrockManager.inference_profile(model_id)
+            try:
+                response = bedrock_runtime_client.converse_stream(**dict(request, modelId=arn))
+            except Exception as e:
+                if arn == model_id or not inference_profiles.is_stale(e):
+                    raise
+                # The stored profile was deleted, resolve it again and retry once
+                inference_profiles.invalidate(arn)
+                response = bedrock_runtime_client.converse_stream(
+                    **dict(request, modelId=BedrockManager.inference_profile(model_id))
+                )
+
+            # Process streaming response, the usage arrives in the last event
+            completion = ""
+            usage: Dict[str, int] = {}
+            stream = response.get("stream")
+            try:
+                for event in stream:
+                    if cancel:
+                        cancel.check()
+                    if "contentBlockDelta" in event:
+                        completion += event["contentBlockDelta"]["delta"].get("text", "")
+                    elif "metadata" in event:
+                        usage = BedrockManager.token_usage(event["metadata"].get("usage", {}))
+            except GenerationCancelled:
+                stream.close()
+                raise
+
+            print(f"converse: usage: {usage}")
+            return completion, usage
+
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            print(f"Error invoking Bedrock Converse: {e}")
+            return MSG_GENERATE_ERROR.format(type(e).__name__), {}
+
+    @classmethod
+    def generate(cls, query: str, prompt: str, cancel: Optional[CancelToken] = None,
+                 images: Optional[List[Tuple[str, bytes]]] = None,
+                 **inputs: Any) -> Tuple[str, Dict[str, int]]:
+        """Answer with ConverseStream when MODEL_ID is set, otherwise with the Bedrock Agent
+
+        inputs are the create_prompt keyword arguments, which Converse sends as
+        separate cacheable segments instead of the single prompt string. images
+        are only sent on the Converse path.
+        """
+        if Config.MODEL_ID == "None":
+            return cls.invoke_agent(prompt, cancel), {}
+        return cls.converse(cls.converse_request(query, images=images, **inputs), cancel)
+
+    @classmethod
+    def token_usage(cls, usage: Dict[str, Any]) -> Dict[str, int]:
+        """Rename the Converse usage fields, leaving out the ones not reported"""
+        return {name: int(usage[field]) for field, name in cls.USAGE_FIELDS.items() if field in usage}
+
+    @staticmethod
+    def system_prompt() -> str:
+        """Return the instructions, identical for every request so they can be cached"""
+        prompts = [Config.PERSONAL_MESSAGE]
 
         if Config.SYSTEM_MESSAGE != "None":
             prompts.append(Config.SYSTEM_MESSAGE)
 
         prompts.append("<question> 태그로 감싸진 질문에 답변을 제공하세요.")
+        prompts.append("<history> 에 정보가 제공 되면, 대화 기록을 참고하여 답변해 주세요.")
+        prompts.append("<context> 에 정보가 제공 되면, 해당 정보를 사용하여 답변해 주세요.")
 
-        try:
-            # Add conversation history if in a thread
-            if thread_ts and say and channel and client_msg_id and latest_ts:
-                # Update status message
-                SlackManager.update_message(say, channel, thread_ts, latest_ts, MSG_PREVIOUS)
+        return "\n".join(prompts)
+
+    @staticmethod
+    def stable_history_size(contexts: List[str]) -> int:
+        """Return how many leading history lines the previous answer in the thread also had
+
+        The newest exchange, the last questions and the answer to them, was added
+        since then. The lines before it are a prefix shared with the previous turn.
+        """
+        size = len(contexts)
+        while size and contexts[size - 1].startswith("assistant("):
+            size -= 1
+        while size and not contexts[size - 1].startswith("assistant("):
+            size -= 1
+        return size
 
-                # Get thread history
-                contexts = SlackManager.get_thread_history(channel, thread_ts, client_msg_id)
+    @staticmethod
+    def question_prompt(query: str, knowledge: Optional[List[str]] = None,
+                        user_id: Optional[str] = None, user_name: Optional[str] = None) -> str:
+        """Format the retrieved passages and the question, the part that changes every turn"""
+        prompts = []
 
-                if contexts:
-                    prompts.append("<history> 에 정보가 제공 되면, 대화 기록을 참고하여 답변해 주세요.")
-                    prompts.append("<history>")
-                    prompts.append("\n\n".join(contexts))
-                    prompts.append("</history>")
+        # Add knowledge base passages if retrieved
+        if knowledge:
+            prompts.append("<context>")
+            prompts.append("\n\n".join(knowledge))
+            prompts.append("</context>")
+
+        # Add the current query with user_id (Slack mention format)
+        prompts.append("")
+        if user_id and user_name and user_name != user_id:
+            prompts.append(f"<question user=\"<@{user_id}>\" name=\"{user_name}\">")
+        elif user_id:
+            prompts.append(f"<question user=\"<@{user_id}>\">")
+        else:
+            prompts.append("<question>")
+        prompts.append(query)
+        prompts.append("</question>")
+
+        return "\n".join(prompts)
 
-            # Add the current query with user_id (Slack mention format)
-            prompts.append("")
-            if user_id:
-                prompts.append(f"<question user=\"<@{user_id}>\">")
-            else:
-                prompts.append("<question>")
-            prompts.append(query)
-            prompts.append("</question>")
+    @classmethod
+    def create_prompt(cls, query: str, contexts: Optional[List[str]] = None,
+                      knowledge: Optional[List[str]] = None, user_id: Optional[str] = None,
+                      user_name: Optional[str] = None) -> str:
+        """Create a prompt for the AI model from the gathered history, knowledge and query"""
+        prompts = []
+        prompts.append(f"User: {cls.system_prompt()}")
+
+        try:
+            # Add conversation history if in a thread
+            if contexts:
+                prompts.append("<history>")
+                prompts.append("\n\n".join(contexts))
+                prompts.append("</history>")
+
+            prompts.append(cls.question_prompt(query, knowledge, user_id, user_name))
             prompts.append("")
 
             prompts.append("Assistant:")
@@ -425,40 +2233,380 @@ class BedrockManager:
             print(f"Error creating prompt: {e}")
             raise e
 
+    @classmethod
+    def converse_request(cls, query: str, contexts: Optional[List[str]] = None,
+                         knowledge: Optional[List[str]] = None, user_id: Optional[str] = None,
+                         user_name: Optional[str] = None,
+                         images: Optional[List[Tuple[str, bytes]]] = None) -> Dict[str, Any]:
+        """Build the ConverseStream parameters with prompt cache checkpoints
+
+        The static system block comes first, then the thread history with one
+        content block per message, then the images, passages and question. Checkpoints
+        follow the system block, the history the previous turn already had (read
+        back from the cache) and the whole history (written for the next turn).
+        Prefixes shorter than PROMPT_CACHE_MIN_TOKENS are not cached by Bedrock and
+        get no checkpoint.
+        """
+        caching = Config.PROMPT_CACHE == "Yes"
+
+        system_text = cls.system_prompt()
+        system: List[Dict[str, Any]] = [{"text": system_text}]
+        prefix_tokens = estimate_tokens(system_text)
+        if caching and prefix_tokens >= Config.PROMPT_CACHE_MIN_TOKENS:
+            system.append(cls.CACHE_POINT)
+
+        content: List[Dict[str, Any]] = []
+        if contexts:
+            stable = cls.stable_history_size(contexts)
+            content.append({"text": "<history>"})
+            for size, line in enumerate(contexts, 1):
+                content.append({"text": line})
+                prefix_tokens += estimate_tokens(line)
+                if caching and size in (stable, len(contexts)) and prefix_tokens >= Config.PROMPT_CACHE_MIN_TOKENS:
+                    content.append(cls.CACHE_POINT)
+            content.append({"text": "</history>"})
+        for image_format, data in images or []:
+            content.append({"image": {"format": image_format, "source": {"bytes": data}}})
+        content.append({"text": cls.question_prompt(query, knowledge, user_id, user_name)})
+
+        return {
+            "modelId": Config.MODEL_ID,
+            "system": system,
+            "messages": [{"role": "user", "content": content}],
+            "inferenceConfig": {"maxTokens": Config.MODEL_MAX_TOKENS},
+        }
+
+
+class ImageJobError(Exception):
+    """Raised with the reply to send when an image command cannot be run"""
+
+
+class ImageJob:
+    """Image generation command, run as a background job
+
+    `!image 바다 위의 고래 --seed 7 --style anime` is acknowledged with a status
+    message right away; the generation itself runs in IMAGE_FUNCTION_NAME through
+    an asynchronous invoke, so the Slack event never waits for the model. The PNG
+    the model returns is uploaded to Slack as it is, and kept in IMAGE_BUCKET_NAME
+    under a key of the model, prompt, seed and style, so a repeated request is
+    answered from S3.
+    """
+
+    KEY_PREFIX = "generated-images/"
+    OPTION_PATTERN = re.compile(r"(?:^|\s)--(seed|style)(?:=|\s+)(\S+)")
+    MAX_SEED = 4294967295
+    CFG_SCALE = 10
+    STEPS = 30
+
+    # Style presets of Stable Diffusion XL, "none" sends the prompt without one
+    STYLES = frozenset({
+        "3d-model", "analog-film", "anime", "cinematic", "comic-book", "digital-art",
+        "enhance", "fantasy-art", "isometric", "line-art", "low-poly", "modeling-compound",
+        "neon-punk", "origami", "photographic", "pixel-art", "tile-texture", "none",
+    })
+
+    @staticmethod
+    def is_command(text: str) -> bool:
+        """Return True if the text is an image generation command"""
+        command = Config.IMAGE_COMMAND
+        return command != "None" and (text == command or text.startswith(command + " "))
+
+    @classmethod
+    def parse(cls, text: str) -> Dict[str, Any]:
+        """Split a command into prompt, seed and style; raises ImageJobError with the reply to send
+
+        Without --seed the seed is derived from the prompt, so the same request
+        draws, and is cached as, the same image.
+        """
+        text = text[len(Config.IMAGE_COMMAND):]
+        options = {name: value for name, value in cls.OPTION_PATTERN.findall(text)}
+        prompt = " ".join(cls.OPTION_PATTERN.sub(" ", text).split())
+        if not prompt:
+            raise ImageJobError(MSG_IMAGE_USAGE)
+
+        style = options.get("style", Config.IMAGE_STYLE).lower()
+        if style not in cls.STYLES:
+            raise ImageJobError(MSG_IMAGE_STYLE.format(style, ", ".join(f"`{s}`" for s in sorted(cls.STYLES))))
+
+        seed = options.get("seed", "")
+        if not seed.isdigit() or int(seed) > cls.MAX_SEED:
+            seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+
+        return {"prompt": prompt, "seed": int(seed), "style": style}
+
+    @staticmethod
+    def cache_key(job: Dict[str, Any]) -> str:
+        """Return the S3 key of a generated image"""
+        params = [Config.IMAGE_MODEL_ID, job["prompt"], job["seed"], job["style"], ImageJob.CFG_SCALE, ImageJob.STEPS]
+        digest = hashlib.sha256(json.dumps(params, ensure_ascii=False).encode("utf-8")).hexdigest()
+        return f"{ImageJob.KEY_PREFIX}{digest}.png"
+
+    @classmethod
+    def model_request(cls, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the InvokeModel parameters for Stable Diffusion XL"""
+        body = {
+            "text_prompts": [{"text": job["prompt"]}],
+            "seed": job["seed"],
+            "cfg_scale": cls.CFG_SCALE,
+            "steps": cls.STEPS,
+            "samples": 1,
+        }
+        if job["style"] != "none":
+            body["style_preset"] = job["style"]
+        return {
+            "modelId": Config.IMAGE_MODEL_ID,
+            "contentType": "application/json",
+            "accept": "application/json",
+            "body": json.dumps(body),
+        }
+
+    @staticmethod
+    def image_bytes(body: Dict[str, Any]) -> bytes:
+        """Return the PNG bytes of a model response, never decoding the image itself"""
+        artifact = body["artifacts"][0]
+        if artifact.get("finishReason") == "CONTENT_FILTERED":
+            raise ImageJobError(MSG_IMAGE_FILTERED)
+        return base64.b64decode(artifact["base64"])
+
+    @staticmethod
+    def upload_params(job: Dict[str, Any], data: bytes) -> Dict[str, Any]:
+        """Build the files_upload_v2 parameters for a generated image"""
+        return {
+            "channel": job["channel"],
+            "thread_ts": job.get("thread_ts"),
+            "content": data,
+            "filename": f"image-{job['seed']}.png",
+            "title": job["prompt"][:200],
+            "initial_comment": MSG_IMAGE_DONE.format(job["user"], job["seed"], job["style"]),
+        }
+
+    @classmethod
+    def start(cls, say: Say, text: str, channel: str, thread_ts: Optional[str], user_id: str) -> None:
+        """Answer a command with a status message and hand the generation to the image function"""
+        try:
+            job = cls.parse(text)
+        except ImageJobError as e:
+            say(text=str(e), thread_ts=thread_ts)
+            return
+
+        result = say(text=MSG_IMAGE, thread_ts=thread_ts)
+        team = TeamRegistry.current()
+        job.update(
+            channel=channel, thread_ts=thread_ts, user=user_id, status_ts=result["ts"],
+            enterprise_id=team.enterprise_id, team_id=team.team_id,
+            is_enterprise_install=team.is_enterprise_install,
+        )
+        print(f"ImageJob: {job}")
+
+        if Config.IMAGE_FUNCTION_NAME == "None":
+            cls.run(job)
+            return
+
+        try:
+            lambda_client.invoke(
+                FunctionName=Config.IMAGE_FUNCTION_NAME,
+                InvocationType="Event",
+                Payload=json.dumps(job).encode("utf-8"),
+            )
+        except Exception as e:
+            print(f"Error starting image job: {e}")
+            slack_client().chat_update(channel=channel, ts=job["status_ts"], text=MSG_ERROR)
+
+    @staticmethod
+    def cached(key: str) -> Optional[bytes]:
+        """Return a previously generated image from S3, or None"""
+        if Config.IMAGE_BUCKET_NAME == "None":
+            return None
+        try:
+            return s3_client.get_object(Bucket=Config.IMAGE_BUCKET_NAME, Key=key)["Body"].read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                print(f"Error reading cached image {key}: {e}")
+            return None
+
+    @staticmethod
+    def store(key: str, data: bytes, job: Dict[str, Any]) -> None:
+        """Keep a generated image in S3"""
+        if Config.IMAGE_BUCKET_NAME == "None":
+            return
+        try:
+            s3_client.put_object(
+                Bucket=Config.IMAGE_BUCKET_NAME, Key=key, Body=data, ContentType="image/png",
+                Metadata={"seed": str(job["seed"]), "style": job["style"]},
+            )
+        except Exception as e:
+            print(f"Error caching image {key}: {e}")
+
+    @classmethod
+    def invoke_model(cls, job: Dict[str, Any]) -> bytes:
+        """Generate an image with IMAGE_MODEL_ID"""
+        response = bedrock_runtime_client.invoke_model(**cls.model_request(job))
+        return cls.image_bytes(json.loads(response["body"].read()))
+
+    @classmethod
+    def run(cls, job: Dict[str, Any]) -> bool:
+        """Generate or fetch the image, upload it to the thread and remove the status message"""
+        trace = StageTrace("image_job")
+        store_future = None
+        try:
+            key = cls.cache_key(job)
+            data = trace.run("cache", cls.cached, key)
+            if data is None:
+                data = trace.run("generate", cls.invoke_model, job)
+                # Stored while the image is uploaded
+                store_future = pipeline_executor.submit(trace.run, "store", cls.store, key, data, job)
+            trace.run("upload", slack_client().files_upload_v2, **cls.upload_params(job, data))
+            slack_client().chat_delete(channel=job["channel"], ts=job["status_ts"])
+            return True
+
+        except Exception as e:
+            print(f"Error in image job: {e}")
+            text = str(e) if isinstance(e, ImageJobError) else MSG_ERROR
+            try:
+                slack_client().chat_update(channel=job["channel"], ts=job["status_ts"], text=text)
+            except Exception as update_error:
+                print(f"Error updating image status: {update_error}")
+            return False
+
+        finally:
+            if store_future:
+                store_future.result()
+            print(trace.report())
+
 
 def conversation(say: Say, query: str, thread_ts: Optional[str] = None,
                channel: Optional[str] = None, client_msg_id: Optional[str] = None,
-               user_id: Optional[str] = None) -> None:
-    """Main conversation handler that processes queries and returns AI responses"""
+               user_id: Optional[str] = None, exclude_ids: Optional[List[str]] = None,
+               cancel: Optional[CancelToken] = None,
+               files: Optional[List[Dict[str, str]]] = None) -> bool:
+    """Main conversation handler that processes queries and returns AI responses
+
+    Status posting, history fetching, user resolution, knowledge base retrieval and
+    image downloads run concurrently; generation starts as soon as the prompt inputs
+    are ready and never waits on Slack status writes. exclude_ids lists the
+    client_msg_ids merged into the query, which are left out of the thread history.
+    files are the attached images, only sent to the model on the Converse path.
+    Returns False if the cancel token fired, in which case the status message is
+    removed and nothing is recorded.
+    """
     print(f"conversation: query: {query}, user_id: {user_id}")
 
+    trace = StageTrace("conversation")
+    status = StatusUpdater(say, channel, thread_ts, trace)
+    record_future = None
+    answered = True
+
     try:
         # Send initial status message
-        result = say(text=Config.BOT_CURSOR, thread_ts=thread_ts)
-        latest_ts = result["ts"]
+        status.post(Config.BOT_CURSOR)
+
+        # Start the independent I/O stages
+        history_future = None
+        if thread_ts and channel and client_msg_id:
+            status.update(MSG_PREVIOUS, "status_previous")
+            history_future = pipeline_executor.submit(
+                trace.run, "history", SlackManager.get_thread_history, channel, thread_ts,
+                exclude_ids or [client_msg_id]
+            )
+
+        user_future = None
+        if user_id:
+            user_future = pipeline_executor.submit(
+                trace.run, "user", SlackManager.get_user_display_name, user_id
+            )
+
+        knowledge_future = None
+        if Config.has_retrieval():
+            knowledge_future = pipeline_executor.submit(
+                trace.run, "retrieve", BedrockManager.invoke_knowledge_base, query, channel
+            )
+
+        images_future = None
+        if files and Config.MODEL_ID != "None":
+            images_future = pipeline_executor.submit(trace.run, "images", SlackImage.load, files)
+        elif files:
+            print("conversation: images are only answered with MODEL_ID (Converse), ignoring them")
 
         # Create prompt with context and query
-        prompt = BedrockManager.create_prompt(
-            say, query, thread_ts, channel, client_msg_id, latest_ts, user_id
-        )
+        inputs = {
+            "contexts": history_future.result() if history_future else None,
+            "knowledge": knowledge_future.result() if knowledge_future else None,
+            "user_id": user_id,
+            "user_name": user_future.result() if user_future else None,
+        }
+        prompt = BedrockManager.create_prompt(query, **inputs)
 
         # Update status while waiting for response
-        SlackManager.update_message(say, channel, thread_ts, latest_ts, MSG_RESPONSE)
+        status.update(MSG_RESPONSE, "status_response")
 
         # Get response from AI
-        message = BedrockManager.invoke_agent(prompt)
+        images = images_future.result() if images_future else None
+        message, usage = trace.run(
+            "generate", BedrockManager.generate, query, prompt, cancel, images, **inputs
+        )
 
         # Send final response
-        SlackManager.update_message(say, channel, thread_ts, latest_ts, message)
+        status.finish(message)
+
+        # Store the complete turn while the final response is posted
+        record_id = client_msg_id or f"{channel}:{int(time.time() * 1000)}"
+        record_future = pipeline_executor.submit(
+            trace.run, "record", ConversationRecord.put, record_id, query, message, prompt,
+            trace.elapsed_ms(), channel, thread_ts, user_id, usage
+        )
+
+    except GenerationCancelled:
+        print("conversation: cancelled, the question was edited or deleted")
+        status.discard()
+        answered = False
 
     except Exception as e:
         print(f"Error in conversation handler: {e}")
         # Update with error message if possible
-        try:
-            if latest_ts:
-                SlackManager.update_message(say, channel, thread_ts, latest_ts, MSG_ERROR)
-        except Exception:
-            pass
+        status.finish(MSG_ERROR)
+
+    finally:
+        status.close()
+        if record_future:
+            record_future.result()
+        print(trace.report())
+
+    return answered
+
+
+def coalesced_conversation(say: Say, lease_key: str, message: Dict[str, str],
+                           thread_ts: Optional[str], channel: str) -> None:
+    """Answer a message, merging in messages that arrive while it is pending"""
+    if not ThreadLease.acquire(lease_key, message):
+        print(f"coalesced_conversation: {message['client_msg_id']} queued on {lease_key}")
+        return
+
+    messages = [message]
+    while True:
+        # Let the rest of a burst arrive before answering
+        if Config.THREAD_DEBOUNCE_SECONDS > 0:
+            time.sleep(Config.THREAD_DEBOUNCE_SECONDS)
+
+        # Drop messages edited or deleted while they were pending
+        cancel = CancelToken(messages + ThreadLease.drain(lease_key))
+        messages = cancel.refresh()
+
+        if messages:
+            first = min(messages, key=lambda m: m.get("ts", ""))
+            if len(messages) > 1:
+                print(f"coalesced_conversation: {len(messages)} messages merged")
+            answered = conversation(
+                say, ThreadLease.merge(messages), thread_ts, channel,
+                first["client_msg_id"], first["user"],
+                exclude_ids=[m["client_msg_id"] for m in messages], cancel=cancel,
+                files=ThreadLease.files(messages),
+            )
+            # Messages still current after a cancellation are answered in the next round
+            messages = [] if answered else cancel.remaining()
+
+        # Messages that arrived during generation get another round
+        if not messages and ThreadLease.release(lease_key):
+            return
 
 
 @app.event("app_mention")
@@ -469,29 +2617,86 @@ def handle_mention(body: Dict[str, Any], say: Say) -> None:
     event = body["event"]
     thread_ts = event.get("thread_ts", event.get("ts"))
     channel = event.get("channel")
-    client_msg_id = event.get("client_msg_id")
     user_id = event.get("user")
 
     # Check if the channel is allowed
-    if Config.ALLOWED_CHANNEL_IDS != "None":
-        allowed_channel_ids = Config.ALLOWED_CHANNEL_IDS.split(",")
-        if channel not in allowed_channel_ids:
-            first_channel = f"<#{allowed_channel_ids[0]}>"
+    if Config.ALLOWED_CHANNEL_SET:
+        if channel not in Config.ALLOWED_CHANNEL_SET:
+            first_channel = f"<#{Config.ALLOWED_CHANNEL_LIST[0]}>"
             message = Config.ALLOWED_CHANNEL_MESSAGE.format(first_channel)
             say(text=message, thread_ts=thread_ts)
             print(f"handle_mention: {message}")
             return
 
     # Extract query text (remove the bot mention)
-    prompt = re.sub(f"<@{get_bot_id()}>", "", event["text"]).strip()
+    prompt = re.sub(f"<@{get_bot_id()}>", "", event.get("text", "")).strip()
+
+    if ImageJob.is_command(prompt):
+        ImageJob.start(say, prompt, channel, thread_ts, user_id)
+        return
+
+    # Process the conversation, merged with quick follow-up messages in the thread
+    lease_key = ThreadLease.key(channel, event.get("thread_ts"), user_id)
+    coalesced_conversation(say, lease_key, ThreadLease.message(event, prompt), thread_ts, channel)
+
+
+def edited_question(event: Dict[str, Any], bot_id: str) -> Optional[Tuple[str, Dict[str, str], Optional[str]]]:
+    """Return the lease key, pending message and reply thread for an edited question
+
+    Edited DMs are always requeued; edited channel messages only when they still
+    mention the bot in an allowed channel.
+    """
+    message = event["message"]
+    channel = event["channel"]
+    user_id = message.get("user", "")
+
+    if event.get("channel_type") == "im":
+        text = message.get("text", "").strip()
+        return ThreadLease.key(channel, None, user_id), ThreadLease.message(message, text), None
+
+    mention = f"<@{bot_id}>"
+    if mention not in message.get("text", ""):
+        return None
+    if Config.ALLOWED_CHANNEL_SET and channel not in Config.ALLOWED_CHANNEL_SET:
+        return None
+
+    text = message["text"].replace(mention, "").strip()
+    thread_ts = message.get("thread_ts", message.get("ts"))
+    lease_key = ThreadLease.key(channel, message.get("thread_ts"), user_id)
+    return lease_key, ThreadLease.message(message, text), thread_ts
+
+
+def handle_message_edit(event: Dict[str, Any], say: Say) -> None:
+    """Cancel generations for an edited or deleted question and requeue the new text
+
+    Only questions still debounced or being answered are requeued; an edit of a
+    question that was already answered is ignored.
+    """
+    if event.get("subtype") == "message_deleted":
+        previous = event["previous_message"]
+        print(f"handle_message_edit: {previous['client_msg_id']} deleted")
+        CancelToken.cancel(previous["client_msg_id"], CancelToken.DELETED_VERSION)
+        return
 
-    # Process the conversation
-    conversation(say, prompt, thread_ts, channel, client_msg_id, user_id)
+    message = event["message"]
+    version = message.get("edited", {}).get("ts") or event.get("event_ts", "0")
+    print(f"handle_message_edit: {message['client_msg_id']} edited at {version}")
+    CancelToken.cancel(message["client_msg_id"], version)
+
+    question = edited_question(event, get_bot_id())
+    if question and ImageJob.is_command(question[1]["text"]):
+        print("handle_message_edit: image commands are not run again on edit")
+    elif question:
+        lease_key, pending, thread_ts = question
+        if ThreadLease.recent(message) or ThreadLease.in_flight(lease_key, pending["client_msg_id"]):
+            coalesced_conversation(say, lease_key, pending, thread_ts, event["channel"])
+        else:
+            print(f"handle_message_edit: {pending['client_msg_id']} was already answered, ignoring the edit")
 
 
 @app.event("message")
 def handle_message(body: Dict[str, Any], say: Say) -> None:
-    """Handle direct messages to the bot"""
+    """Handle direct messages to the bot, and edits or deletes of questions"""
     print(f"handle_message: {body}")
 
     event = body["event"]
@@ -500,13 +2705,21 @@ def handle_message(body: Dict[str, Any], say: Say) -> None:
     if event.get("bot_id"):
         return
 
+    if event.get("subtype") in EventRouter.EDIT_SUBTYPES:
+        handle_message_edit(event, say)
+        return
+
     channel = event["channel"]
-    client_msg_id = event["client_msg_id"]
     user_id = event.get("user")
-    prompt = event["text"].strip()
+    prompt = event.get("text", "").strip()
+
+    if ImageJob.is_command(prompt):
+        ImageJob.start(say, prompt, channel, None, user_id)
+        return
 
-    # Process the conversation (thread_ts=None for DMs)
-    conversation(say, prompt, None, channel, client_msg_id, user_id)
+    # Process the conversation (thread_ts=None for DMs), merged with quick follow-ups
+    lease_key = ThreadLease.key(channel, None, user_id)
+    coalesced_conversation(say, lease_key, ThreadLease.message(event, prompt), None, channel)
 
 
 def mask_account_number(account: str) -> str:
@@ -522,13 +2735,72 @@ def mask_account_number(account: str) -> str:
     return digits_only[:4] + '*' * (len(digits_only) - 6) + digits_only[-2:]
 
 
+def is_refund_message(blocks: List[Dict[str, Any]]) -> bool:
+    """Check if message blocks are a refund request (has the header)"""
+    for block in blocks:
+        if block.get("type") == "header":
+            header_text = block.get("text", {}).get("text", "")
+            if "환불 신청" in header_text:
+                return True
+    return False
+
+
+def format_kst_time(timestamp: Optional[float] = None) -> str:
+    """Format a Unix timestamp (default: now) the way refund messages show times, in KST"""
+    kst = timezone(timedelta(hours=9))
+    moment = datetime.fromtimestamp(timestamp, kst) if timestamp is not None else datetime.now(kst)
+    return moment.strftime("%Y. %m. %d. %p %I:%M:%S").replace("AM", "오전").replace("PM", "오후")
+
+
+def build_refund_blocks(blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Mask the account number and add the refund timestamp to refund message blocks"""
+    updated_blocks = []
+    refund_time_added = False
+    current_time = format_kst_time()
+
+    for block in blocks:
+        if block.get("type") == "section" and block.get("fields"):
+            new_fields = []
+            for field in block["fields"]:
+                field_text = field.get("text", "")
+
+                # Mask account number
+                if "*계좌번호:*" in field_text:
+                    lines = field_text.split("\n")
+                    if len(lines) >= 2:
+                        account = lines[1]
+                        masked = mask_account_number(account)
+                        field = {
+                            "type": "mrkdwn",
+                            "text": f"*계좌번호:*\n{masked}"
+                        }
+
+                new_fields.append(field)
+
+            # Add refund timestamp if not already present
+            has_refund_time = any("*환불일시:*" in f.get("text", "") for f in new_fields)
+            if not has_refund_time and not refund_time_added:
+                new_fields.append({
+                    "type": "mrkdwn",
+                    "text": f"*환불일시:*\n{current_time}"
+                })
+                refund_time_added = True
+
+            block = dict(block)
+            block["fields"] = new_fields
+
+        updated_blocks.append(block)
+
+    return updated_blocks
+
+
 def process_refund_done(channel: str, message_ts: str, user: str) -> None:
     """Process refund-done emoji reaction: mask account number and add refund timestamp"""
     print(f"process_refund_done: channel={channel}, message_ts={message_ts}, user={user}")
 
     try:
         # Get the original message
-        result = app.client.conversations_history(
+        result = slack_client().conversations_history(
             channel=channel,
             latest=message_ts,
             limit=1,
@@ -546,64 +2818,15 @@ def process_refund_done(channel: str, message_ts: str, user: str) -> None:
             print("No blocks found in message")
             return
 
-        # Check if this is a refund request message (has the header)
-        is_refund_message = False
-        for block in blocks:
-            if block.get("type") == "header":
-                header_text = block.get("text", {}).get("text", "")
-                if "환불 신청" in header_text:
-                    is_refund_message = True
-                    break
-
-        if not is_refund_message:
+        if not is_refund_message(blocks):
             print("Not a refund request message")
             return
 
-        # Process blocks to mask account number and add refund timestamp
-        updated_blocks = []
-        refund_time_added = False
-        # Convert to KST (UTC+9)
-        kst = timezone(timedelta(hours=9))
-        current_time = datetime.now(kst).strftime("%Y. %m. %d. %p %I:%M:%S").replace("AM", "오전").replace("PM", "오후")
-
-        for block in blocks:
-            if block.get("type") == "section" and block.get("fields"):
-                new_fields = []
-                for field in block["fields"]:
-                    field_text = field.get("text", "")
-
-                    # Mask account number
-                    if "*계좌번호:*" in field_text:
-                        lines = field_text.split("\n")
-                        if len(lines) >= 2:
-                            account = lines[1]
-                            masked = mask_account_number(account)
-                            field = {
-                                "type": "mrkdwn",
-                                "text": f"*계좌번호:*\n{masked}"
-                            }
-
-                    new_fields.append(field)
-
-                # Add refund timestamp if not already present
-                has_refund_time = any("*환불일시:*" in f.get("text", "") for f in new_fields)
-                if not has_refund_time and not refund_time_added:
-                    new_fields.append({
-                        "type": "mrkdwn",
-                        "text": f"*환불일시:*\n{current_time}"
-                    })
-                    refund_time_added = True
-
-                block = dict(block)
-                block["fields"] = new_fields
-
-            updated_blocks.append(block)
-
         # Update the message
-        app.client.chat_update(
+        slack_client().chat_update(
             channel=channel,
             ts=message_ts,
-            blocks=updated_blocks,
+            blocks=build_refund_blocks(blocks),
             text=message.get("text", "환불 신청이 처리되었습니다.")
         )
 
@@ -613,9 +2836,195 @@ def process_refund_done(channel: str, message_ts: str, user: str) -> None:
         print(f"Error processing refund done: {e}")
 
 
+class RatePacer:
+    """Spaces out calls shared by several threads to at most `rate` per second"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, deadline: Optional[float] = None) -> Optional[float]:
+        """Claim the next call slot and return the delay until it, or None if it falls after the deadline"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            if deadline is not None and slot > deadline:
+                return None
+            self._next = slot + self.interval
+        return slot - now
+
+    def wait(self, deadline: Optional[float] = None) -> bool:
+        """Block until the next call slot, or return False if that slot falls after the deadline"""
+        delay = self.reserve(deadline)
+        if delay is None:
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+
+class RefundBatch:
+    """
+    Processes every open refund request in a channel over a time range.
+
+    Messages are read with paginated conversations.history and requests that
+    already carry a refund timestamp are skipped, so a second run only picks up
+    what is left. Updates run on the pipeline pool paced to REFUND_BATCH_RATE
+    per second; updates that would start after the time budget are reported as
+    pending instead.
+    """
+    PAGE_SIZE = 200
+    RATE_LIMIT_RETRIES = 3
+
+    @staticmethod
+    def is_processed(blocks: List[Dict[str, Any]]) -> bool:
+        """Check if a refund request already has a refund timestamp"""
+        return any(
+            "*환불일시:*" in field.get("text", "")
+            for block in blocks
+            for field in block.get("fields") or []
+        )
+
+    @staticmethod
+    def time_range(latest: Optional[Any] = None, days: Optional[Any] = None) -> Tuple[str, str]:
+        """Return (oldest, latest) Slack timestamps covering `days` days up to `latest` (default: now)"""
+        latest_ts = float(latest) if latest else time.time()
+        days = Config.REFUND_BATCH_DAYS if days is None else float(days)
+        return f"{latest_ts - days * 86400:.6f}", f"{latest_ts:.6f}"
+
+    @staticmethod
+    def permalink(channel: str, ts: str) -> str:
+        """Build a Slack archive link for a message without an API call"""
+        return f"<https://slack.com/archives/{channel}/p{ts.replace('.', '')}|{ts}>"
+
+    @classmethod
+    def call(cls, method, **kwargs) -> Any:
+        """Call a Slack Web API method, waiting out rate limits"""
+        for attempt in range(cls.RATE_LIMIT_RETRIES + 1):
+            try:
+                return method(**kwargs)
+            except SlackApiError as e:
+                if e.response.status_code != 429 or attempt == cls.RATE_LIMIT_RETRIES:
+                    raise
+                delay = int(e.response.headers.get("Retry-After", 1))
+                print(f"RefundBatch: rate limited, retrying in {delay}s")
+                time.sleep(delay)
+
+    @classmethod
+    def scan(cls, channel: str, oldest: str, latest: str) -> Tuple[List[Dict[str, Any]], int]:
+        """Collect refund request messages in the range, along with the number of messages read"""
+        requests = []
+        scanned = 0
+        cursor = None
+        while True:
+            params = {"channel": channel, "oldest": oldest, "latest": latest,
+                      "inclusive": True, "limit": cls.PAGE_SIZE}
+            if cursor:
+                params["cursor"] = cursor
+            result = cls.call(slack_client().conversations_history, **params)
+
+            messages = result.get("messages") or []
+            scanned += len(messages)
+            requests.extend(m for m in messages if is_refund_message(m.get("blocks") or []))
+
+            cursor = (result.get("response_metadata") or {}).get("next_cursor")
+            if not result.get("has_more") or not cursor:
+                return requests, scanned
+
+    @classmethod
+    def update(cls, channel: str, message: Dict[str, Any], pacer: RatePacer,
+               deadline: float) -> Optional[bool]:
+        """Update one refund request; None if it was left for the next run"""
+        if not pacer.wait(deadline):
+            return None
+        try:
+            cls.call(
+                slack_client().chat_update,
+                channel=channel,
+                ts=message["ts"],
+                blocks=build_refund_blocks(message["blocks"]),
+                text=message.get("text", "환불 신청이 처리되었습니다."),
+            )
+            return True
+        except Exception as e:
+            print(f"Error updating refund message {message['ts']}: {e}")
+            return False
+
+    @classmethod
+    def run(cls, channel: str, oldest: str, latest: str,
+            budget: Optional[float] = None) -> Dict[str, Any]:
+        """Scan the range and update every open refund request, returning a report"""
+        started = time.monotonic()
+        deadline = started + (Config.REFUND_BATCH_BUDGET if budget is None else budget)
+
+        requests, scanned = cls.scan(channel, oldest, latest)
+        todo = [m for m in requests if not cls.is_processed(m["blocks"])]
+
+        pacer = RatePacer(Config.REFUND_BATCH_RATE)
+        futures = [
+            (message["ts"], pipeline_executor.submit(cls.update, channel, message, pacer, deadline))
+            for message in todo
+        ]
+
+        report = {
+            "channel": channel,
+            "oldest": oldest,
+            "latest": latest,
+            "scanned": scanned,
+            "requests": len(requests),
+            "already_done": len(requests) - len(todo),
+            "updated": [],
+            "failed": [],
+            "pending": [],
+        }
+        for ts, future in futures:
+            result = future.result()
+            key = "pending" if result is None else "updated" if result else "failed"
+            report[key].append(ts)
+        report["elapsed_ms"] = int((time.monotonic() - started) * 1000)
+
+        print(f"RefundBatch: {json.dumps(report)}")
+        return report
+
+    @classmethod
+    def format_report(cls, report: Dict[str, Any]) -> str:
+        """Render a batch report as a Slack message"""
+        period = f"{format_kst_time(float(report['oldest']))} ~ {format_kst_time(float(report['latest']))}"
+        lines = [
+            f"*환불 일괄 처리 결과* ({period})",
+            f"• 환불 신청: {report['requests']}건 (확인한 메시지 {report['scanned']}건)",
+            f"• 처리: {len(report['updated'])}건",
+            f"• 이미 처리됨: {report['already_done']}건",
+        ]
+        if report["failed"]:
+            links = ", ".join(cls.permalink(report["channel"], ts) for ts in report["failed"])
+            lines.append(f"• 실패: {len(report['failed'])}건 {links}")
+        if report["pending"]:
+            lines.append(f"• 남음: {len(report['pending'])}건 (시간 제한으로 멈췄습니다. 다시 실행하면 이어서 처리합니다.)")
+        return "\n".join(lines)
+
+
+def process_refund_batch(channel: str, message_ts: str, user: str) -> None:
+    """Process refund-done-all emoji reaction: handle open refund requests up to the reacted message"""
+    print(f"process_refund_batch: channel={channel}, message_ts={message_ts}, user={user}")
+
+    try:
+        oldest, latest = RefundBatch.time_range(message_ts)
+        report = RefundBatch.run(channel, oldest, latest)
+        slack_client().chat_postMessage(
+            channel=channel,
+            thread_ts=message_ts,
+            text=RefundBatch.format_report(report),
+        )
+    except Exception as e:
+        print(f"Error processing refund batch: {e}")
+
+
 # Reaction handlers mapping: emoji name -> handler function
 REACTION_HANDLERS = {
     "refund-done": lambda channel, ts, user: process_refund_done(channel, ts, user),
+    "refund-done-all": lambda channel, ts, user: process_refund_batch(channel, ts, user),
 }
 
 
@@ -630,8 +3039,7 @@ def handle_reaction_added(body: Dict[str, Any]) -> None:
     item = event.get("item", {})
 
     # Check if this reaction is in the allowed list
-    allowed_emojis = Config.get_reaction_emojis()
-    if reaction not in allowed_emojis:
+    if reaction not in Config.REACTION_EMOJI_SET:
         return
 
     # Get message details
@@ -671,18 +3079,135 @@ def unauthorized() -> Dict[str, Any]:
     }
 
 
-def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    """Main Lambda handler for Slack events"""
+def get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    """Get a request header case-insensitively from an API Gateway event"""
+    name = name.lower()
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+class EventRouter:
+    """Classifies parsed Slack event bodies without any network call"""
+
+    IGNORE = "ignore"
+    REJECT = "reject"
+    REACTION = "reaction"
+    MESSAGE = "message"
+    EDIT = "edit"
+    UNINSTALL = "uninstall"
+
+    # Message subtypes that carry a user question; joins, bot posts etc. are dropped
+    MESSAGE_SUBTYPES = frozenset({None, "thread_broadcast", "file_share"})
+    # Message subtypes that change or remove a question
+    EDIT_SUBTYPES = frozenset({"message_changed", "message_deleted"})
+    EVENT_TYPES = frozenset({"app_mention", "message"})
+    # Events that remove an OAuth installation
+    UNINSTALL_TYPES = frozenset({"app_uninstalled", "tokens_revoked"})
+
+    @classmethod
+    def route_edit(cls, event: Dict[str, Any]) -> str:
+        """Route an edit or delete; only user questions whose text changed matter"""
+        previous = event.get("previous_message") or {}
+        if event.get("subtype") == "message_deleted":
+            message = previous
+        else:
+            message = event.get("message") or {}
+            # Unfurls, reply counts etc. also arrive as message_changed
+            if message.get("text") == previous.get("text"):
+                return cls.IGNORE
+
+        if message.get("bot_id") or not message.get("client_msg_id") or not message.get("user"):
+            return cls.IGNORE
+        return cls.EDIT
+
+    @classmethod
+    def route(cls, body: Dict[str, Any]) -> str:
+        """Return the route for an event body"""
+        event = body.get("event")
+        if not event:
+            return cls.IGNORE
+
+        event_type = event.get("type", "")
+
+        if event_type == "reaction_added":
+            item = event.get("item", {})
+            if event.get("reaction") not in Config.REACTION_EMOJI_SET:
+                return cls.IGNORE
+            if item.get("type") != "message" or not item.get("channel") or not item.get("ts"):
+                return cls.IGNORE
+            return cls.REACTION
+
+        if event_type in cls.UNINSTALL_TYPES:
+            return cls.UNINSTALL if Config.is_multi_team() else cls.IGNORE
+
+        if event_type not in cls.EVENT_TYPES:
+            return cls.IGNORE
+
+        if event_type == "message" and event.get("subtype") in cls.EDIT_SUBTYPES:
+            return cls.route_edit(event)
+
+        if event.get("bot_id") or event.get("subtype") not in cls.MESSAGE_SUBTYPES:
+            return cls.IGNORE
+
+        # File uploads may come without a client_msg_id, they count when they carry images
+        if not (event.get("client_msg_id") or SlackImage.attachments(event)) or not event.get("user"):
+            return cls.IGNORE
+
+        if (event_type == "app_mention" and Config.ALLOWED_CHANNEL_SET
+                and event.get("channel") not in Config.ALLOWED_CHANNEL_SET):
+            return cls.REJECT
+
+        return cls.MESSAGE
+
+
+def dispatch(body: Dict[str, Any], event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Dispatch an already parsed and verified Slack request to the Bolt app"""
+    # Bolt only accepts a parsed body in socket mode, which differs from HTTP mode
+    # solely by skipping signature verification (already done in lambda_handler)
+    bolt_request = BoltRequest(
+        body=body,
+        query=event.get("queryStringParameters"),
+        headers=event.get("headers") or {},
+        mode="socket_mode",
+    )
+    if context is not None:
+        bolt_request.context["aws_lambda_function_name"] = context.function_name
+        bolt_request.context["aws_lambda_invoked_function_arn"] = context.invoked_function_arn
+    bolt_request.context["lambda_request"] = event
+
+    # Listeners act for the workspace of the event; Bolt answers uninstalled ones itself
+    with TeamRegistry.using(TeamRegistry.resolve(body)):
+        return to_aws_response(app.dispatch(bolt_request))
+
+
+def screen_slack_event(event: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any], str]:
+    """Parse, verify and route a Slack request without any network call
+
+    Returns an early response when the request needs no further processing,
+    otherwise None together with the parsed body and its route.
+    """
     # Validate required configuration
     if not Config.validate():
         return {
             "statusCode": 500,
             "headers": {"Content-type": "application/json"},
             "body": json.dumps({"status": "Error", "message": "Missing required configuration"}),
-        }
+        }, {}, EventRouter.IGNORE
 
-    # Parse request body
-    body = json.loads(event["body"])
+    # Acknowledge Slack retries of slow requests straight from the headers;
+    # the original delivery is still being processed
+    retry_num = get_header(event, "X-Slack-Retry-Num")
+    if retry_num and get_header(event, "X-Slack-Retry-Reason") == "http_timeout":
+        print(f"lambda_handler: retry {retry_num} acknowledged")
+        return success(), {}, EventRouter.IGNORE
+
+    # Parse request body once; Bolt dispatches the parsed dict
+    raw_body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        raw_body = base64.b64decode(raw_body).decode("utf-8")
+    body = json.loads(raw_body)
 
     # Handle Slack verification challenge
     if "challenge" in body:
@@ -690,33 +3215,54 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             "statusCode": 200,
             "headers": {"Content-type": "application/json"},
             "body": json.dumps({"challenge": body["challenge"]}),
-        }
+        }, body, EventRouter.IGNORE
+
+    # Verify the request signature before any I/O
+    if not signature_verifier.is_valid_request(raw_body, event.get("headers") or {}):
+        print("lambda_handler: invalid signature")
+        return unauthorized(), body, EventRouter.IGNORE
 
     print(f"lambda_handler: {body}")
 
-    # Check for valid event structure
-    if "event" not in body:
-        print("lambda_handler: event not found")
-        return success()
+    # Drop non-actionable events without touching DynamoDB or Slack
+    route = EventRouter.route(body)
+    if route == EventRouter.IGNORE:
+        print("lambda_handler: ignored event")
+        return success(), body, route
 
-    event_type = body["event"].get("type", "")
+    # Drop events this container has already handled
+    event_id = body.get("event_id")
+    if event_id and EventDeduplicator.is_duplicate(event_id):
+        print("lambda_handler: duplicate event_id detected")
+        return success(), body, route
 
-    # Handle reaction events directly (no client_msg_id, no deduplication needed)
-    if event_type == "reaction_added":
-        slack_handler = SlackRequestHandler(app=app)
-        return slack_handler.handle(event, context)
+    return None, body, route
 
-    # For message events, check client_msg_id
-    if "client_msg_id" not in body["event"]:
-        print("lambda_handler: client_msg_id not found")
-        return success()
+
+def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Main Lambda handler for Slack events"""
+    response, body, route = screen_slack_event(event)
+    if response is not None:
+        return response
+
+    # Mentions in other channels only get the allowed channel notice
+    if route == EventRouter.REJECT:
+        return dispatch(body, event, context)
+
+    # Reactions, edits and uninstalls have no new client_msg_id, so claim the event_id instead
+    if route in (EventRouter.REACTION, EventRouter.EDIT, EventRouter.UNINSTALL):
+        event_id = body.get("event_id")
+        if event_id and not DynamoDBManager.claim_event(event_id):
+            print("lambda_handler: duplicate event_id detected")
+            return success()
+        return dispatch(body, event, context)
 
     # Extract message identifiers
-    token = body["event"]["client_msg_id"]
+    token = ThreadLease.message_id(body["event"])
     user = body["event"]["user"]
 
     # Check for duplicate events (idempotency)
-    if DynamoDBManager.get_context(token, user) != "":
+    if EventDeduplicator.is_duplicate(token) or DynamoDBManager.has_context(token, user):
         print("lambda_handler: duplicate event detected")
         return success()
 
@@ -727,11 +3273,22 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         return success()
 
     # Store context to prevent duplicate processing
-    DynamoDBManager.put_context(token, user, body["event"]["text"])
+    DynamoDBManager.put_context(token, user)
 
     # Handle the Slack event
-    slack_handler = SlackRequestHandler(app=app)
-    return slack_handler.handle(event, context)
+    return dispatch(body, event, context)
+
+
+def oauth_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Install page and OAuth redirect that add a workspace to the installation store"""
+    if app.oauth_flow is None:
+        return {"statusCode": 404, "headers": {}, "body": "Not Found"}
+
+    request = to_bolt_request(event)
+    query = request.query or {}
+    if ("code" in query and "state" in query) or "error" in query:
+        return to_aws_response(app.oauth_flow.handle_callback(request))
+    return to_aws_response(app.oauth_flow.handle_installation(request))
 
 
 def kakao_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
@@ -764,9 +3321,61 @@ def kakao_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
     # Create prompt and get response
     try:
-        prompt = BedrockManager.create_prompt(None, query)
-        message = BedrockManager.invoke_agent(prompt)
+        trace = StageTrace("kakao_handler")
+        knowledge = trace.run("retrieve", BedrockManager.invoke_knowledge_base, query)
+        prompt = BedrockManager.create_prompt(query, knowledge=knowledge)
+        message, usage = trace.run("generate", BedrockManager.generate, query, prompt, knowledge=knowledge)
+        ConversationRecord.put(
+            f"kakao:{int(time.time() * 1000)}", query, message, prompt, trace.elapsed_ms(), usage=usage
+        )
+        print(trace.report())
         return success(message)
     except Exception as e:
         print(f"kakao_handler: error processing query: {e}")
         return success("죄송합니다. 응답을 생성하는 중 오류가 발생했습니다.")
+
+
+def image_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Run an image job handed over by ImageJob.start through an asynchronous invoke"""
+    print(f"image_handler: {event}")
+
+    team = TeamRegistry.get(event.get("enterprise_id"), event.get("team_id"), event.get("is_enterprise_install", False))
+    if team is None:
+        return {"status": "Skipped"}
+
+    # Errors are reported in the thread, so the invoke is never retried
+    with TeamRegistry.using(team):
+        if ImageJob.run(event):
+            return {"status": "Success"}
+    return {"status": "Error"}
+
+
+def refund_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Scheduled refund batch over REFUND_CHANNEL_ID (or the channel given in the event input)"""
+    print(f"refund_handler: {event}")
+
+    channel = event.get("channel") or Config.REFUND_CHANNEL_ID
+    if not channel or channel == "None":
+        print("refund_handler: no refund channel configured")
+        return {"status": "Skipped"}
+
+    # With OAuth the event input names the workspace of the channel
+    team = TeamRegistry.get(event.get("enterprise_id"), event.get("team_id"))
+    if team is None:
+        return {"status": "Skipped"}
+
+    # Leave room for the report before the Lambda timeout
+    budget = None
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        budget = min(Config.REFUND_BATCH_BUDGET, context.get_remaining_time_in_millis() / 1000 - 15)
+
+    try:
+        with TeamRegistry.using(team):
+            oldest, latest = RefundBatch.time_range(event.get("latest"), event.get("days"))
+            report = RefundBatch.run(channel, oldest, latest, budget)
+            if report["updated"] or report["failed"] or report["pending"]:
+                slack_client().chat_postMessage(channel=channel, text=RefundBatch.format_report(report))
+        return {"status": "Success", **report}
+    except Exception as e:
+        print(f"refund_handler: error: {e}")
+        return {"status": "Error", "message": str(e)}
@@ -0,0 +1,220 @@
+"""Application inference profiles for Bedrock models, resolved once and reused
+
+Shipped with the function and shared by handler.py, async_handler.py and the
+examples/bedrock scripts, so every Converse path calls the model through the
+same registry instead of creating a profile per call.
+"""
+
+import json
+import os
+import threading
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
+
+from botocore.exceptions import ClientError
+
+
+class JsonProfileStore:
+    """Resolved ARNs in a JSON file, so only the first run touches the control plane"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._profiles = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"JsonProfileStore: ignoring {self.path}: {e}")
+            return {}
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self._profiles, f, indent=2)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            print(f"JsonProfileStore: cannot write {self.path}: {e}")
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._profiles.get(key)
+        return entry["arn"] if entry else None
+
+    def put(self, key: str, arn: str) -> None:
+        self._profiles[key] = {"arn": arn}
+        self._save()
+
+    def delete(self, key: str) -> None:
+        self._profiles.pop(key, None)
+        self._save()
+
+
+class InferenceProfileRegistry:
+    """Resolves application inference profiles, creating them only when missing
+
+    Lookups go through an in-memory cache, then the store (a JsonProfileStore, or
+    anything with the same get, put and delete), then the Bedrock control plane:
+    a profile with the name, or one carrying all the tags for the same model, is
+    reused before a new one is created. A profile is only reused for the model
+    it serves: when the name is taken by another model, as after MODEL_ID
+    changes, the profile is found or created under profile_name instead.
+    Entries are keyed by name, model and region scope, so a different model is
+    never served from a stale ARN.
+    """
+
+    # Errors Converse answers for a profile that was deleted since it was stored.
+    # ValidationException is left out: a malformed request must not drop a live profile.
+    STALE_ERRORS = ("ResourceNotFoundException",)
+
+    def __init__(self, client: Any, region: str, store: Any = None):
+        """client is a boto3 "bedrock" client, store keeps resolved ARNs across restarts"""
+        self.client = client
+        self.region = region
+        self.store = store
+        self._profiles: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def key(self, model_id: str, name: Optional[str], cross_region: bool) -> str:
+        scope = "cross-region" if cross_region else "in-region"
+        return f"{name or ''}|{model_id}|{self.region}|{scope}"
+
+    def cached(self, model_id: str, name: Optional[str] = None, cross_region: bool = False) -> Optional[str]:
+        """Return the ARN to call for the model without any lookup, or None"""
+        if model_id.startswith("arn:"):
+            return model_id
+        return self._profiles.get(self.key(model_id, name, cross_region))
+
+    def resolve(self, model_id: str, name: Optional[str] = None, tags: Optional[List[Dict[str, str]]] = None,
+                cross_region: bool = False) -> str:
+        """Return the ARN of the named profile for the model, creating it if missing
+
+        Without a name, a profile carrying all the tags is looked up instead. With
+        cross_region, a new profile copies from the geography's cross-region profile.
+        """
+        arn = self.cached(model_id, name, cross_region)
+        if arn:
+            return arn
+
+        key = self.key(model_id, name, cross_region)
+        with self._lock:
+            arn = self._profiles.get(key)
+            if arn:
+                return arn
+
+            arn = self.store.get(key) if self.store else None
+            if arn is None:
+                arn = self.find_or_create(model_id, name, tags, cross_region)
+                if self.store:
+                    self.store.put(key, arn)
+            self._profiles[key] = arn
+            return arn
+
+    def invalidate(self, arn: str) -> None:
+        """Forget a profile that was deleted, so the next resolve finds or creates it again"""
+        with self._lock:
+            for key in [key for key, value in self._profiles.items() if value == arn]:
+                del self._profiles[key]
+                if self.store:
+                    self.store.delete(key)
+
+    @classmethod
+    def is_stale(cls, e: Exception) -> bool:
+        """Return True if Converse failed because the profile it was called with is gone"""
+        return isinstance(e, ClientError) and e.response["Error"]["Code"] in cls.STALE_ERRORS
+
+    def _list(self, type_equals: str) -> Iterator[Dict[str, Any]]:
+        kwargs = {"typeEquals": type_equals, "maxResults": 100}
+        while True:
+            response = self.client.list_inference_profiles(**kwargs)
+            yield from response.get("inferenceProfileSummaries", [])
+            if not response.get("nextToken"):
+                return
+            kwargs["nextToken"] = response["nextToken"]
+
+    def model_source(self, model_id: str, cross_region: bool = False) -> str:
+        """Return the ARN a profile for the model copies from
+
+        With cross_region, this is the system-defined profile of the region's
+        geography, such as "us.anthropic.claude-3-5-sonnet-20240620-v1:0".
+        Models without one fall back to the foundation model.
+        """
+        if cross_region:
+            geography = self.region.split("-")[0]
+            geography = "apac" if geography == "ap" else geography
+            for profile in self._list("SYSTEM_DEFINED"):
+                if profile["inferenceProfileId"] == f"{geography}.{model_id}":
+                    return profile["inferenceProfileArn"]
+            print(f"InferenceProfileRegistry: no cross-region profile for {model_id} in {self.region}")
+        return f"arn:aws:bedrock:{self.region}::foundation-model/{model_id}"
+
+    @staticmethod
+    def profile_name(name: str, model_id: str) -> str:
+        """Return the name of the model's profile when the name is taken by another model"""
+        suffix = uuid.uuid5(uuid.NAMESPACE_URL, model_id).hex[:12]
+        return f"{name[:51].rstrip(' _-')}-{suffix}"
+
+    def find(self, name: Optional[str] = None, tags: Optional[List[Dict[str, str]]] = None,
+             model_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Return an active application profile for the model by name, or else by tags, or None"""
+        names = {name, self.profile_name(name, model_id)} if name and model_id else {name}
+        wanted = {tag["key"]: tag["value"] for tag in tags or []}
+        for profile in self._list("APPLICATION"):
+            if profile.get("status", "ACTIVE") != "ACTIVE" or not self._serves(profile, model_id):
+                continue
+            if name and profile["inferenceProfileName"] in names:
+                return profile
+            if wanted and not name:
+                response = self.client.list_tags_for_resource(resourceARN=profile["inferenceProfileArn"])
+                found = {tag["key"]: tag["value"] for tag in response.get("tags", [])}
+                if wanted.items() <= found.items():
+                    return profile
+        return None
+
+    def find_or_create(self, model_id: str, name: Optional[str] = None,
+                       tags: Optional[List[Dict[str, str]]] = None, cross_region: bool = False) -> str:
+        """Return the ARN of a profile for the model from the control plane, creating one if missing"""
+        profile = self.find(name, tags, model_id)
+        if profile is not None:
+            return profile["inferenceProfileArn"]
+
+        source = self.model_source(model_id, cross_region)
+        if not name:
+            return self._create(f"gurumi-{uuid.uuid5(uuid.NAMESPACE_URL, source).hex[:12]}", source, tags, model_id)
+        try:
+            return self._create(name, source, tags, model_id)
+        except ClientError as e:
+            # The name is taken by a profile of another model
+            if e.response["Error"]["Code"] != "ConflictException":
+                raise
+            print(f"InferenceProfileRegistry: {name} serves another model than {model_id}")
+            return self._create(self.profile_name(name, model_id), source, tags, model_id)
+
+    @staticmethod
+    def _serves(profile: Dict[str, Any], model_id: Optional[str]) -> bool:
+        return model_id is None or any(
+            model["modelArn"].endswith("/" + model_id) for model in profile.get("models", [])
+        )
+
+    def _create(self, name: str, source: str, tags: Optional[List[Dict[str, str]]], model_id: str) -> str:
+        try:
+            response = self.client.create_inference_profile(
+                inferenceProfileName=name,
+                description="gurumi-ai-bot Inference Profile",
+                clientRequestToken=str(uuid.uuid5(uuid.NAMESPACE_URL, name + source)),
+                modelSource={"copyFrom": source},
+                tags=tags or [],
+            )
+            print(f"InferenceProfileRegistry: created {name} from {source}")
+            return response["inferenceProfileArn"]
+        except ClientError as e:
+            # Another process created it since the lookup
+            if e.response["Error"]["Code"] != "ConflictException":
+                raise
+            profile = self.find(name, model_id=model_id)
+            if profile is None:
+                raise
+            return profile["inferenceProfileArn"]